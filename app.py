@@ -1,9 +1,34 @@
 import streamlit as st
-import numpy as np
-from PIL import Image, ImageChops
+from PIL import Image
 import pandas as pd
+import os
 from datetime import date
 
+from geoscan import AnalysisParams, analyze, content_hash, default_cache
+from geoscan.modes import MODES, RESAMPLE_FILTERS, mode_by_label
+from geoscan.spectral import BAND_MAPS, INDICES
+from geoscan.heatmap import COLORMAPS, render_heatmap
+from geoscan.blocks import BLOCK_SIZES, DEFAULT_BLOCK_SIZE
+from geoscan.pyramid import window_around
+from geoscan.progress import STAGES, ProgressRelay
+from geoscan.admission import default_pool
+from geoscan.ingest import MAX_UPLOAD_BYTES, admit
+from geoscan.stats import CHANGED_LEVEL, DEFAULT_PERCENTILE, THRESHOLDS, rebin_histogram
+from geoscan.radiometry import NORMALIZATIONS
+from geoscan.report import Reports
+from geoscan.store import default_store
+from geoscan.telemetry import StageRecorder, current_rss, default_telemetry, peak_rss, serve, total_memory
+from geoscan.timeseries import SceneStack, scene_label
+
+# Ширина колонки превью в физических пикселях (треть широкой раскладки на HiDPI-экране)
+DISPLAY_WIDTH = 800
+
+# Сторона фрагмента детального просмотра в полном разрешении
+INSPECT_SIZE = 512
+
+# Порт HTTP-метрик Prometheus для локального сборщика; без переменной сервер не запускается
+METRICS_PORT = int(os.environ.get("GEOSCAN_METRICS_PORT", 0))
+
 # ========== НАСТРОЙКА СТРАНИЦЫ ==========
 st.set_page_config(
     page_title="🛰️ GEO SCAN PRO | Мониторинг Земли",
@@ -399,6 +424,14 @@ with st.sidebar:
     # Параметры анализа
     st.markdown("### ⚙️ **ПАРАМЕТРЫ АНАЛИЗА**")
     
+    comparison = st.radio(
+        "**Тип сравнения**",
+        ["Пара снимков", "Временной ряд"],
+        horizontal=True,
+        help="Временной ряд: последовательные и накопленные изменения по N снимкам"
+    )
+    series_mode = comparison == "Временной ряд"
+    
     threshold = st.slider(
         "**Порог обнаружения аномалий (%)**",
         min_value=0.1,
@@ -408,14 +441,116 @@ with st.sidebar:
         help="Регулирует чувствительность системы"
     )
     
+    threshold_labels = {"Вручную": None}
+    threshold_labels.update({item.label: item.key for item in THRESHOLDS.values()})
+    threshold_choice = st.selectbox(
+        "**Уровень изменений**",
+        list(threshold_labels),
+        index=0,
+        help="Вручную — порог сравнивается со средней разницей снимков. Автоматически — по гистограмме "
+             "разницы выбирается уровень, выше которого пиксель считается изменённым, и порог "
+             "сравнивается с долей таких пикселей"
+    )
+    threshold_method = threshold_labels[threshold_choice]
+    percentile_q = DEFAULT_PERCENTILE
+    if threshold_method:
+        st.caption(THRESHOLDS[threshold_method].description)
+    if threshold_method == "percentile":
+        percentile_q = st.slider("**Перцентиль разницы**", min_value=90.0, max_value=99.9,
+                                 value=DEFAULT_PERCENTILE, step=0.1)
+    # Выбранный уровень известен только после анализа — показывается здесь же, у ползунка
+    auto_threshold_note = st.empty()
+    
+    anomaly_rule = st.radio(
+        "**Правило аномалии**",
+        ["По всей сцене", "По любому блоку"],
+        horizontal=True,
+        help="По любому блоку: порог сравнивается с долей изменений каждого квадрата кадра, "
+             "и локальное изменение не теряется в среднем по большой сцене"
+    )
+    block_size = st.select_slider(
+        "**Размер блока, пикс**",
+        options=list(BLOCK_SIZES),
+        value=DEFAULT_BLOCK_SIZE
+    )
+    show_grid = st.toggle("Сетка блоков на карте изменений", value=False)
+    # Сторона блока для правила аномалии; None — доля изменений всей сцены
+    rule_block = block_size if anomaly_rule == "По любому блоку" else None
+    
     # Дополнительные настройки
     analysis_mode = st.selectbox(
         "**Режим анализа**",
-        ["Стандартный", "Высокая точность", "Быстрый анализ"],
+        [mode.label for mode in MODES.values()],
         index=0
     )
+    st.caption(mode_by_label(analysis_mode).tradeoff)
+    
+    resample_labels = {
+        "По режиму": None,
+        "Ближайший сосед": RESAMPLE_FILTERS['nearest'],
+        "Билинейный": RESAMPLE_FILTERS['bilinear'],
+        "Бикубический": RESAMPLE_FILTERS['bicubic'],
+        "Ланцош": RESAMPLE_FILTERS['lanczos'],
+    }
+    resample_filter = st.selectbox(
+        "**Фильтр выравнивания**",
+        list(resample_labels),
+        index=0,
+        help="Применяется, только если снимки разного размера"
+    )
+    
+    index_labels = {index.label: index.key for index in INDICES.values()}
+    change_measure = st.selectbox(
+        "**Показатель изменений**",
+        ["Яркость (RGB)"] + list(index_labels),
+        index=0,
+        help="Спектральные индексы считаются по многоканальным TIFF"
+    )
+    
+    band_labels = {band_map.label: band_map.key for band_map in BAND_MAPS.values()}
+    band_order = st.selectbox(
+        "**Порядок каналов**",
+        list(band_labels),
+        index=0,
+        help="Для многоканальных снимков Sentinel-2 и Landsat"
+    )
+    
+    register_scenes = st.toggle(
+        "Совмещение снимков",
+        value=True,
+        help="Оценка сдвига снимка «после» фазовой корреляцией и его компенсация перед сравнением"
+    )
+    
+    normalization_labels = {"Без нормализации": None}
+    normalization_labels.update({item.label: item.key for item in NORMALIZATIONS.values()})
+    normalization = st.selectbox(
+        "**Радиометрическая нормализация**",
+        list(normalization_labels),
+        index=0,
+        help="Приводит яркости снимка «после» к снимку «до», чтобы сезонная разница "
+             "освещённости не считалась изменением. Для спектральных индексов не применяется"
+    )
+    if normalization_labels[normalization]:
+        st.caption(NORMALIZATIONS[normalization_labels[normalization]].description)
     
     show_heatmap = st.toggle("Показать тепловую карту", value=True)
+    colormap_labels = {colormap.label: colormap.key for colormap in COLORMAPS.values()}
+    heatmap_palette = st.selectbox(
+        "**Палитра тепловой карты**",
+        list(colormap_labels),
+        index=0,
+        disabled=not show_heatmap
+    )
+    heatmap_gain = st.slider(
+        "**Усиление тепловой карты**",
+        min_value=0.5,
+        max_value=10.0,
+        value=1.0,
+        step=0.5,
+        disabled=not show_heatmap,
+        help="Во сколько раз растягивается шкала разницы перед раскраской: слабые изменения становятся заметнее"
+    )
+    heatmap_style = {"colormap": colormap_labels[heatmap_palette], "gain": heatmap_gain}
     
     st.markdown("---")
     
@@ -449,17 +584,10 @@ with st.sidebar:
     </div>
     """, unsafe_allow_html=True)
     
-    # Статус системы
+    # Статус системы: заполняется в конце скрипта, когда анализ этого перезапуска уже измерен
     st.markdown("---")
     st.markdown("### 📊 **СТАТУС СИСТЕМЫ**")
-    
-    col_stat1, col_stat2, col_stat3 = st.columns(3)
-    with col_stat1:
-        st.metric("Процессор", "15%", delta="↓ 2%")
-    with col_stat2:
-        st.metric("Память", "68%", delta="↑ 5%")
-    with col_stat3:
-        st.metric("Сеть", "24%", delta="→")
+    status_panel = st.empty()
 
 # ========== ОСНОВНОЙ ИНТЕРФЕЙС ==========
 # Главный заголовок с анимацией
@@ -512,77 +640,282 @@ st.markdown("---")
 st.markdown("### 📤 **ЗАГРУЗКА СПУТНИКОВЫХ СНИМКОВ**")
 
 # Красивые карточки для загрузки
-col_upload1, col_upload2 = st.columns(2)
+img1 = img2 = None
+scenes = []
+if series_mode:
+    st.markdown("#### 🗓️ **СНИМКИ ВРЕМЕННОГО РЯДА**")
+    st.markdown("*Порядок — по имени файла; дата вида 2024-05-31 или 20240531 в имени становится подписью*")
+    scenes = st.file_uploader(
+        "Перетащите или выберите файлы",
+        type=['png', 'jpg', 'jpeg', 'tiff', 'tif'],
+        key="scenes",
+        accept_multiple_files=True,
+        label_visibility="collapsed",
+        help="Новый снимок в конце ряда считается без пересчёта предыдущих"
+    ) or []
+    if scenes:
+        st.success(f"✅ **Загружено снимков: {len(scenes)}**")
+else:
+    col_upload1, col_upload2 = st.columns(2)
 
-with col_upload1:
-    with st.container():
-        st.markdown("#### 📅 **СНИМОК 'ДО'**")
-        st.markdown("*Ранний период наблюдения*")
-        img1 = st.file_uploader(
-            "Перетащите или выберите файл",
-            type=['png', 'jpg', 'jpeg', 'tiff', 'tif'],
-            key="img1",
-            label_visibility="collapsed",
-            help="Поддерживаются форматы: PNG, JPG, TIFF"
-        )
-        if img1:
-            st.success("✅ **Файл успешно загружен**")
-            file_details = {"Имя файла": img1.name, "Тип файла": img1.type}
-            st.json(file_details, expanded=False)
+    with col_upload1:
+        with st.container():
+            st.markdown("#### 📅 **СНИМОК 'ДО'**")
+            st.markdown("*Ранний период наблюдения*")
+            img1 = st.file_uploader(
+                "Перетащите или выберите файл",
+                type=['png', 'jpg', 'jpeg', 'tiff', 'tif'],
+                key="img1",
+                label_visibility="collapsed",
+                help="Поддерживаются форматы: PNG, JPG, TIFF"
+            )
+            if img1:
+                st.success("✅ **Файл успешно загружен**")
+                file_details = {"Имя файла": img1.name, "Тип файла": img1.type}
+                st.json(file_details, expanded=False)
 
-with col_upload2:
-    with st.container():
-        st.markdown("#### 📅 **СНИМОК 'ПОСЛЕ'**")
-        st.markdown("*Поздний период наблюдения*")
-        img2 = st.file_uploader(
-            "Перетащите или выберите файл",
-            type=['png', 'jpg', 'jpeg', 'tiff', 'tif'],
-            key="img2",
-            label_visibility="collapsed",
-            help="Рекомендуется одинаковый размер с первым снимком"
-        )
-        if img2:
-            st.success("✅ **Файл успешно загружен**")
-            file_details = {"Имя файла": img2.name, "Тип файла": img2.type}
-            st.json(file_details, expanded=False)
+    with col_upload2:
+        with st.container():
+            st.markdown("#### 📅 **СНИМОК 'ПОСЛЕ'**")
+            st.markdown("*Поздний период наблюдения*")
+            img2 = st.file_uploader(
+                "Перетащите или выберите файл",
+                type=['png', 'jpg', 'jpeg', 'tiff', 'tif'],
+                key="img2",
+                label_visibility="collapsed",
+                help="Рекомендуется одинаковый размер с первым снимком"
+            )
+            if img2:
+                st.success("✅ **Файл успешно загружен**")
+                file_details = {"Имя файла": img2.name, "Тип файла": img2.type}
+                st.json(file_details, expanded=False)
 
 st.markdown("---")
 
 # ========== АНАЛИЗ И ВИЗУАЛИЗАЦИЯ ==========
-if img1 and img2:
-    # Прогресс-бар с анимацией
+def queue_status(relay, status_text):
+    """Ожидание в общем пуле: место в очереди, а во время расчёта — ход из потока пула."""
+    def on_wait(position):
+        if position:
+            status_text.text(
+                f"⏳ В очереди на анализ: {position}-й · выполняется {default_pool.running} "
+                f"из {default_pool.workers}, занято {default_pool.in_flight_bytes / 1024 ** 2:.0f} "
+                f"из {default_pool.max_bytes / 1024 ** 2:.0f} МБ"
+            )
+        else:
+            relay.replay()
+    return on_wait
+
+
+def upload_hashes(*uploads):
+    """SHA-256 загрузок, посчитанные один раз на файл: перезапуск скрипта не хэширует их заново."""
+    known = st.session_state.get("upload_hashes", {})
+    hashes = {upload.file_id: known.get(upload.file_id) or content_hash(upload) for upload in uploads}
+    st.session_state["upload_hashes"] = hashes
+    return [hashes[upload.file_id] for upload in uploads]
+
+
+def render_series(stack, threshold, show_heatmap, heatmap_style, threshold_method=None, percentile_q=DEFAULT_PERCENTILE):
+    """Таблица по датам, график тренда и карты выбранного шага временного ряда."""
+    steps = stack.steps
+    
+    def measure(step):
+        # Доля изменений шага, которая сравнивается с порогом
+        if threshold_method is None:
+            return step.change_percent
+        return step.consecutive.changed_share(step.consecutive.auto_level(threshold_method, percentile_q))
+    
+    st.markdown("### 📈 **ДИНАМИКА ИЗМЕНЕНИЙ ПО ДАТАМ**")
+    series_df = pd.DataFrame({
+        "Дата": [step.label for step in steps],
+        "К предыдущему снимку, %": [round(step.change_percent, 2) for step in steps],
+        "Накопленные, %": [round(step.cumulative_percent, 2) for step in steps],
+        "Изменённых пикселей": [step.consecutive.changed_pixels for step in steps],
+        "Сдвиг (x; y)": [
+            "{:+d}; {:+d}".format(*step.registration.offset) if step.registration else "—" for step in steps
+        ],
+        "Статус": ["⚠️ АНОМАЛИЯ" if measure(step) > threshold else "✅ НОРМА" for step in steps],
+    })
+    if threshold_method is not None:
+        series_df.insert(
+            3, "Выше автоматического уровня, %", [round(measure(step), 2) for step in steps]
+        )
+    
+    col_table, col_chart = st.columns([2, 3])
+    with col_table:
+        st.dataframe(series_df, use_container_width=True, hide_index=True)
+        st.download_button(
+            label="⬇️ Таблица CSV",
+            data=series_df.to_csv(index=False).encode('utf-8'),
+            file_name=f"time_series_{date.today()}.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
+    with col_chart:
+        import plotly.express as px
+        trend = series_df.melt(
+            id_vars="Дата",
+            value_vars=["К предыдущему снимку, %", "Накопленные, %"],
+            var_name="Показатель",
+            value_name="Изменения, %"
+        )
+        fig = px.line(
+            trend,
+            x="Дата",
+            y="Изменения, %",
+            color="Показатель",
+            markers=True,
+            title="Тренд изменений",
+            color_discrete_sequence=['#00ffff', '#ff0080']
+        )
+        fig.add_hline(y=threshold, line_dash="dash", line_color="#ffaa00", annotation_text="Порог")
+        fig.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            font_color='#ffffff'
+        )
+        st.plotly_chart(fig, use_container_width=True)
+    
+    st.markdown("### 🖼️ **КАРТЫ ИЗМЕНЕНИЙ**")
+    labels = [step.label for step in steps]
+    selected = st.select_slider("Дата", options=labels, value=labels[-1]) if len(labels) > 1 else labels[0]
+    step = steps[labels.index(selected)]
+    before, after = stack.frames[step.index - 1], stack.frames[step.index]
+    
+    col_prev, col_curr, col_step, col_total = st.columns(4)
+    with col_prev:
+        st.markdown(f"#### **{before.label}**")
+        st.image(before.overview.level_for(DISPLAY_WIDTH), use_container_width=True)
+    with col_curr:
+        st.markdown(f"#### **{after.label}**")
+        st.image(after.overview.level_for(DISPLAY_WIDTH), use_container_width=True)
+    for column, title, overview in (
+        (col_step, "К ПРЕДЫДУЩЕМУ", step.overview_consecutive),
+        (col_total, "НАКОПЛЕННЫЕ", step.overview_cumulative),
+    ):
+        with column:
+            st.markdown(f"#### **{title}**")
+            diff_view = overview.level_for(DISPLAY_WIDTH)
+            st.image(render_heatmap(diff_view, **heatmap_style) if show_heatmap else diff_view, use_container_width=True)
+    st.caption(
+        f"📏 **Размер ряда:** {stack.frames[0].overview.size[0]}×{stack.frames[0].overview.size[1]} пикселей · "
+        "накопленная карта — максимум изменений по всем шагам до выбранной даты"
+    )
+
+
+if series_mode and len(scenes) >= 2:
+    # Ряд живёт в сессии: новый снимок в конце — одно декодирование и одна разница
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    
+    params = AnalysisParams.for_mode(
+        mode_by_label(analysis_mode).key,
+        index=index_labels.get(change_measure),
+        bands=band_labels[band_order],
+        register=register_scenes,
+        normalize=normalization_labels[normalization],
+        resample=resample_labels[resample_filter]
+    )
+    stack = st.session_state.get("scene_stack")
+    if stack is None or stack.params != params:
+        stack = st.session_state["scene_stack"] = SceneStack(params)
+    
+    # Снимки считаются в общем пуле, а показываются из потока сессии
+    relay = ProgressRelay()
+    
+    def scene_progress(position, total):
+        def show(fraction, label, elapsed):
+            overall = (position + fraction) / total
+            progress_bar.progress(min(int(overall * 100), 100))
+            status_text.text(f"🔍 Снимок {position + 1} из {total}: {label}... {overall:.0%}")
+        recorder = StageRecorder(relay.wrap(show))
+        scene_recorders.append(recorder)
+        return recorder
+    
+    ordered = sorted(scenes, key=lambda scene: scene.name)
+    scene_recorders = []
+    try:
+        computed = stack.sync(
+            [(scene_label(scene.name), scene) for scene in ordered], scene_progress,
+            pool=default_pool, on_wait=queue_status(relay, status_text), keys=upload_hashes(*ordered)
+        )
+    except ValueError as error:
+        st.session_state.pop("scene_stack", None)
+        progress_bar.empty()
+        status_text.empty()
+        st.error(f"❌ **{error}**")
+        st.stop()
+    width, height = stack.frames[0].image.size
+    for recorder in scene_recorders:
+        recorder.finish()
+        default_telemetry.record(recorder, "series", params.mode, width * height / 1e6)
+    progress_bar.progress(100)
+    status_text.text(f"✅ Ряд из {len(stack)} снимков, пересчитано: {computed}")
+    
+    render_series(stack, threshold, show_heatmap, heatmap_style, threshold_method, percentile_q)
+
+elif img1 and img2:
+    # Прогресс-бар: обновляется по реальным этапам конвейера
     progress_bar = st.progress(0)
     status_text = st.empty()
     
-    for i in range(101):
-        progress_bar.progress(i)
-        status_text.text(f"🔍 **ВЫПОЛНЯЕТСЯ АНАЛИЗ... {i}%**")
-        if i == 25:
-            status_text.text("🔍 **ЗАГРУЗКА ИЗОБРАЖЕНИЙ... 25%**")
-        elif i == 50:
-            status_text.text("🔍 **ВЫЧИСЛЕНИЕ РАЗЛИЧИЙ... 50%**")
-        elif i == 75:
-            status_text.text("🔍 **АНАЛИЗ АНОМАЛИЙ... 75%**")
-        elif i == 100:
-            status_text.text("✅ **АНАЛИЗ ЗАВЕРШЁН!**")
-    
-    # Имитация обработки
-    import time
-    time.sleep(0.5)
-    
-    # Загрузка и подготовка изображений
-    image1 = Image.open(img1).convert('RGB')
-    image2 = Image.open(img2).convert('RGB')
-    image2 = image2.resize(image1.size)
-    
-    img1_array = np.array(image1)
-    img2_array = np.array(image2)
-    
-    # Анализ различий
-    diff = ImageChops.difference(image1, image2).convert('L')
-    diff_array = np.array(diff)
-    change_percent = (np.mean(diff_array) / 255.0) * 100
-    similarity = 100 - change_percent
+    def show_progress(fraction, label, elapsed):
+        progress_bar.progress(int(fraction * 100))
+        if fraction >= 1:
+            status_text.text(f"✅ {label}! ({elapsed:.1f} с)")
+        else:
+            status_text.text(f"🔍 {label}... {fraction:.0%} ({elapsed:.1f} с)")
+    
+    # Расчёт идёт в общем пуле: ход оттуда показывается из потока сессии
+    relay = ProgressRelay()
+    progress = StageRecorder(relay.wrap(show_progress))
+    
+    # Анализ различий (результат кэшируется по содержимому снимков)
+    params = AnalysisParams.for_mode(
+        mode_by_label(analysis_mode).key,
+        index=index_labels.get(change_measure),
+        bands=band_labels[band_order],
+        register=register_scenes,
+        normalize=normalization_labels[normalization],
+        resample=resample_labels[resample_filter]
+    )
+    try:
+        # Размеры кадров — по заголовкам, до декодирования: большое уходит в предпросмотр
+        admission = admit(img1, img2, params, max_file_bytes=MAX_UPLOAD_BYTES,
+                          max_bytes=default_pool.max_bytes)
+        params = admission.params
+        result = analyze(
+            img1, img2, params, progress=progress, store=default_store,
+            pool=default_pool, on_wait=queue_status(relay, status_text), hashes=upload_hashes(img1, img2)
+        )
+        relay.replay()
+    except ValueError as error:
+        progress_bar.empty()
+        status_text.empty()
+        st.error(f"❌ **{error}**")
+        st.stop()
+    stats = result.stats
+    change_percent = result.change_percent
+    similarity = result.similarity
+    # Автоматический уровень: изменены пиксели выше него, порог — на их долю
+    level = stats.auto_level(threshold_method, percentile_q) if threshold_method else None
+    share = level is not None
+    if share:
+        auto_threshold_note.caption(
+            f"🎯 **{threshold_choice}:** уровень {level} из 255 — изменено "
+            f"{stats.changed_share(level):.2f}% пикселей"
+        )
+    grid = result.grid(block_size, level if share else CHANGED_LEVEL)
+    # Доля изменений, которая сравнивается с порогом: сцены или самого изменённого блока
+    scene_measure = result.change_measure(None, level)
+    measured = result.change_measure(rule_block, level)
+    anomaly = measured > threshold
+    measured_label = f"в худшем блоке {grid.block_size} пикс" if rule_block else "по сцене"
+    reports = st.session_state.get("reports")
+    if reports is None or reports.result is not result:
+        reports = st.session_state["reports"] = Reports(result)
+    
+    progress.stage('render')
     
     # ========== ВИЗУАЛИЗАЦИЯ РЕЗУЛЬТАТОВ ==========
     st.markdown("### 🖼️ **ВИЗУАЛИЗАЦИЯ РЕЗУЛЬТАТОВ**")
@@ -593,31 +926,65 @@ if img1 and img2:
     with col_img1:
         with st.container():
             st.markdown("#### **СНИМОК 'ДО'**")
-            st.image(image1, use_container_width=True)
-            st.caption(f"📏 **Размер:** {image1.size[0]}×{image1.size[1]} пикселей")
+            st.image(result.overview1.level_for(DISPLAY_WIDTH), use_container_width=True)
+            st.caption(f"📏 **Размер:** {result.overview1.size[0]}×{result.overview1.size[1]} пикселей")
     
     with col_img2:
         with st.container():
             st.markdown("#### **СНИМОК 'ПОСЛЕ'**")
-            st.image(image2, use_container_width=True)
-            st.caption(f"📏 **Размер:** {image2.size[0]}×{image2.size[1]} пикселей")
+            st.image(result.overview2.level_for(DISPLAY_WIDTH), use_container_width=True)
+            st.caption(f"📏 **Размер:** {result.overview2.size[0]}×{result.overview2.size[1]} пикселей")
     
     with col_img3:
         with st.container():
             st.markdown("#### **КАРТА ИЗМЕНЕНИЙ**")
             
-            # Создаём цветную тепловую карту
+            diff_view = result.overview_diff.level_for(DISPLAY_WIDTH)
+            shown_map = render_heatmap(diff_view, **heatmap_style) if show_heatmap else diff_view
+            if show_grid:
+                # Сетка рисуется по блокам в размере обзора — цена не зависит от размера сцены
+                shown_map = Image.alpha_composite(
+                    shown_map.convert("RGBA"), grid.overlay(shown_map.size, result.size, threshold, share)
+                )
+            st.image(shown_map, use_container_width=True)
             if show_heatmap:
-                heatmap = diff.convert('RGB')
-                heatmap_array = np.array(heatmap)
-                # Усиливаем красный канал для тепловой карты
-                heatmap_array[:, :, 0] = np.clip(diff_array * 2, 0, 255)
-                heatmap = Image.fromarray(heatmap_array)
-                st.image(heatmap, use_container_width=True)
-                st.caption("🔥 **Тепловая карта:** Красный = максимальные изменения")
+                st.caption(f"🔥 **Тепловая карта:** {heatmap_palette}, усиление ×{heatmap_gain:g}")
             else:
-                st.image(diff, use_container_width=True)
                 st.caption("⚫ **Чёрно-белая карта:** Белый = изменения")
+            if show_grid:
+                st.caption(
+                    f"🧩 **Сетка {grid.shape[1]}×{grid.shape[0]} блоков по {grid.block_size} пикс:** "
+                    f"выше порога {grid.blocks_above(threshold, share)}"
+                )
+    
+    if admission.preview:
+        st.warning(f"⚡ **Режим предпросмотра:** {admission.reason} — анализ выполнен в режиме "
+                   f"«{MODES[params.mode].label}»")
+    if result.screened:
+        st.info("⚡ **Быстрый анализ:** предварительный скрининг не выявил изменений, детальный расчёт пропущен")
+    elif result.scale > 1:
+        st.caption(f"⚡ Карта изменений рассчитана с прореживанием 1:{result.scale}")
+    
+    # Полное разрешение загружается только по запросу и только для фрагмента
+    with st.expander("🔍 **ДЕТАЛЬНЫЙ ПРОСМОТР В ПОЛНОМ РАЗРЕШЕНИИ**"):
+        if st.toggle("Загрузить фрагмент", value=False):
+            col_x, col_y = st.columns(2)
+            with col_x:
+                center_x = st.slider("Центр по горизонтали (%)", 0, 100, 50)
+            with col_y:
+                center_y = st.slider("Центр по вертикали (%)", 0, 100, 50)
+            
+            box = window_around(result.overview1.size, center_x / 100, center_y / 100, INSPECT_SIZE)
+            st.caption(f"Фрагмент: x {box[0]}–{box[2]}, y {box[1]}–{box[3]}")
+            
+            col_zoom1, col_zoom2, col_zoom3 = st.columns(3)
+            with col_zoom1:
+                st.image(result.overview1.region(box), use_container_width=True)
+            with col_zoom2:
+                st.image(result.overview2.region(box), use_container_width=True)
+            with col_zoom3:
+                diff_region = result.overview_diff.region(box)
+                st.image(render_heatmap(diff_region, **heatmap_style) if show_heatmap else diff_region, use_container_width=True)
     
     st.markdown("---")
     
@@ -638,19 +1005,19 @@ if img1 and img2:
     with metric_col2:
         st.metric(
             label="**ИЗМЕНЕНИЯ**",
-            value=f"{change_percent:.2f}%",
-            delta=f"{(change_percent - threshold):+.2f}%" if change_percent != threshold else "0%",
+            value=f"{scene_measure:.2f}%",
+            delta=f"{(scene_measure - threshold):+.2f}%" if scene_measure != threshold else "0%",
             delta_color="inverse"
         )
     
     with metric_col3:
-        anomaly_status = "⚠️ АНОМАЛИЯ" if change_percent > threshold else "✅ НОРМА"
-        delta_status = "Превышен" if change_percent > threshold else "В норме"
+        anomaly_status = "⚠️ АНОМАЛИЯ" if anomaly else "✅ НОРМА"
+        delta_status = ("Превышен" if anomaly else "В норме") + (" в блоке" if rule_block else "")
         st.metric(
             label="**СТАТУС**",
             value=anomaly_status,
             delta=delta_status,
-            delta_color="normal" if change_percent <= threshold else "off"
+            delta_color="normal" if not anomaly else "off"
         )
     
     with metric_col4:
@@ -679,18 +1046,43 @@ if img1 and img2:
                     "Максимальная яркость разницы",
                     "Средняя яркость разницы",
                     "Стандартное отклонение",
-                    "Пикселей выше порога"
+                    "Медиана разницы",
+                    "95-й перцентиль разницы",
+                    "Пикселей выше порога",
+                    f"Наибольшая доля изменений блока {grid.block_size} пикс",
+                    "Блоков выше порога"
                 ],
                 "Значение": [
-                    f"{img1_array.size:,}",
-                    f"{np.sum(diff_array > 50):,}",
-                    f"{np.max(diff_array):.1f}",
-                    f"{np.mean(diff_array):.2f}",
-                    f"{np.std(diff_array):.3f}",
-                    f"{np.sum(diff_array > threshold * 2.55):,}"
+                    f"{result.sample_count:,}",
+                    f"{stats.changed_pixels:,}",
+                    f"{stats.max:.1f}",
+                    f"{stats.mean:.2f}",
+                    f"{stats.std:.3f}",
+                    f"{stats.percentile(50)}",
+                    f"{stats.percentile(95)}",
+                    f"{stats.pixels_above(level if share else threshold * 2.55):,}",
+                    f"{grid.peak(share):.2f}%",
+                    f"{grid.blocks_above(threshold, share)} из {grid.mean.size}"
                 ]
             }
             
+            if result.registration:
+                shift_x, shift_y = result.registration.offset
+                stats_data["Показатель"] += ["Сдвиг снимка «после» (x; y)", "Достоверность совмещения"]
+                stats_data["Значение"] += [
+                    f"{shift_x:+d}; {shift_y:+d} пикс" if result.registration.applied else "не применён",
+                    f"{result.registration.confidence:.3f}"
+                ]
+            
+            if stats.rescaled:
+                # Растры глубже 8 бит: карта в шкале 0–255 от диапазона их значений
+                stats_data["Показатель"] += ["Шкала разницы (255 =)", "Максимальная разница, ед. данных"]
+                stats_data["Значение"] += [f"{stats.span:g} ед. данных", f"{stats.in_data_units(stats.max):g}"]
+            
+            if result.spectral:
+                stats_data["Показатель"].append(f"Среднее {change_measure.split()[0]}")
+                stats_data["Значение"].append(f"{result.spectral.mean_delta:+.4f}")
+            
             stats_df = pd.DataFrame(stats_data)
             st.dataframe(
                 stats_df,
@@ -701,21 +1093,34 @@ if img1 and img2:
                     "Значение": st.column_config.TextColumn(width="medium")
                 }
             )
+            
+            if result.spectral:
+                st.markdown("#### **РАЗНИЦА ПО КАНАЛАМ**")
+                st.dataframe(
+                    pd.DataFrame({
+                        "Канал": [f"#{band + 1}" for band in range(len(result.spectral.band_differences))],
+                        "Средняя |Δ|": [f"{value:.2f}" for value in result.spectral.band_differences]
+                    }),
+                    use_container_width=True,
+                    hide_index=True
+                )
         
         with col_stat2:
             st.markdown("#### **ГРАФИК РАСПРЕДЕЛЕНИЯ**")
             
-            # Создаём гистограмму
+            # Гистограмма считается на сервере, в браузер уходят только бины
+            bin_starts, bin_counts, bin_size = rebin_histogram(stats.histogram, nbins=50)
             hist_data = pd.DataFrame({
-                'Интенсивность изменений': diff_array.flatten()
+                'Интенсивность изменений': stats.in_data_units(bin_starts + bin_size / 2),
+                'Количество пикселей': bin_counts
             })
             
             # Улучшенная гистограмма
             import plotly.express as px
-            fig = px.histogram(
+            fig = px.bar(
                 hist_data,
                 x='Интенсивность изменений',
-                nbins=50,
+                y='Количество пикселей',
                 title="Распределение интенсивности изменений",
                 color_discrete_sequence=['#00ffff']
             )
@@ -724,12 +1129,54 @@ if img1 and img2:
                 plot_bgcolor='rgba(0,0,0,0)',
                 paper_bgcolor='rgba(0,0,0,0)',
                 font_color='#ffffff',
-                xaxis_title="Интенсивность (0-255)",
+                # Растры глубже 8 бит — в единицах данных, а не в шкале карты
+                xaxis_title=f"Разница, ед. данных (0-{stats.span:g})" if stats.rescaled else "Интенсивность (0-255)",
                 yaxis_title="Количество пикселей",
                 bargap=0.1
             )
             
             st.plotly_chart(fig, use_container_width=True)
+
+    # ========== ОБЛАСТИ ИЗМЕНЕНИЙ ==========
+    regions = result.regions
+    with st.expander(f"🗺️ **ОБЛАСТИ ИЗМЕНЕНИЙ: {regions.count:,}**", expanded=False):
+        if regions.count == 0:
+            st.info("Связных областей выше уровня изменений не найдено")
+        else:
+            shown = min(len(regions), 100)
+            st.caption(
+                f"Крупнейшие {shown} из {regions.count:,} областей (8-связность, яркость разницы > {regions.level:g}); "
+                f"координаты — в пикселях снимка «до», общая площадь {regions.total_area:,} пикс"
+            )
+            regions_df = pd.DataFrame(regions.rows(shown))
+            column_names = {
+                'id': "№",
+                'area': "Площадь, пикс",
+                'left': "Слева",
+                'top': "Сверху",
+                'right': "Справа",
+                'bottom': "Снизу",
+                'centroid_x': "Центр X",
+                'centroid_y': "Центр Y",
+                'mean_intensity': "Средняя интенсивность"
+            }
+            st.dataframe(
+                regions_df.rename(columns=column_names).round(1),
+                use_container_width=True,
+                hide_index=True
+            )
+            st.download_button(
+                label=f"⬇️ Все {len(regions):,} областей (CSV)",
+                data=reports.regions_csv,
+                file_name=f"change_regions_{date.today()}.csv",
+                mime="text/csv",
+                on_click="ignore",
+                use_container_width=True
+            )
+
+    progress.finish()
+    width, height = result.size
+    default_telemetry.record(progress, "pair", result.mode, width * height / 1e6)
     
     # ========== ИТОГОВЫЙ ОТЧЁТ ==========
     st.markdown("---")
@@ -737,13 +1184,13 @@ if img1 and img2:
     col_report1, col_report2 = st.columns([3, 1])
     
     with col_report1:
-        if change_percent > threshold:
+        if anomaly:
             st.error(f"""
             ## 🚨 **ОБНАРУЖЕНЫ КРИТИЧЕСКИЕ ИЗМЕНЕНИЯ!**
             
             ### **Детали анализа:**
-            - **📊 Площадь изменений:** {change_percent:.2f}% (порог: {threshold}%)
-            - **⚠️ Превышение порога:** {(change_percent - threshold):.2f}%
+            - **📊 Площадь изменений:** {scene_measure:.2f}% (порог: {threshold}%)
+            - **⚠️ Превышение порога {measured_label}:** {(measured - threshold):.2f}%
             - **📅 Рекомендуемые действия:** Необходима срочная проверка территории
             
             ### **Возможные причины:**
@@ -759,8 +1206,8 @@ if img1 and img2:
             ## ✅ **ТЕРРИТОРИЯ СТАБИЛЬНА**
             
             ### **Детали анализа:**
-            - **📊 Площадь изменений:** {change_percent:.2f}% (порог: {threshold}%)
-            - **📈 Запас до порога:** {(threshold - change_percent):.2f}%
+            - **📊 Площадь изменений:** {scene_measure:.2f}% (порог: {threshold}%)
+            - **📈 Запас до порога {measured_label}:** {(threshold - measured):.2f}%
             - **📅 Статус:** Мониторинг не выявил критических изменений
             
             ### **Заключение:**
@@ -771,59 +1218,37 @@ if img1 and img2:
             """)
     
     with col_report2:
-        # Генерация отчёта
-        report_content = f"""
-        ==================================
-        ОТЧЁТ ОБ АНАЛИЗЕ TERRAIN SCANNER
-        ==================================
-        
-        Дата анализа: {date.today()}
-        Время анализа: {pd.Timestamp.now().strftime('%H:%M:%S')}
-        
-        --------------------------------
-        ПАРАМЕТРЫ АНАЛИЗА:
-        --------------------------------
-        • Порог обнаружения: {threshold}%
-        • Режим анализа: {analysis_mode}
-        • Показать тепловую карту: {'Да' if show_heatmap else 'Нет'}
-        
-        --------------------------------
-        РЕЗУЛЬТАТЫ:
-        --------------------------------
-        • Сходство изображений: {similarity:.1f}%
-        • Обнаружено изменений: {change_percent:.2f}%
-        • Статус: {'АНОМАЛИЯ' if change_percent > threshold else 'НОРМА'}
-        • Эффективность анализа: {efficiency:.1f}%
-        
-        --------------------------------
-        ДЕТАЛЬНАЯ СТАТИСТИКА:
-        --------------------------------
-        • Всего пикселей: {img1_array.size:,}
-        • Изменённых пикселей: {np.sum(diff_array > 50):,}
-        • Макс. интенсивность: {np.max(diff_array):.1f}
-        • Сред. интенсивность: {np.mean(diff_array):.2f}
-        
-        --------------------------------
-        ЗАКЛЮЧЕНИЕ:
-        --------------------------------
-        {'Обнаружены значительные изменения, требующие внимания' if change_percent > threshold else 'Значимых изменений не обнаружено, территория стабильна'}
-        
-        ==================================
-        СИСТЕМА АВТОМАТИЧЕСКОГО МОНИТОРИНГА
-        © 2024 GEO SCAN PRO
-        Контакты: yasya.ackerman.77@gmail.com
-        ==================================
-        """
-        
-        # Кнопки действий
-        if st.button("📥 **СКАЧАТЬ ПОЛНЫЙ ОТЧЁТ**", use_container_width=True, type="primary"):
-            st.download_button(
-                label="⬇️ НАЖМИТЕ ДЛЯ СКАЧИВАНИЯ",
-                data=report_content,
-                file_name=f"terrain_scan_report_{date.today()}.txt",
-                mime="text/plain",
-                use_container_width=True
-            )
+        # Отчёты строятся только по нажатию кнопки скачивания и запоминаются для результата
+        report_settings = {
+            "Режим анализа": MODES[params.mode].label + (" (предпросмотр)" if admission.preview else ""),
+            "Показатель изменений": change_measure,
+            "Показать тепловую карту": "Да" if show_heatmap else "Нет"
+        }
+        st.download_button(
+            label="📥 **СКАЧАТЬ ПОЛНЫЙ ОТЧЁТ**",
+            data=lambda: reports.text(threshold, report_settings, rule_block, level),
+            file_name=f"terrain_scan_report_{date.today()}.txt",
+            mime="text/plain",
+            on_click="ignore",
+            type="primary",
+            use_container_width=True
+        )
+        st.download_button(
+            label="🧾 Статистика (JSON)",
+            data=lambda: reports.stats(threshold, rule_block, level),
+            file_name=f"terrain_scan_stats_{date.today()}.json",
+            mime="application/json",
+            on_click="ignore",
+            use_container_width=True
+        )
+        st.download_button(
+            label="🗺️ Полигоны изменений (GeoJSON)",
+            data=reports.regions_geojson,
+            file_name=f"change_regions_{date.today()}.geojson",
+            mime="application/geo+json",
+            on_click="ignore",
+            use_container_width=True
+        )
         
         if st.button("🖨️ **РАСПЕЧАТАТЬ РЕЗУЛЬТАТЫ**", use_container_width=True):
             st.success("**Готово к печати!** Откройте диалог печати в браузере.")
@@ -834,6 +1259,8 @@ if img1 and img2:
 
 else:
     # Состояние без загруженных изображений
+    if series_mode and scenes:
+        st.info("🗓️ Для временного ряда нужно не меньше двух снимков")
     st.markdown("---")
     
     col_demo1, col_demo2, col_demo3 = st.columns(3)
@@ -855,13 +1282,13 @@ else:
     with col_demo2:
         with st.container():
             st.markdown("#### **📚 ИНСТРУКЦИЯ**")
-            st.markdown("""
+            st.markdown(f"""
             **Рекомендации:**
             
             • Используйте снимки одинакового размера
             • Форматы: PNG, JPG, TIFF
             • Минимальное разрешение: 800×600
-            • Максимальный размер: 20 МБ
+            • Максимальный размер: {MAX_UPLOAD_BYTES // 1024 ** 2} МБ (больше — режим предпросмотра)
             """)
     
     with col_demo3:
@@ -957,6 +1384,108 @@ with footer_col3:
     </div>
     """, unsafe_allow_html=True)
 
+# ========== СТАТУС СИСТЕМЫ ==========
+def render_status(panel):
+    """Показатели процесса, этапы последнего анализа и история — вместо заглушек."""
+    megabyte = 1024 * 1024
+    stage_labels = {name: label.capitalize() for name, label, _ in STAGES}
+    history = default_telemetry.history()
+    memory = total_memory()
+    peak = peak_rss()
+    rss = current_rss() or peak
+    hit_rate = default_telemetry.cache_hit_rate()
+    
+    with panel.container():
+        col_stat1, col_stat2, col_stat3 = st.columns(3)
+        with col_stat1:
+            st.metric(
+                "Процессор",
+                f"{default_telemetry.cpu_percent():.0f}%",
+                help="Загрузка процессом с прошлого обновления страницы; 100% — одно ядро"
+            )
+        with col_stat2:
+            st.metric(
+                "Память",
+                f"{rss / megabyte:.0f} МБ" if rss else "—",
+                help="Резидентная память процесса"
+                     + (f"; пик {peak / megabyte:.0f} МБ" if peak else "")
+                     + (f" из {memory / 1024 ** 3:.1f} ГБ" if memory else "")
+            )
+        with col_stat3:
+            st.metric(
+                "Кэш",
+                f"{hit_rate:.0%}" if hit_rate is not None else "—",
+                help=f"Доля попаданий в кэш результатов; в нём {len(default_cache)} "
+                     f"результатов, {default_cache.nbytes / megabyte:.0f} МБ. Хранилище на диске: "
+                     f"{default_store.hits} попаданий, {default_store.misses} промахов, "
+                     f"{default_store.nbytes / megabyte:.0f} из {default_store.max_bytes / megabyte:.0f} МБ"
+            )
+        
+        st.caption(
+            f"Пул анализов: выполняется {default_pool.running} из {default_pool.workers}, "
+            f"в очереди {default_pool.queued}, память заданий ≈ {default_pool.in_flight_bytes / megabyte:.0f} "
+            f"из {default_pool.max_bytes / megabyte:.0f} МБ"
+        )
+        
+        if history:
+            last = history[0]
+            st.caption(
+                f"Последний анализ: {last.seconds:.2f} с, пик памяти {last.peak_rss / megabyte:.0f} МБ"
+                + (" — из кэша" if last.cached else "")
+            )
+            st.dataframe(
+                pd.DataFrame({
+                    "Этап": [stage_labels.get(name, name) for name in last.stages],
+                    "Время, с": [round(stage.seconds, 3) for stage in last.stages.values()],
+                    "ЦП, с": [round(stage.cpu_seconds, 3) for stage in last.stages.values()],
+                    "Пик, МБ": [round(stage.peak_rss / megabyte) for stage in last.stages.values()],
+                }),
+                use_container_width=True,
+                hide_index=True
+            )
+            with st.expander(f"История анализов ({len(history)})"):
+                st.dataframe(
+                    pd.DataFrame({
+                        "Время": [pd.Timestamp(record.finished, unit="s").strftime("%H:%M:%S") for record in history],
+                        "Тип": ["ряд" if record.kind == "series" else "пара" for record in history],
+                        "Режим": [MODES[record.mode].label for record in history],
+                        "Мп": [record.megapixels for record in history],
+                        "Кэш": ["да" if record.cached else "нет" for record in history],
+                        "Время, с": [round(record.seconds, 2) for record in history],
+                        "Пик, МБ": [round(record.peak_rss / megabyte) for record in history],
+                    }),
+                    use_container_width=True,
+                    hide_index=True
+                )
+        
+        col_export1, col_export2 = st.columns(2)
+        with col_export1:
+            st.download_button(
+                label="⬇️ Журнал",
+                data=default_telemetry.log().encode("utf-8"),
+                file_name=f"geoscan_metrics_{date.today()}.jsonl",
+                mime="application/jsonl",
+                use_container_width=True,
+                disabled=not history
+            )
+        with col_export2:
+            st.download_button(
+                label="⬇️ Prometheus",
+                data=default_telemetry.prometheus().encode("utf-8"),
+                file_name="metrics.prom",
+                mime="text/plain",
+                use_container_width=True
+            )
+        if METRICS_PORT:
+            try:
+                serve(METRICS_PORT)
+                st.caption(f"Метрики для сборщика: http://127.0.0.1:{METRICS_PORT}/metrics")
+            except OSError as error:
+                st.caption(f"Сервер метрик на порту {METRICS_PORT} не запущен: {error}")
+
+
+render_status(status_panel)
+
 # ========== ФИНАЛЬНЫЙ СКРИПТ ДЛЯ АНИМАЦИЙ ==========
 st.markdown("""
 <script>
@@ -0,0 +1,27 @@
+"""GEO SCAN PRO — ядро анализа изменений земной поверхности."""
+from .engine import (
+    AnalysisParams,
+    AnalysisResult,
+    ResultCache,
+    analyze,
+    compute,
+    content_hash,
+    default_cache,
+)
+from .progress import ProgressReporter
+from .stats import DiffStats
+from .store import AnalysisStore, default_store
+
+__all__ = [
+    'AnalysisParams',
+    'AnalysisResult',
+    'AnalysisStore',
+    'DiffStats',
+    'ProgressReporter',
+    'ResultCache',
+    'analyze',
+    'compute',
+    'content_hash',
+    'default_cache',
+    'default_store',
+]
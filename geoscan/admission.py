@@ -0,0 +1,195 @@
+"""Допуск анализов к исполнению: общий ограниченный пул для всех сессий процесса.
+
+Каждая сессия Streamlit считает в своём потоке, и без ограничений
+несколько больших сцен, загруженных одновременно, уводят хост в подкачку.
+``AnalysisPool`` выполняет задания в ``workers`` потоках и допускает
+очередное, только пока оценка памяти всех выполняемых заданий не
+превышает ``max_bytes``; остальные ждут в очереди строго по порядку
+поступления, так что большая сцена не голодает за потоком мелких.
+Задание, которое больше бюджета целиком, выполняется в одиночку.
+
+Память задания оценивается по размерам кадров из заголовков
+(``footprint``): удельные расходы ниже измерены пиком резидентной памяти
+на парах 12 и 25 Мп.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from .modes import MODES
+from .pyramid import fit_factor
+from .tiling import TILED_MIN_PIXELS
+
+# Байт на пиксель кадра «до»: расчёт целиком в памяти и по тайлам (растры читаются окнами)
+WHOLE_BYTES_PER_PIXEL = {'standard': 22, 'precise': 42}
+TILED_BYTES_PER_PIXEL = {'standard': 10, 'precise': 16}
+# Быстрый режим: декодирование в полном разрешении плюс прореженный уровень
+FAST_BYTES_PER_PIXEL = 14
+# Снимок «после» другого размера: выравнивание и совмещение в полном разрешении
+RESIZE_BYTES_PER_PIXEL = 36
+
+# Как часто ожидающий поток сообщает позицию в очереди, секунд
+POLL_INTERVAL = 0.25
+
+
+def _default_workers() -> int:
+    return int(os.environ.get('GEOSCAN_WORKERS') or min(4, os.cpu_count() or 1))
+
+
+def _default_max_bytes() -> int:
+    if os.environ.get('GEOSCAN_INFLIGHT_BYTES'):
+        return int(os.environ['GEOSCAN_INFLIGHT_BYTES'])
+    try:
+        # Половина физической памяти: остальное — кэш результатов, ОС и сам Streamlit
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2
+    except (OSError, ValueError, AttributeError):
+        return 4 * 1024 ** 3
+
+
+def footprint(size1: tuple[int, int], size2: tuple[int, int], params, windowed: bool = False) -> int:
+    """Оценка пика памяти сравнения кадров ``size1`` и ``size2``, байт.
+
+    ``windowed`` — оба снимка читаются окнами (поддерживаемые TIFF), и
+    разница считается по тайлам при любом размере.
+    """
+    mode = MODES[params.mode]
+    width, height = size1
+    pixels = width * height
+    kind = 'precise' if mode.precise or params.index else 'standard'
+    if mode.max_side and not params.index:
+        level = fit_factor(size1, mode.max_side)
+        per_pixel = FAST_BYTES_PER_PIXEL if level > 1 else WHOLE_BYTES_PER_PIXEL[kind]
+    elif windowed or pixels >= TILED_MIN_PIXELS:
+        per_pixel = TILED_BYTES_PER_PIXEL[kind]
+    else:
+        per_pixel = WHOLE_BYTES_PER_PIXEL[kind]
+    total = pixels * per_pixel
+    if size2 != size1 and not mode.max_side:
+        total += pixels * RESIZE_BYTES_PER_PIXEL
+    return total
+
+
+class Job:
+    """Задание пула; ``position`` — место в очереди, 0 — уже выполняется или завершено."""
+
+    def __init__(self, pool: AnalysisPool, fn, args: tuple, kwargs: dict, cost: int):
+        self.cost = cost
+        self.future = Future()
+        self._pool = pool
+        self._call = (fn, args, kwargs)
+
+    @property
+    def position(self) -> int:
+        return self._pool._position(self)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Ждёт завершения не дольше ``timeout``; ``True``, если задание завершено."""
+        wait([self.future], timeout)
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    def cancel(self) -> bool:
+        """Снимает задание с очереди; выполняющееся доводится до конца."""
+        return self._pool._cancel(self)
+
+
+class AnalysisPool:
+    """Ограниченный пул потоков с допуском по оценке памяти выполняемых заданий."""
+
+    def __init__(self, workers: int | None = None, max_bytes: int | None = None):
+        self.workers = workers or _default_workers()
+        self.max_bytes = max_bytes or _default_max_bytes()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='geoscan-analysis')
+        self._queue: deque[Job] = deque()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._in_flight = 0
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    @property
+    def in_flight_bytes(self) -> int:
+        """Сумма оценок памяти выполняемых заданий."""
+        return self._in_flight
+
+    def submit(self, fn, *args, cost: int = 0, **kwargs) -> Job:
+        job = Job(self, fn, args, kwargs, cost)
+        with self._lock:
+            self._queue.append(job)
+            self._dispatch()
+        return job
+
+    def run(self, fn, *args, cost: int = 0, on_wait=None, **kwargs):
+        """Выполняет ``fn`` в пуле и ждёт результата в вызывающем потоке.
+
+        ``on_wait(position)`` вызывается в вызывающем потоке каждые
+        ``POLL_INTERVAL`` секунд, пока задание не завершится: в очереди —
+        с его местом, во время выполнения — с нулём. Если ожидание прервано
+        (сессия перезапущена), задание снимается с очереди.
+        """
+        job = self.submit(fn, *args, cost=cost, **kwargs)
+        try:
+            while not job.wait(POLL_INTERVAL):
+                if on_wait is not None:
+                    on_wait(job.position)
+        finally:
+            job.cancel()
+        return job.result()
+
+    def _dispatch(self) -> None:
+        # Вызывается под self._lock
+        while self._queue and self._running < self.workers:
+            job = self._queue[0]
+            if self._running and self._in_flight + job.cost > self.max_bytes:
+                return
+            self._queue.popleft()
+            self._running += 1
+            self._in_flight += job.cost
+            self._executor.submit(self._execute, job)
+
+    def _execute(self, job: Job) -> None:
+        fn, args, kwargs = job._call
+        try:
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(fn(*args, **kwargs))
+                except BaseException as error:
+                    job.future.set_exception(error)
+        finally:
+            job._call = None
+            with self._lock:
+                self._running -= 1
+                self._in_flight -= job.cost
+                self._dispatch()
+
+    def _position(self, job: Job) -> int:
+        with self._lock:
+            for position, queued in enumerate(self._queue, 1):
+                if queued is job:
+                    return position
+        return 0
+
+    def _cancel(self, job: Job) -> bool:
+        with self._lock:
+            try:
+                self._queue.remove(job)
+            except ValueError:
+                return False
+            # Снятое задание могло держать очередь: следующее, возможно, уже помещается
+            self._dispatch()
+        return job.future.cancel()
+
+
+# Общий пул процесса; число потоков и бюджет — из GEOSCAN_WORKERS и GEOSCAN_INFLIGHT_BYTES
+default_pool = AnalysisPool()
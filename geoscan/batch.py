@@ -0,0 +1,361 @@
+"""Пакетная обработка пар снимков «до/после» без интерфейса.
+
+Пары берутся из манифеста CSV (колонки ``before``, ``after`` и
+необязательная ``id``) или из каталога, где снимки названы
+``<id>_before.<ext>`` и ``<id>_after.<ext>`` либо лежат в подкаталогах
+``before/`` и ``after/`` под одинаковыми именами. Пары считаются в пуле
+процессов тем же ``compute``, что и в приложении; строки результатов
+пишутся в CSV или JSONL по мере готовности, поэтому прерванный запуск
+продолжается с того же файла, пропуская уже посчитанные пары; строки
+с ошибками и оборванные строки при этом убираются из файла, а их пары
+считаются заново. С
+``--store`` результаты сохраняются в хранилище на диске, общем с
+приложением, и повторный пакет по тем же снимкам их не пересчитывает.
+С ``--auto`` уровень изменений выбирается по гистограмме каждой пары, и
+порог сравнивается с долей пикселей выше него — одним порогом на весь
+пакет, без подстройки под сцену.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, TextIO
+
+from .blocks import DEFAULT_BLOCK_SIZE
+from .engine import AnalysisParams, analyze, compute
+from .modes import MODES, RESAMPLE_FILTERS
+from .radiometry import NORMALIZATIONS
+from .spectral import BAND_MAPS, INDICES
+from .stats import CHANGED_LEVEL, DEFAULT_PERCENTILE, THRESHOLDS
+from .store import AnalysisStore
+
+# Порог доли изменений, %, как у ползунка приложения по умолчанию
+DEFAULT_THRESHOLD = 5.0
+
+# Расширения снимков, которые ищутся в каталоге
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+
+# Колонки строки результата в порядке вывода
+FIELDS = (
+    'id', 'before', 'after', 'width', 'height', 'megapixels',
+    'similarity', 'change_percent', 'status', 'auto_level', 'changed_share',
+    'mean', 'std', 'max', 'median', 'p95', 'changed_pixels',
+    'regions', 'largest_region', 'peak_block_percent', 'blocks_above',
+    'shift_x', 'shift_y', 'registration_confidence',
+    'seconds', 'error',
+)
+
+# Как часто печатается строка пропускной способности, секунд
+REPORT_INTERVAL = 5.0
+
+
+@dataclass(frozen=True)
+class Pair:
+    id: str
+    before: str
+    after: str
+
+
+def read_manifest(path: str | os.PathLike) -> list[Pair]:
+    """Пары из CSV-манифеста; относительные пути — от каталога манифеста."""
+    root = Path(path).parent
+    pairs = []
+    with open(path, newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            # Без колонки id парой считается путь снимка «до», как он записан в манифесте
+            pairs.append(Pair(row.get('id') or row['before'], str(root / row['before']), str(root / row['after'])))
+    return pairs
+
+
+def discover_pairs(directory: str | os.PathLike) -> list[Pair]:
+    """Пары из каталога по суффиксам ``_before``/``_after`` или подкаталогам ``before/``/``after/``."""
+    root = Path(directory)
+    images = sorted(path for path in root.rglob('*') if path.suffix.lower() in IMAGE_SUFFIXES)
+    befores, afters = {}, {}
+    for path in images:
+        relative = path.relative_to(root)
+        parts = relative.parts
+        if len(parts) > 1 and parts[0] in ('before', 'after'):
+            key = Path(*parts[1:]).with_suffix('').as_posix()
+            (befores if parts[0] == 'before' else afters)[key] = path
+        elif path.stem.endswith('_before'):
+            befores[relative.with_name(path.stem[:-len('_before')]).as_posix()] = path
+        elif path.stem.endswith('_after'):
+            afters[relative.with_name(path.stem[:-len('_after')]).as_posix()] = path
+    return [Pair(key, str(befores[key]), str(afters[key])) for key in sorted(befores) if key in afters]
+
+
+def score_pair(pair: Pair, params: AnalysisParams, threshold: float,
+               store: AnalysisStore | None = None, block_size: int | None = None,
+               auto: str | None = None, q: float = DEFAULT_PERCENTILE) -> dict:
+    """Строка результата для одной пары; ошибка пары пишется в строку, а не прерывает пакет.
+
+    ``block_size`` — аномалия по любому блоку сетки, а не по всей сцене.
+    ``auto`` — метод автоматического уровня изменений (ключ ``THRESHOLDS``,
+    ``q`` — перцентиль для ``percentile``): с порогом сравнивается доля
+    пикселей выше уровня.
+    """
+    started = time.perf_counter()
+    try:
+        if store is not None:
+            result = analyze(pair.before, pair.after, params, cache=None, store=store)
+        else:
+            result = compute(pair.before, pair.after, params)
+    except Exception as error:
+        return _failed_row(pair, error, round(time.perf_counter() - started, 3))
+    row = dict.fromkeys(FIELDS, '')
+    row.update(id=pair.id, before=pair.before, after=pair.after)
+    stats = result.stats
+    level = stats.auto_level(auto, q) if auto else None
+    share = level is not None
+    grid = result.grid(block_size or DEFAULT_BLOCK_SIZE, level if share else CHANGED_LEVEL)
+    width, height = result.size
+    row.update(
+        width=width,
+        height=height,
+        megapixels=round(width * height / 1e6, 3),
+        similarity=round(result.similarity, 4),
+        change_percent=round(result.change_percent, 4),
+        status='anomaly' if result.exceeds(threshold, block_size, level) else 'normal',
+        auto_level=level if share else '',
+        changed_share=round(stats.changed_share(level), 4) if share else '',
+        mean=round(stats.mean, 4),
+        std=round(stats.std, 4),
+        max=round(float(stats.max), 4),
+        median=stats.percentile(50),
+        p95=stats.percentile(95),
+        changed_pixels=stats.changed_pixels,
+        regions=result.regions.count,
+        largest_region=int(result.regions.area[0]) if len(result.regions) else 0,
+        peak_block_percent=round(grid.peak_percent, 4),
+        blocks_above=grid.blocks_above(threshold, share),
+        seconds=round(time.perf_counter() - started, 3),
+    )
+    if result.registration is not None:
+        shift_x, shift_y = result.registration.offset
+        row.update(shift_x=shift_x, shift_y=shift_y,
+                   registration_confidence=round(result.registration.confidence, 4))
+    return row
+
+
+def _failed_row(pair: Pair, error: BaseException, seconds: float | str = '') -> dict:
+    row = dict.fromkeys(FIELDS, '')
+    row.update(id=pair.id, before=pair.before, after=pair.after,
+               error=f'{type(error).__name__}: {error}', seconds=seconds)
+    return row
+
+
+def completed_rows(path: str | os.PathLike) -> list[dict]:
+    """Полные строки пар, посчитанных без ошибки, из существующего файла результатов."""
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='', encoding='utf-8') as file:
+        if str(path).endswith('.jsonl'):
+            rows = (_json_row(line) for line in file if line.strip())
+        else:
+            rows = csv.DictReader(file)
+        # Строка CSV, оборванная остановкой процесса, читается без последних колонок:
+        # полной считается строка с временем расчёта
+        return [row for row in rows
+                if row and row.get('id') and row.get('seconds') not in (None, '') and not row.get('error')]
+
+
+def completed_ids(path: str | os.PathLike) -> set[str]:
+    """Пары, уже посчитанные без ошибки в существующем файле результатов."""
+    return {row['id'] for row in completed_rows(path)}
+
+
+def _json_row(line: str) -> dict | None:
+    # Строка, оборванная остановкой процесса, считается непосчитанной
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return None
+
+
+def prune_results(path: str | os.PathLike) -> None:
+    """Оставляет в файле результатов только полные строки без ошибок.
+
+    Пары с ошибками и оборванные прерванным запуском считаются заново, и
+    их прежние строки убираются, чтобы у пары не копились дубликаты.
+    Файл переписывается через временный и подменяется целиком.
+    """
+    if not os.path.exists(path):
+        return
+    rows = completed_rows(path)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', newline='', encoding='utf-8') as file:
+        writer = ResultWriter(file, jsonl=str(path).endswith('.jsonl'))
+        for row in rows:
+            writer.write(row)
+    os.replace(temporary, path)
+
+
+class ResultWriter:
+    """Дописывает строки в CSV или JSONL и сбрасывает каждую на диск."""
+
+    def __init__(self, file: TextIO, jsonl: bool):
+        self.file = file
+        self.jsonl = jsonl
+        self._csv = None
+        if not jsonl:
+            self._csv = csv.DictWriter(file, fieldnames=FIELDS)
+            if file.tell() == 0:
+                self._csv.writeheader()
+
+    def write(self, row: dict) -> None:
+        if self.jsonl:
+            self.file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        else:
+            self._csv.writerow(row)
+        self.file.flush()
+
+
+class Throughput:
+    """Счётчик пар и мегапикселей в секунду с начала запуска."""
+
+    def __init__(self, total: int, clock=time.perf_counter):
+        self.total = total
+        self.clock = clock
+        self.started = clock()
+        self.done = 0
+        self.failed = 0
+        self.megapixels = 0.0
+
+    def add(self, row: dict) -> None:
+        self.done += 1
+        if row['error']:
+            self.failed += 1
+        else:
+            self.megapixels += row['megapixels']
+
+    def summary(self) -> str:
+        elapsed = max(self.clock() - self.started, 1e-9)
+        rate = self.done / elapsed
+        remaining = (self.total - self.done) / rate if rate else float('inf')
+        return (f'{self.done}/{self.total} пар, ошибок {self.failed} | '
+                f'{rate:.2f} пар/с, {self.megapixels / elapsed:.1f} Мп/с | '
+                f'прошло {elapsed:.0f} с, осталось ≈ {remaining:.0f} с')
+
+
+def run(pairs: Iterable[Pair], params: AnalysisParams, threshold: float,
+        workers: int | None = None, store: AnalysisStore | None = None,
+        block_size: int | None = None, auto: str | None = None,
+        q: float = DEFAULT_PERCENTILE) -> Iterator[dict]:
+    """Строки результатов в порядке готовности.
+
+    В пуле одновременно не больше ``2 × workers`` пар, поэтому память не
+    растёт с длиной манифеста. Сбой процесса (нехватка памяти, падение в
+    декодере) пишется строкой с ошибкой для каждой пары, бывшей в пуле, а
+    остальные пары считаются в новом пуле.
+    """
+    workers = workers or os.cpu_count() or 1
+    pairs = iter(pairs)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = {}
+    broken = False
+    try:
+        while True:
+            if broken and not pending:
+                executor.shutdown()
+                executor = ProcessPoolExecutor(max_workers=workers)
+                broken = False
+            if not broken:
+                for pair in pairs:
+                    try:
+                        future = executor.submit(score_pair, pair, params, threshold, store, block_size, auto, q)
+                    except BrokenProcessPool:
+                        # Пул сломался после ожидания: пара уйдёт в новый пул
+                        pairs, broken = itertools.chain([pair], pairs), True
+                        break
+                    pending[future] = pair
+                    if len(pending) >= 2 * workers:
+                        break
+            if not pending:
+                if broken:
+                    continue
+                return
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pair = pending.pop(future)
+                try:
+                    row = future.result()
+                except Exception as error:
+                    broken = broken or isinstance(error, BrokenProcessPool)
+                    row = _failed_row(pair, error)
+                yield row
+    finally:
+        executor.shutdown()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m geoscan',
+        description='Пакетное сравнение пар снимков «до/после».',
+    )
+    parser.add_argument('source', help='CSV-манифест (before, after[, id]) или каталог с парами')
+    parser.add_argument('-o', '--output', required=True, help='файл результатов .csv или .jsonl')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='число процессов (по умолчанию — все ядра)')
+    parser.add_argument('--mode', choices=sorted(MODES), default='standard', help='режим анализа')
+    parser.add_argument('--resample', choices=list(RESAMPLE_FILTERS), default=None,
+                        help='фильтр выравнивания снимков разного размера (по умолчанию — режима)')
+    parser.add_argument('--index', choices=sorted(INDICES), default=None, help='спектральный индекс')
+    parser.add_argument('--bands', choices=sorted(BAND_MAPS), default='rgbn', help='порядок каналов')
+    parser.add_argument('--no-register', dest='register', action='store_false',
+                        help='не совмещать снимки перед сравнением')
+    parser.add_argument('--normalize', choices=sorted(NORMALIZATIONS), default=None,
+                        help='радиометрическая нормализация снимка «после» по снимку «до»')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='порог аномалии, %%')
+    parser.add_argument('--block-size', type=int, default=None, metavar='PX',
+                        help=f'аномалия по любому блоку этой стороны, а не по всей сцене '
+                             f'(сетка в результатах — {DEFAULT_BLOCK_SIZE} пикс, если не задано)')
+    parser.add_argument('--auto', choices=list(THRESHOLDS), default=None,
+                        help='автоматический уровень изменений по гистограмме пары; '
+                             'порог — на долю пикселей выше него')
+    parser.add_argument('--percentile', type=float, default=DEFAULT_PERCENTILE, metavar='Q',
+                        help='перцентиль разницы для --auto percentile (по умолчанию %(default)s)')
+    parser.add_argument('--store', default=None, metavar='DIR',
+                        help='каталог хранилища результатов (например, общий с приложением)')
+    parser.add_argument('--restart', action='store_true', help='посчитать заново, не продолжая файл результатов')
+    args = parser.parse_args(argv)
+
+    pairs = read_manifest(args.source) if os.path.isfile(args.source) else discover_pairs(args.source)
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = completed_ids(args.output)
+    todo = [pair for pair in pairs if pair.id not in done]
+    print(f'Пар: {len(pairs)}, уже посчитано: {len(pairs) - len(todo)}, в работе: {len(todo)}', file=sys.stderr)
+    if not todo:
+        return 0
+    prune_results(args.output)
+
+    params = AnalysisParams.for_mode(
+        args.mode, resample=RESAMPLE_FILTERS.get(args.resample),
+        index=args.index, bands=args.bands, register=args.register,
+        normalize=args.normalize,
+    )
+    store = AnalysisStore(args.store) if args.store else None
+    throughput = Throughput(len(todo))
+    reported = throughput.started
+    with open(args.output, 'a', newline='', encoding='utf-8') as file:
+        writer = ResultWriter(file, jsonl=args.output.endswith('.jsonl'))
+        for row in run(todo, params, args.threshold, args.workers, store, args.block_size,
+                       args.auto, args.percentile):
+            writer.write(row)
+            throughput.add(row)
+            if row['error']:
+                print(f'{row["id"]}: {row["error"]}', file=sys.stderr)
+            if throughput.clock() - reported >= REPORT_INTERVAL:
+                reported = throughput.clock()
+                print(throughput.summary(), file=sys.stderr)
+    print(throughput.summary(), file=sys.stderr)
+    return 1 if throughput.failed else 0
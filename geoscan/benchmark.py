@@ -0,0 +1,318 @@
+"""Воспроизводимый замер производительности конвейера анализа.
+
+Синтетические пары от единиц до сотен мегапикселей пишутся полосами в
+несжатые TIFF (при необходимости перекодируются в PNG или JPEG) и
+кэшируются в рабочем каталоге: фон — общая для пары текстура, поверх
+неё — независимый слабый шум и прямоугольники известной площади, которые
+есть только на снимке «после». Каждый случай (размер × режим) считается
+в отдельном процессе, поэтому пик резидентной памяти относится только к
+нему. Время снимается по этапам конвейера (``StageRecorder``) и двум
+этапам отрисовки: тепловая карта обзора и фрагмента и бины гистограммы.
+Результаты пишутся в JSON и сравниваются с прошлым запуском с допуском::
+
+    python -m geoscan.benchmark -o bench.json --sizes 1,16,64
+    python -m geoscan.benchmark -o new.json --baseline bench.json --tolerance 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from .heatmap import render_heatmap
+from .modes import MODES
+from .pyramid import window_around
+from .stats import CHANGED_LEVEL, rebin_histogram
+from .telemetry import StageRecorder, peak_rss
+
+# Размеры пар по умолчанию, мегапикселей
+DEFAULT_SIZES = (1, 4, 16, 64)
+
+# Допустимый рост времени и памяти относительно прошлого запуска
+DEFAULT_TOLERANCE = 0.15
+
+# Этапы короче этого, секунд, сравниваются с ним: иначе шум таймера выглядит регрессией
+MIN_SECONDS = 0.1
+
+# Строк в одной полосе синтетического TIFF
+ROWS_PER_STRIP = 256
+
+# Изменённые прямоугольники (left, top, right, bottom) в долях кадра и их цвет
+CHANGES = ((0.10, 0.15, 0.30, 0.35), (0.55, 0.60, 0.65, 0.72), (0.80, 0.20, 0.84, 0.26))
+CHANGE_COLOR = (235, 225, 205)
+
+# Ширина превью и сторона фрагмента, которые отрисовывает приложение
+RENDER_WIDTH = 800
+INSPECT_SIZE = 512
+
+FORMAT_VERSION = 1
+
+
+def frame_size(megapixels: float) -> tuple[int, int]:
+    """Кадр 3:2 с заданным числом мегапикселей."""
+    width = round(math.sqrt(megapixels * 1e6 * 1.5))
+    return width, round(width / 1.5)
+
+
+def change_boxes(size: tuple[int, int]) -> list[tuple[int, int, int, int]]:
+    width, height = size
+    return [(round(left * width), round(top * height), round(right * width), round(bottom * height))
+            for left, top, right, bottom in CHANGES]
+
+
+def expected_changed_pixels(size: tuple[int, int]) -> int:
+    return sum((right - left) * (bottom - top) for left, top, right, bottom in change_boxes(size))
+
+
+def synthetic_strips(size: tuple[int, int], seed: int, after: bool) -> Iterator[np.ndarray]:
+    """Полосы снимка «до» или «после» по ``ROWS_PER_STRIP`` строк.
+
+    Фон 45–105 с общей текстурой ±20 и независимым шумом ±4: разница фона
+    не выше 8, а прямоугольники светлее фона на 100 с лишним уровней
+    яркости, поэтому изменённых пикселей ровно столько, сколько в
+    прямоугольниках.
+    """
+    width, height = size
+    x = np.arange(width, dtype=np.float32)
+    boxes = change_boxes(size) if after else []
+    for top in range(0, height, ROWS_PER_STRIP):
+        bottom = min(top + ROWS_PER_STRIP, height)
+        y = np.arange(top, bottom, dtype=np.float32)[:, None]
+        base = 75 + 30 * np.sin(x / 97) * np.cos(y / 61)
+        texture = np.random.default_rng([seed, top]).integers(-20, 21, (bottom - top, width, 3), dtype=np.int16)
+        texture += np.random.default_rng([seed, top, 1 + after]).integers(-4, 5, texture.shape, dtype=np.int16)
+        texture += base.astype(np.int16)[..., None]
+        strip = texture.astype(np.uint8)
+        for left, box_top, right, box_bottom in boxes:
+            if box_top < bottom and box_bottom > top:
+                strip[max(box_top, top) - top:min(box_bottom, bottom) - top, left:right] = CHANGE_COLOR
+        yield strip
+
+
+def write_tiff(path: str | os.PathLike, size: tuple[int, int], strips: Iterator[np.ndarray]) -> None:
+    """Несжатый RGB TIFF, записанный полосами без сборки кадра в памяти."""
+    width, height = size
+    count = -(-height // ROWS_PER_STRIP)
+    strip_bytes = [min(ROWS_PER_STRIP, height - top) * width * 3 for top in range(0, height, ROWS_PER_STRIP)]
+    offsets = np.cumsum([8] + strip_bytes[:-1])
+    data_end = 8 + sum(strip_bytes)
+    with open(path, 'wb') as file:
+        file.write(struct.pack('<2sHI', b'II', 42, data_end))
+        for strip in strips:
+            file.write(strip.tobytes())
+        # Массивы тегов длиннее 4 байт лежат после IFD
+        entries = 10
+        extra = data_end + 2 + entries * 12 + 4
+        bits_at, offsets_at, counts_at = extra, extra + 6, extra + 6 + 4 * count
+        tags = [
+            (256, 4, 1, width), (257, 4, 1, height), (258, 3, 3, bits_at), (259, 3, 1, 1), (262, 3, 1, 2),
+            (273, 4, count, offsets_at if count > 1 else int(offsets[0])), (277, 3, 1, 3),
+            (278, 4, 1, ROWS_PER_STRIP), (279, 4, count, counts_at if count > 1 else strip_bytes[0]), (284, 3, 1, 1),
+        ]
+        file.write(struct.pack('<H', entries))
+        for tag, field_type, values, value in tags:
+            file.write(struct.pack('<HHII', tag, field_type, values, value))
+        file.write(struct.pack('<I', 0))
+        file.write(struct.pack('<3H', 8, 8, 8))
+        file.write(np.asarray(offsets, dtype='<u4').tobytes())
+        file.write(np.asarray(strip_bytes, dtype='<u4').tobytes())
+
+
+def synthetic_pair(workdir: str | os.PathLike, megapixels: float, fmt: str = 'tiff',
+                   seed: int = 0) -> tuple[str, str]:
+    """Пути пары заданного размера; уже записанная пара берётся из ``workdir``."""
+    size = frame_size(megapixels)
+    paths = []
+    for name, after in (('before', False), ('after', True)):
+        stem = Path(workdir) / f'{size[0]}x{size[1]}-{seed}-{name}'
+        tiff = stem.with_suffix('.tif')
+        if not tiff.exists():
+            partial = tiff.with_suffix('.part')
+            write_tiff(partial, size, synthetic_strips(size, seed, after))
+            partial.replace(tiff)
+        path = tiff if fmt == 'tiff' else stem.with_suffix('.' + fmt)
+        if not path.exists():
+            _convert(tiff, path)
+        paths.append(str(path))
+    return paths[0], paths[1]
+
+
+def _convert(source: Path, target: Path) -> None:
+    # Перекодирование целиком в памяти; предел PIL на размер кадра здесь не нужен
+    limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+    try:
+        with Image.open(source) as image:
+            image.save(target, quality=95)
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+def peak_rss_mb() -> float:
+    """Пик резидентной памяти текущего процесса, МБ; 0 — если его не узнать."""
+    return (peak_rss() or 0) / (1024 * 1024)
+
+
+def run_case(path1: str, path2: str, mode: str, repeat: int) -> dict:
+    """Лучшее из ``repeat`` время по этапам и пик памяти; выполняется в отдельном процессе."""
+    from .engine import AnalysisParams, compute
+
+    baseline = peak_rss_mb()
+    best: dict[str, float] = {}
+    for _ in range(repeat):
+        clock = StageRecorder()
+        started = time.perf_counter()
+        result = compute(path1, path2, AnalysisParams.for_mode(mode), clock)
+        clock.finish()
+        seconds = {name: stage.seconds for name, stage in clock.stages.items()}
+        # Этапы отрисовки — вне конвейера, и в отчёте о ходе анализа у них нет своих имён
+        rendered = time.perf_counter()
+        render_heatmap(result.overview_diff.level_for(RENDER_WIDTH))
+        render_heatmap(result.overview_diff.region(window_around(result.size, 0.5, 0.5, INSPECT_SIZE)))
+        binned = time.perf_counter()
+        rebin_histogram(result.stats.histogram, nbins=50)
+        seconds['heatmap'] = binned - rendered
+        seconds['histogram'] = time.perf_counter() - binned
+        seconds['total'] = time.perf_counter() - started
+        best = {name: min(value, best.get(name, math.inf)) for name, value in seconds.items()}
+        stats = result.stats
+        del result
+    return {
+        'seconds': {name: round(value, 4) for name, value in best.items()},
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'baseline_rss_mb': round(baseline, 1),
+        'change_percent': round(stats.mean / 255 * 100, 4),
+        'changed_pixels': stats.changed_pixels,
+    }
+
+
+def environment() -> dict:
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(sizes, modes, fmt: str = 'tiff', repeat: int = 1, seed: int = 0,
+        workdir: str | os.PathLike | None = None) -> dict:
+    """Замер всех случаев; результат — документ для ``compare`` и файла JSON."""
+    workdir = Path(workdir or Path(tempfile.gettempdir()) / 'geoscan-benchmark')
+    workdir.mkdir(parents=True, exist_ok=True)
+    cases = []
+    for megapixels in sizes:
+        path1, path2 = synthetic_pair(workdir, megapixels, fmt, seed)
+        size = frame_size(megapixels)
+        for mode in modes:
+            # Новый процесс на каждый случай: пик памяти процесса не сбрасывается
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                try:
+                    measured = executor.submit(run_case, path1, path2, mode, repeat).result()
+                except Exception as error:
+                    # Например, PNG больше предела PIL — приложение тоже его не откроет
+                    measured = {'error': f'{type(error).__name__}: {error}'}
+            case = {
+                'id': f'{megapixels:g}MP/{mode}',
+                'megapixels': megapixels,
+                'width': size[0],
+                'height': size[1],
+                'mode': mode,
+                'expected_changed_pixels': expected_changed_pixels(size),
+                **measured,
+            }
+            cases.append(case)
+            print(describe(case), file=sys.stderr)
+    return {
+        'version': FORMAT_VERSION,
+        'environment': environment(),
+        'settings': {'format': fmt, 'repeat': repeat, 'seed': seed, 'changed_level': CHANGED_LEVEL},
+        'cases': cases,
+    }
+
+
+def describe(case: dict) -> str:
+    if 'error' in case:
+        return f'{case["id"]:>18}: {case["error"]}'
+    stages = ', '.join(f'{name} {value:.2f}' for name, value in case['seconds'].items() if name != 'total')
+    return (f'{case["id"]:>18}: {case["seconds"]["total"]:.2f} с ({stages}) | '
+            f'пик {case["peak_rss_mb"]:.0f} МБ | изменено {case["changed_pixels"]:,} '
+            f'из ожидаемых {case["expected_changed_pixels"]:,}')
+
+
+def compare(current: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    """Регрессии времени и памяти относительно ``baseline``; случаи без пары не сравниваются."""
+    previous = {case['id']: case for case in baseline['cases']}
+    regressions = []
+    for case in current['cases']:
+        old = previous.get(case['id'])
+        if old is None or 'error' in case or 'error' in old:
+            continue
+        metrics = [(f'{name}, с', value, old['seconds'].get(name), MIN_SECONDS)
+                   for name, value in case['seconds'].items()]
+        metrics.append(('пик памяти, МБ', case['peak_rss_mb'], old['peak_rss_mb'], 0.0))
+        for label, value, reference, floor in metrics:
+            if reference is None:
+                continue
+            limit = max(reference, floor) * (1 + tolerance)
+            if value > limit:
+                regressions.append(f'{case["id"]} {label}: {value:g} > {reference:g} (+{tolerance:.0%})')
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m geoscan.benchmark',
+        description='Замер времени этапов и пика памяти на синтетических парах.',
+    )
+    parser.add_argument('-o', '--output', required=True, help='файл результатов .json')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='размеры пар через запятую, Мп (по умолчанию %(default)s)')
+    parser.add_argument('--modes', default=','.join(MODES), help='режимы через запятую (по умолчанию все)')
+    parser.add_argument('--format', choices=('tiff', 'png', 'jpeg'), default='tiff', help='формат снимков')
+    parser.add_argument('--repeat', type=int, default=1, help='повторов случая; берётся лучшее время')
+    parser.add_argument('--seed', type=int, default=0, help='зерно синтетических снимков')
+    parser.add_argument('--workdir', default=None, help='каталог кэша синтетических пар')
+    parser.add_argument('--baseline', default=None, help='прошлый файл результатов для сравнения')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='допустимый рост времени и памяти, доля (по умолчанию %(default)s)')
+    args = parser.parse_args(argv)
+
+    modes = args.modes.split(',')
+    unknown = sorted(set(modes) - set(MODES))
+    if unknown:
+        parser.error(f'неизвестные режимы: {", ".join(unknown)}')
+    sizes = [float(size) for size in args.sizes.split(',')]
+    report = run(sizes, modes, args.format, args.repeat, args.seed, args.workdir)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline, encoding='utf-8') as file:
+        regressions = compare(report, json.load(file), args.tolerance)
+    for line in regressions:
+        print(f'РЕГРЕССИЯ {line}', file=sys.stderr)
+    print(f'Регрессий: {len(regressions)}', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
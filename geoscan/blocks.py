@@ -0,0 +1,160 @@
+"""Сетка блоков: показатели карты изменений по квадратам кадра.
+
+Одна доля изменений на всю сцену скрывает локальные изменения: стройка
+на 1 % площади снимка не поднимает среднее до порога. Сетка делит кадр
+на блоки ``block_size`` × ``block_size`` пикселей и для каждого хранит
+среднюю и наибольшую разницу и долю изменённых пикселей — аномалию можно
+объявлять по любому блоку выше порога.
+
+Карта читается полосами блоков. Полоса без копирования переставляется
+шагами (``reshape`` среза карты в ``(строки блоков, block, столбцы блоков,
+block)``), и показатели всех её блоков сворачиваются по осям 1 и 3 —
+один проход по карте. Неполные блоки у правого и нижнего края
+сворачиваются так же, своими срезами.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .stats import CHANGED_LEVEL
+
+# Сторона блока в пикселях кадра по умолчанию и на выбор в интерфейсе
+DEFAULT_BLOCK_SIZE = 512
+BLOCK_SIZES = (128, 256, 512, 1024, 2048)
+
+# Наибольшее число пикселей карты в одной полосе блоков
+STRIP_PIXELS = 4_000_000
+
+
+@dataclass(frozen=True)
+class BlockGrid:
+    """Показатели блоков, строки сверху вниз; ``block_size`` — сторона блока в пикселях кадра.
+
+    ``mean`` и ``max`` — в единицах карты изменений (0–255), ``changed`` —
+    доля пикселей блока выше уровня изменений ``level``.
+    """
+
+    block_size: int
+    level: float
+    mean: np.ndarray
+    max: np.ndarray
+    changed: np.ndarray
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.mean.shape
+
+    @property
+    def change_percent(self) -> np.ndarray:
+        """Доля изменений каждого блока, % — как ``AnalysisResult.change_percent`` для сцены."""
+        return self.mean / 255.0 * 100
+
+    @property
+    def changed_percent(self) -> np.ndarray:
+        """Доля пикселей каждого блока выше ``level``, %."""
+        return self.changed * 100
+
+    def scores(self, share: bool = False) -> np.ndarray:
+        """То, что сравнивается с порогом: доля изменений или, с ``share``, доля изменённых пикселей, %."""
+        return self.changed_percent if share else self.change_percent
+
+    @property
+    def peak_percent(self) -> float:
+        return float(self.change_percent.max()) if self.mean.size else 0.0
+
+    def peak(self, share: bool = False) -> float:
+        return float(self.scores(share).max()) if self.mean.size else 0.0
+
+    def blocks_above(self, threshold: float, share: bool = False) -> int:
+        return int(np.count_nonzero(self.scores(share) > threshold))
+
+    def rows(self, limit: int | None = None) -> list[dict]:
+        """Блоки от наибольшей доли изменений к наименьшей: строка, столбец, рамка в кадре, показатели."""
+        order = np.argsort(-self.mean, axis=None, kind='stable')[:limit]
+        rows, columns = np.unravel_index(order, self.shape)
+        return [
+            {
+                'row': int(row),
+                'column': int(column),
+                'left': int(column) * self.block_size,
+                'top': int(row) * self.block_size,
+                'change_percent': float(self.change_percent[row, column]),
+                'max': float(self.max[row, column]),
+                'changed_fraction': float(self.changed[row, column]),
+            }
+            for row, column in zip(rows, columns)
+        ]
+
+    def overlay(self, size: tuple[int, int], frame_size: tuple[int, int], threshold: float,
+                share: bool = False) -> Image.Image:
+        """Прозрачный слой ``RGBA`` размером ``size`` поверх обзора кадра ``frame_size``: блоки выше порога.
+
+        Рисуется по числу блоков, а не по пикселям кадра, поэтому стоит
+        одинаково для любой сцены.
+        """
+        width, height = size
+        frame_width, frame_height = frame_size
+        overlay = Image.new('RGBA', size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(overlay)
+        for row, column in zip(*np.nonzero(self.scores(share) > threshold)):
+            left, top = column * self.block_size, row * self.block_size
+            right = min(left + self.block_size, frame_width)
+            bottom = min(top + self.block_size, frame_height)
+            draw.rectangle(
+                (left * width // frame_width, top * height // frame_height,
+                 right * width // frame_width - 1, bottom * height // frame_height - 1),
+                fill=(255, 40, 40, 96), outline=(255, 40, 40, 255),
+            )
+        return overlay
+
+
+def _reduce(part: np.ndarray, side: int, block: int, level: float, sums, peaks, counts) -> None:
+    """Суммы, максимумы и число пикселей выше ``level`` по блокам полосы ``part`` высотой в целое число ``side``."""
+    height, width = part.shape
+    full = width // block * block
+    for left, right, span in ((0, full, block), (full, width, width - full)):
+        if right == left:
+            continue
+        # Перестановка шагами без копии: (строки блоков, строки блока, столбцы блоков, столбцы блока)
+        blocks = part[:, left:right].reshape(height // side, side, (right - left) // span, span)
+        columns = slice(left // block, -(-right // block))
+        sums[:, columns] = blocks.sum(axis=(1, 3), dtype=np.float64)
+        peaks[:, columns] = blocks.max(axis=(1, 3))
+        counts[:, columns] = np.count_nonzero(blocks > level, axis=(1, 3))
+
+
+def block_grid(diff_array: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE, scale: int = 1,
+               level: float = CHANGED_LEVEL,
+               on_strip: Callable[[int, int], None] | None = None) -> BlockGrid:
+    """Сетка блоков ``block_size`` пикселей кадра по карте, меньшей кадра в ``scale`` раз."""
+    block = max(1, block_size // scale)
+    height, width = diff_array.shape
+    rows, columns = -(-height // block), -(-width // block)
+    sums, peaks, counts = (np.zeros((rows, columns)) for _ in range(3))
+    strip = max(1, STRIP_PIXELS // max(block * width, 1))
+    total = -(-rows // strip)
+    for done, first in enumerate(range(0, rows, strip), start=1):
+        last = min(first + strip, rows)
+        part = np.asarray(diff_array[first * block:last * block])
+        # Нижний неполный ряд блоков сворачивается отдельно, со своей высотой
+        full = part.shape[0] // block * block
+        for top, bottom, side in ((0, full, block), (full, part.shape[0], part.shape[0] - full)):
+            if bottom > top:
+                block_rows = slice(first + top // block, first + -(-bottom // block))
+                _reduce(part[top:bottom], side, block, level, sums[block_rows], peaks[block_rows], counts[block_rows])
+        if on_strip is not None:
+            on_strip(done, total)
+    heights = np.minimum(block, height - np.arange(rows) * block)
+    widths = np.minimum(block, width - np.arange(columns) * block)
+    areas = np.outer(heights, widths)
+    return BlockGrid(
+        block_size=block * scale,
+        level=level,
+        mean=sums / areas,
+        max=peaks,
+        changed=counts / areas,
+    )
@@ -0,0 +1,507 @@
+"""Движок обнаружения изменений: декодирование → выравнивание → разница → статистика.
+
+Результаты кэшируются по хэшу содержимого снимков и параметрам анализа,
+поэтому перезапуск скрипта Streamlit (движение ползунка порога,
+переключение тепловой карты) не декодирует и не сравнивает снимки заново.
+"""
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+
+import numpy as np
+from PIL import Image
+
+from .admission import footprint
+from .blocks import DEFAULT_BLOCK_SIZE, BlockGrid, block_grid
+from .ingest import check_pixels, open_image, read_header, source_of
+from .jpeg import DraftImage, open_draft
+from .modes import MODES, SCREEN_LEVEL, SCREEN_MAX_SIDE, AnalysisMode
+from .progress import ProgressReporter
+from .pyramid import Pyramid, decimate, fit_factor
+from .radiometry import Remapped, fit_lut, remap
+from .regions import ChangeRegions, find_regions
+from .registration import Registration, Translated, register, translate
+from .spectral import BAND_MAPS, INDICES, SpectralKernel, SpectralSummary
+from .stats import CHANGED_LEVEL, DiffStats
+from .tiff import HIGH_BIT_MODES, DecodedRaster, TiffRaster, open_tiff, open_tiff_path
+from .tiling import (
+    DEFAULT_TILE_SIZE,
+    TILED_MIN_PIXELS,
+    NativeKernel,
+    diff_tile,
+    precise_tile,
+    tiled_difference,
+    whole_difference,
+)
+
+# Бюджет памяти кэша результатов по умолчанию
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class AnalysisParams:
+    """Параметры, влияющие на результат вычислений (входят в ключ кэша).
+
+    ``tile_size`` не меняет результат и в ключ не входит: ``None`` — тайлы
+    включаются автоматически для больших сцен, ``0`` — всегда целиком.
+    """
+
+    mode: str = 'standard'
+    resample: Image.Resampling = Image.Resampling.BICUBIC
+    # Спектральный индекс (ключ INDICES) вместо яркостной разницы и порядок каналов
+    index: str | None = None
+    bands: str = 'rgbn'
+    # Совмещение снимка «после» фазовой корреляцией перед разницей
+    register: bool = True
+    # Радиометрическая нормализация снимка «после» (ключ NORMALIZATIONS)
+    normalize: str | None = None
+    tile_size: int | None = field(default=None, compare=False)
+
+    @classmethod
+    def for_mode(cls, key: str, resample: Image.Resampling | None = None, **overrides) -> AnalysisParams:
+        """Параметры режима ``key``; ``resample=None`` — фильтр выравнивания режима."""
+        return cls(mode=key, resample=MODES[key].resample if resample is None else resample, **overrides)
+
+
+@dataclass
+class AnalysisResult:
+    """Результат сравнения пары снимков. Общий для всех сессий — не изменять."""
+
+    image1: Image.Image
+    image2: Image.Image
+    diff_array: np.ndarray
+    stats: DiffStats
+    overview1: Pyramid
+    overview2: Pyramid
+    overview_diff: Pyramid
+    mode: str = 'standard'
+    # Во сколько раз карта изменений меньше снимка «до»
+    scale: int = 1
+    # Быстрый режим: пара признана неизменной на уровне скрининга
+    screened: bool = False
+    spectral: SpectralSummary | None = None
+    registration: Registration | None = None
+    regions: ChangeRegions | None = None
+    # Сетки блоков по стороне блока и уровню изменений: строятся по запросу и запоминаются
+    _grids: dict[tuple[int, float], BlockGrid] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    @property
+    def diff(self) -> Image.Image:
+        return Image.fromarray(self.diff_array)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.image1.size
+
+    @property
+    def sample_count(self) -> int:
+        # Число значений в RGB-массиве снимка «до» (ширина × высота × 3)
+        width, height = self.image1.size
+        return width * height * len(self.image1.getbands())
+
+    @property
+    def change_percent(self) -> float:
+        return (self.stats.mean / 255.0) * 100
+
+    @property
+    def similarity(self) -> float:
+        return 100 - self.change_percent
+
+    def grid(self, block_size: int = DEFAULT_BLOCK_SIZE, level: float = CHANGED_LEVEL) -> BlockGrid:
+        """Сетка блоков ``block_size`` пикселей кадра — один проход по карте на каждый размер блока и уровень."""
+        key = (block_size, level)
+        grid = self._grids.get(key)
+        if grid is None:
+            grid = self._grids[key] = block_grid(self.diff_array, block_size, self.scale, level)
+        return grid
+
+    def cached_grid(self, block_size: int | None = None, level: float = CHANGED_LEVEL) -> BlockGrid | None:
+        """Уже посчитанная ``grid`` сетка уровня ``level``; без ``block_size`` — любого размера."""
+        if block_size is not None:
+            return self._grids.get((block_size, level))
+        return next((grid for (_, grid_level), grid in self._grids.items() if grid_level == level), None)
+
+    def change_measure(self, block_size: int | None = None, level: float | None = None) -> float:
+        """Доля изменений, %, которая сравнивается с порогом аномалии.
+
+        Без ``level`` — средняя разница (``change_percent``), с уровнем
+        автоматического порога — доля пикселей строго выше него. С
+        ``block_size`` — то же для самого изменённого блока сетки.
+        """
+        if block_size is None:
+            return self.change_percent if level is None else self.stats.changed_share(level)
+        grid = self.grid(block_size, CHANGED_LEVEL if level is None else level)
+        return grid.peak(share=level is not None)
+
+    def exceeds(self, threshold: float, block_size: int | None = None, level: float | None = None) -> bool:
+        """Аномалия: ``change_measure`` выше ``threshold`` %."""
+        return self.change_measure(block_size, level) > threshold
+
+    @property
+    def nbytes(self) -> int:
+        images = resident_bytes(self.image1) + resident_bytes(self.image2)
+        images += sum(pyramid.nbytes for pyramid in (self.overview1, self.overview2, self.overview_diff))
+        images += self.stats.nbytes + (self.regions.nbytes if self.regions is not None else 0)
+        # Карта изменений из тайлового режима лежит на диске и в бюджет не входит
+        if isinstance(self.diff_array, np.memmap):
+            return images
+        return images + self.diff_array.nbytes
+
+
+def resident_bytes(image) -> int:
+    if isinstance(image, (Translated, Remapped)):
+        return resident_bytes(image.source)
+    if isinstance(image, Image.Image):
+        return image.width * image.height * len(image.getbands())
+    # Ленивые источники (TIFF, черновое декодирование, снимок из хранилища) знают свой объём сами
+    return image.nbytes
+
+
+def _buffer(data) -> memoryview:
+    if isinstance(data, (str, os.PathLike)):
+        with open(data, 'rb') as file:
+            return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+    if hasattr(data, 'getvalue'):
+        # BytesIO, созданный из bytes, отдаёт их без копии; getbuffer() скопировал бы
+        return memoryview(data.getvalue())
+    return memoryview(data)
+
+
+def content_hash(data) -> str:
+    """SHA-256 содержимого файла без промежуточной копии в ``bytes``."""
+    with _buffer(data) as view:
+        return hashlib.sha256(view).hexdigest()
+
+
+def decode(data, rgb: tuple[int, int, int] = (0, 1, 2), max_side: int | None = None):
+    """PIL-изображение RGB или, для поддерживаемых TIFF, оконный растр без декодирования.
+
+    Снимок глубже 8 бит, декодированный PIL, остаётся в собственном типе
+    (``DecodedRaster``) и сравнивается, как растр TIFF той же разрядности.
+
+    ``rgb`` — каналы многоканального TIFF, из которых собирается цветной
+    снимок. ``max_side`` — наибольшая сторона уровня, на котором будет
+    идти анализ: JPEG тогда декодируется сразу в уменьшенном масштабе.
+    Размер кадра проверяется ``check_pixels`` до распаковки данных.
+    """
+    source = source_of(data)
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            raster = open_tiff_path(source, rgb)
+        else:
+            raster = open_tiff(source, rgb=rgb)
+        if raster is not None:
+            check_pixels(raster.size)
+            return raster
+        image = open_image(source)
+        check_pixels(image.size)
+        draft = open_draft(source, max_side) if max_side else None
+        if draft is not None:
+            return draft
+    except Image.DecompressionBombError as error:
+        raise ValueError(f'Снимок отклонён: {error}') from None
+    if image.mode in HIGH_BIT_MODES:
+        return DecodedRaster(np.asarray(image), rgb)
+    if image.mode == 'RGB':
+        # convert('RGB') скопировал бы уже готовый кадр целиком
+        image.load()
+        return image
+    return image.convert('RGB')
+
+
+def estimate_bytes(data1, data2, params: AnalysisParams) -> int:
+    """Оценка пика памяти ``compute`` для пары по заголовкам снимков; 0 — не оценить."""
+    header1, header2 = read_header(data1), read_header(data2)
+    if header1 is None or header2 is None:
+        return 0
+    return footprint(header1.size, header2.size, params, header1.windowed and header2.windowed)
+
+
+def materialize(image) -> Image.Image:
+    """Полностью декодированное изображение — для операций над всем кадром сразу."""
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, (TiffRaster, DraftImage)):
+        return image.to_image()
+    return image.crop((0, 0) + image.size)
+
+
+def align(image1, image2, params: AnalysisParams):
+    if image2.size == image1.size:
+        return image2
+    return materialize(image2).resize(image1.size, resample=params.resample)
+
+
+def check_spectral(image1, image2, kernel: SpectralKernel) -> None:
+    for image in (image1, image2):
+        if not isinstance(image, TiffRaster) or image.samples < kernel.required_bands:
+            raise ValueError(
+                f'Для индекса {kernel.index.label} нужны многоканальные TIFF '
+                f'не менее чем с {kernel.required_bands} каналами'
+            )
+    if image1.size != image2.size:
+        raise ValueError('Для спектральных индексов снимки должны совпадать по размеру')
+
+
+def resolve_tile_size(image1, image2, tile_size: int | None) -> int:
+    if tile_size is None:
+        width, height = image1.size
+        # Растры и сдвинутые снимки читаются окнами — их выгодно считать по тайлам
+        lazy = not isinstance(image1, Image.Image) or not isinstance(image2, Image.Image)
+        return DEFAULT_TILE_SIZE if lazy or width * height >= TILED_MIN_PIXELS else 0
+    return tile_size
+
+
+def native_raster(image) -> TiffRaster | None:
+    """Растр глубже 8 бит под сдвигом совмещения; ``None`` — источник 8-битный или уже преобразованный."""
+    while isinstance(image, Translated):
+        image = image.source
+    return image if isinstance(image, TiffRaster) and image.high_bit else None
+
+
+def native_kernel(image1, image2, span: float | None = None) -> NativeKernel | None:
+    """Ядро разницы в собственном типе, если оба источника — растры глубже 8 бит.
+
+    ``span`` — шкала карты в единицах данных; по умолчанию — общий
+    диапазон значений обоих растров.
+    """
+    raster1, raster2 = native_raster(image1), native_raster(image2)
+    if raster1 is None or raster2 is None or raster1.bands != raster2.bands:
+        return None
+    if span is None:
+        (low1, high1), (low2, high2) = raster1.value_range(), raster2.value_range()
+        span = max(high1, high2) - min(low1, low2)
+    return NativeKernel(span if span > 0 else 1.0, raster1.bands)
+
+
+def select_kernel(mode: AnalysisMode, spectral: SpectralKernel | None = None,
+                  native: NativeKernel | None = None):
+    """Ядро разницы и тип карты изменений для режима."""
+    if spectral is not None:
+        return spectral, np.float32
+    if native is not None:
+        # Растры глубже 8 бит сравниваются в собственном типе в любом режиме
+        return native, np.float32
+    if mode.precise:
+        return precise_tile, np.float32
+    return diff_tile, np.uint8
+
+
+def difference(work1, work2, kernel, dtype, tile_size: int | None,
+               progress: ProgressReporter) -> tuple[np.ndarray, DiffStats]:
+    """Карта изменений и статистика — по тайлам или целиком, по размеру сцены."""
+    tile_size = resolve_tile_size(work1, work2, tile_size)
+    if tile_size:
+        return tiled_difference(
+            work1, work2, tile_size, kernel, dtype,
+            on_tile=lambda done, total: progress.advance(done / total),
+        )
+    return whole_difference(work1, work2, kernel)
+
+
+def compute(data1, data2, params: AnalysisParams | None = None,
+            progress: ProgressReporter | None = None) -> AnalysisResult:
+    """Полный расчёт без кэша."""
+    params = params or AnalysisParams()
+    progress = progress or ProgressReporter()
+    mode = MODES[params.mode]
+    band_map = BAND_MAPS[params.bands]
+    spectral = SpectralKernel(INDICES[params.index], band_map) if params.index else None
+
+    progress.stage('decode')
+    # Быстрый режим считает на прореженном уровне — JPEG незачем декодировать целиком
+    max_side = mode.max_side if spectral is None else None
+    image1 = decode(data1, band_map.rgb, max_side)
+    progress.advance(0.5)
+    image2 = decode(data2, band_map.rgb, max_side)
+    if spectral is not None:
+        check_spectral(image1, image2, spectral)
+
+    progress.stage('align')
+    # Быстрый режим считает на прореженном уровне снимков; индексы — всегда в полном
+    level = fit_factor(image1.size, mode.max_side) if mode.max_side and spectral is None else 1
+    work1 = decimate(image1, level)
+    if level == 1:
+        image2 = work2 = align(image1, image2, params)
+    else:
+        work2 = align(work1, decimate(image2, level), params)
+    drafted = isinstance(image1, DraftImage) or isinstance(image2, DraftImage)
+    if params.normalize and spectral is None:
+        # Таблица строится по гистограммам рабочих уровней и применяется до совмещения,
+        # чтобы поля без данных, взятые из снимка «до», не прошли через неё
+        lut = fit_lut(work1, work2, params.normalize)
+        work2 = remap(work2, lut)
+        # Полное разрешение быстрого режима читается через таблицу только по окнам
+        image2 = work2 if level == 1 else Remapped(image2, lut)
+    # Снимок другого размера не выравнивается в полном разрешении только ради показа
+    view2, view2_scale = (image2, 1) if image2.size == image1.size else (work2, level)
+    registration = None
+    if params.register:
+        if view2_scale == 1 and not drafted:
+            registration = register(image1, view2, reduced=(work1, work2), level=level)
+            view2 = translate(view2, image1, registration)
+            if level == 1:
+                work2 = view2
+            elif view2 is not image2:
+                # Рабочий уровень строится из совмещённого кадра: сдвиг на уровне
+                # был бы точен лишь до его пикселя, и остаток выглядел бы изменением
+                work2 = decimate(view2, level)
+        else:
+            # Полного разрешения нет (снимок другого размера) или оно не декодировано:
+            # сдвиг оценивается и применяется на рабочем уровне
+            registration = register(work1, work2).scaled(level)
+            work2 = translate(work2, work1, registration, level)
+            view2 = work2 if view2_scale != 1 else translate(view2, image1, registration)
+
+    progress.stage('diff')
+    # Рабочие уровни быстрого режима уже 8-битные: в собственном типе сравниваются только полные
+    native = native_kernel(work1, work2) if spectral is None else None
+    kernel, dtype = select_kernel(mode, spectral, native)
+    scale, screened = level, False
+    diff_array = stats = None
+    if mode.screening and spectral is None and native is None:
+        factor = fit_factor(work1.size, SCREEN_MAX_SIDE)
+        coarse_array, coarse_stats = whole_difference(decimate(work1, factor), decimate(work2, factor), kernel)
+        if coarse_stats.percentile(99) <= SCREEN_LEVEL:
+            diff_array, stats, scale, screened = coarse_array, coarse_stats, level * factor, True
+    if diff_array is None:
+        diff_array, stats = difference(work1, work2, kernel, dtype, params.tile_size, progress)
+    diff_array.flags.writeable = False
+
+    progress.stage('stats')
+    # Пиксель прореженной карты представляет scale² пикселей снимка
+    stats = replace(stats, weight=scale * scale, span=native.span if native is not None else stats.span)
+
+    progress.stage('regions')
+    regions = find_regions(
+        diff_array, scale=scale, frame_size=image1.size,
+        on_strip=lambda done, total: progress.advance(done / total),
+    )
+
+    progress.stage('overview')
+    # Прореженные снимки быстрого режима сразу служат обзорами
+    overview1 = Pyramid.build(image1, top=work1 if level > 1 else None)
+    progress.advance(1 / 3)
+    overview2 = Pyramid.build(view2, scale=view2_scale, top=work2 if level > 1 else None)
+    progress.advance(2 / 3)
+    overview_diff = Pyramid.build(Image.fromarray(diff_array), scale=scale)
+
+    return AnalysisResult(
+        image1=image1,
+        image2=view2,
+        diff_array=diff_array,
+        stats=stats,
+        overview1=overview1,
+        overview2=overview2,
+        overview_diff=overview_diff,
+        mode=mode.key,
+        scale=scale,
+        screened=screened,
+        spectral=spectral.summary() if spectral is not None else None,
+        registration=registration,
+        regions=regions,
+    )
+
+
+class ResultCache:
+    """Потокобезопасный LRU-кэш результатов с ограничением по объёму памяти."""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[tuple, AnalysisResult] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: tuple) -> AnalysisResult | None:
+        with self._lock:
+            result = self._items.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: tuple, result: AnalysisResult) -> None:
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._items.pop(key).nbytes
+            self._items[key] = result
+            self._bytes += result.nbytes
+            self._shrink()
+
+    def refresh(self) -> None:
+        """Пересчитывает объём, когда результаты в кэше выросли (снимки записи из хранилища)."""
+        with self._lock:
+            self._bytes = sum(result.nbytes for result in self._items.values())
+            self._shrink()
+
+    def _shrink(self) -> None:
+        # Последний добавленный результат остаётся, даже если он больше бюджета
+        while self._bytes > self.max_bytes and len(self._items) > 1:
+            _, evicted = self._items.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+
+# Общий кэш процесса: модуль импортируется один раз и переживает перезапуски скрипта
+default_cache = ResultCache()
+
+
+def analyze(data1, data2, params: AnalysisParams | None = None,
+            cache: ResultCache | None = default_cache,
+            progress: ProgressReporter | None = None, store=None,
+            pool=None, on_wait=None, hashes: tuple[str, str] | None = None) -> AnalysisResult:
+    """Сравнение пары снимков с кэшированием по содержимому и параметрам.
+
+    ``store`` — хранилище на диске (``geoscan.store.AnalysisStore``), общее
+    для процессов: промах кэша в памяти сначала ищется там, а посчитанный
+    результат сохраняется в обоих. ``pool`` — ``geoscan.admission.AnalysisPool``:
+    расчёт при промахе ждёт в нём допуска по оценке памяти, ``on_wait`` —
+    как в ``AnalysisPool.run``; найденное в кэше или хранилище отдаётся без очереди.
+    ``hashes`` — уже известные ``content_hash`` снимков: с ними попадание в
+    кэш не читает файлы целиком.
+    """
+    params = params or AnalysisParams()
+    if cache is None and store is None:
+        return _run(data1, data2, params, progress, pool, on_wait)
+    hash1, hash2 = hashes or (content_hash(data1), content_hash(data2))
+    key = (hash1, hash2, params)
+    result = cache.get(key) if cache is not None else None
+    if result is not None:
+        return result
+    if store is not None:
+        result = store.get(hash1, hash2, params, data1, data2, pool=pool,
+                           on_recompute=cache.refresh if cache is not None else None)
+    if result is None:
+        result = _run(data1, data2, params, progress, pool, on_wait)
+        if store is not None:
+            store.put(hash1, hash2, params, result)
+    if cache is not None:
+        cache.put(key, result)
+    return result
+
+
+def _run(data1, data2, params: AnalysisParams, progress, pool, on_wait) -> AnalysisResult:
+    if pool is None:
+        return compute(data1, data2, params, progress)
+    cost = estimate_bytes(data1, data2, params)
+    return pool.run(compute, data1, data2, params, progress, cost=cost, on_wait=on_wait)
@@ -0,0 +1,67 @@
+"""Цветная тепловая карта изменений для показа в интерфейсе.
+
+Карта изменений в 8 битах раскрашивается палитрой из 256 цветов: копия
+уровня переводится в режим ``P`` с этой палитрой, поэтому результат
+занимает байт на пиксель — единственное выделение размером с выход, без
+промежуточных RGB-массивов. Усиление встроено в палитру: значение ``v``
+окрашивается цветом ``min(v · gain, 255)``.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_COLORMAP = 'classic'
+DEFAULT_GAIN = 1.0
+
+
+@dataclass(frozen=True)
+class Colormap:
+    """Палитра, заданная опорными цветами, равномерно расставленными по шкале 0–255."""
+
+    key: str
+    label: str
+    stops: tuple[tuple[int, int, int], ...]
+
+    def colors(self, levels: np.ndarray) -> np.ndarray:
+        """Цвета (N, 3) для уровней 0–255 линейной интерполяцией между опорными."""
+        positions = np.linspace(0, 255, len(self.stops))
+        stops = np.asarray(self.stops, dtype=np.float64)
+        return np.stack([np.interp(levels, positions, stops[:, channel]) for channel in range(3)], axis=1)
+
+
+COLORMAPS = {colormap.key: colormap for colormap in (
+    # Серый с удвоенным красным каналом — прежний вид тепловой карты
+    Colormap('classic', 'Серый с красным', ((0, 0, 0), (255, 128, 128), (255, 255, 255))),
+    Colormap('inferno', 'Inferno', (
+        (0, 0, 4), (40, 11, 84), (101, 21, 110), (159, 42, 99),
+        (212, 72, 66), (245, 125, 21), (250, 193, 39), (252, 255, 164),
+    )),
+    Colormap('turbo', 'Turbo', (
+        (48, 18, 59), (70, 134, 251), (27, 229, 181), (164, 252, 60),
+        (251, 185, 56), (228, 91, 20), (122, 4, 3),
+    )),
+    Colormap('viridis', 'Viridis', ((68, 1, 84), (59, 82, 139), (33, 145, 140), (94, 201, 98), (253, 231, 37))),
+    Colormap('hot', 'Накал', ((0, 0, 0), (255, 0, 0), (255, 255, 0), (255, 255, 255))),
+    Colormap('gray', 'Оттенки серого', ((0, 0, 0), (255, 255, 255))),
+)}
+
+
+@lru_cache(maxsize=64)
+def palette(colormap: str = DEFAULT_COLORMAP, gain: float = DEFAULT_GAIN) -> tuple[int, ...]:
+    """Палитра ``putpalette``: 256 цветов RGB подряд с учётом усиления."""
+    levels = np.minimum(np.arange(256) * gain, 255)
+    colors = COLORMAPS[colormap].colors(levels)
+    return tuple(np.rint(colors).astype(np.uint8).reshape(-1).tolist())
+
+
+def render_heatmap(diff_view: Image.Image, colormap: str = DEFAULT_COLORMAP,
+                   gain: float = DEFAULT_GAIN) -> Image.Image:
+    """Тепловая карта 8-битной карты изменений в режиме ``P``; исходное изображение не меняется."""
+    # Уровень пирамиды общий для всех перезапусков — раскрашивается его копия
+    heatmap = diff_view.copy() if diff_view.mode == 'L' else diff_view.convert('L')
+    heatmap.putpalette(palette(colormap, float(gain)))
+    return heatmap
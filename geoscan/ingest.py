@@ -0,0 +1,160 @@
+"""Приём снимков: пределы по заголовку до декодирования.
+
+Размер кадра читается из заголовка (IFD TIFF или заголовок, который PIL
+разбирает без распаковки данных), и решение принимается до того, как
+декодирование выделит память. Кадр больше ``max_pixels`` отклоняется —
+это же защита от «бомб», крошечных файлов с кадром в десятки
+гигапикселей. Загрузка больше ``max_file_bytes`` (правило «Максимальный
+размер: 20 МБ») или пара, расчёт которой не помещается в бюджет памяти,
+переводится в быстрый режим — предпросмотр, — если он помещается;
+иначе отклоняется.
+
+Снимки читаются прямо из буфера загрузки: ``UploadedFile`` — это
+``BytesIO`` над ``bytes``, и ``getvalue()`` отдаёт их без копии.
+"""
+from __future__ import annotations
+
+import io
+import os
+import threading
+from dataclasses import dataclass, replace
+
+from PIL import Image
+
+from .admission import footprint
+from .modes import FAST, MODES
+from .tiff import open_tiff, open_tiff_path
+
+# Наибольший кадр, который принимается к анализу, пикселей
+MAX_PIXELS = int(os.environ.get('GEOSCAN_MAX_PIXELS') or 500_000_000)
+# Загрузка больше этого объёма анализируется в режиме предпросмотра
+MAX_UPLOAD_BYTES = int(os.environ.get('GEOSCAN_MAX_UPLOAD_BYTES') or 20 * 1024 * 1024)
+
+# Режим предпросмотра для загрузок сверх пределов
+PREVIEW_MODE = FAST.key
+
+# Подмена предела PIL на время открытия снимка — по одной за раз, чтобы
+# исходное значение всегда восстанавливалось
+_pil_limit_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Header:
+    """Заголовок снимка: размер кадра, оконное чтение (поддерживаемый TIFF), объём файла."""
+
+    size: tuple[int, int]
+    windowed: bool
+    file_bytes: int
+
+    @property
+    def pixels(self) -> int:
+        return self.size[0] * self.size[1]
+
+
+@dataclass(frozen=True)
+class Admission:
+    """Параметры, с которыми пара допущена; ``preview`` — с понижением до быстрого режима."""
+
+    params: object
+    preview: bool = False
+    reason: str = ''
+
+
+def source_of(data):
+    """Путь или буфер загрузки без копии — то, из чего читают декодеры."""
+    if isinstance(data, (str, os.PathLike)):
+        return data
+    return data.getvalue() if hasattr(data, 'getvalue') else data
+
+
+def open_image(data, max_pixels: int = MAX_PIXELS) -> Image.Image:
+    """Ленивое ``PIL.Image`` прямо поверх файла или буфера; данные не распаковываются.
+
+    Собственная проверка PIL при открытии идёт по пределу ``max_pixels``:
+    до 2× она лишь предупреждает, и такие кадры отклоняет ``check_pixels``,
+    а выше — бросает ``DecompressionBombError``. ``Image.MAX_IMAGE_PIXELS``
+    подменяется только на время разбора заголовка, и остальной код
+    процесса видит предел PIL по умолчанию.
+    """
+    data = source_of(data)
+    with _pil_limit_lock:
+        limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, max_pixels
+        try:
+            return Image.open(data if isinstance(data, (str, os.PathLike)) else io.BytesIO(data))
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def _megapixels(pixels: int) -> str:
+    return f'{pixels / 1e6:.0f} Мп'
+
+
+def check_pixels(size: tuple[int, int], max_pixels: int = MAX_PIXELS) -> None:
+    """``ValueError``, если кадр ``size`` больше ``max_pixels``."""
+    width, height = size
+    if width * height > max_pixels:
+        raise ValueError(
+            f'Снимок {width}×{height} ({_megapixels(width * height)}) больше допустимых '
+            f'{_megapixels(max_pixels)}'
+        )
+
+
+def read_header(data, max_pixels: int = MAX_PIXELS) -> Header | None:
+    """Заголовок снимка без декодирования; ``None``, если формат не распознан.
+
+    Кадр, который PIL отказывается открыть как «бомбу», — ``ValueError``.
+    """
+    data = source_of(data)
+    if isinstance(data, (str, os.PathLike)):
+        raster, file_bytes = open_tiff_path(data), os.path.getsize(data)
+    else:
+        raster, file_bytes = open_tiff(data), len(data)
+    if raster is not None:
+        return Header(raster.size, True, file_bytes)
+    try:
+        with open_image(data, max_pixels) as image:
+            return Header(image.size, False, file_bytes)
+    except Image.DecompressionBombError as error:
+        raise ValueError(f'Снимок отклонён: {error}') from None
+    except (OSError, ValueError):
+        return None
+
+
+def admit(data1, data2, params, max_pixels: int = MAX_PIXELS,
+          max_file_bytes: int | None = None, max_bytes: int | None = None) -> Admission:
+    """Проверка пары по заголовкам до декодирования.
+
+    ``max_file_bytes`` — предел объёма загрузки, ``max_bytes`` — бюджет
+    памяти расчёта (оценка ``footprint``). Сверх них пара переводится в
+    режим предпросмотра, если там помещается; иначе — ``ValueError``, как
+    и для кадра больше ``max_pixels``. Нераспознанный формат пропускается:
+    ошибку сообщит само декодирование.
+    """
+    header1, header2 = read_header(data1, max_pixels), read_header(data2, max_pixels)
+    if header1 is None or header2 is None:
+        return Admission(params)
+    for header in (header1, header2):
+        check_pixels(header.size, max_pixels)
+    windowed = header1.windowed and header2.windowed
+
+    def fits(candidate) -> bool:
+        return max_bytes is None or footprint(header1.size, header2.size, candidate, windowed) <= max_bytes
+
+    largest = max(header1.file_bytes, header2.file_bytes)
+    if max_file_bytes is not None and largest > max_file_bytes:
+        reason = f'файл {largest / 1024 ** 2:.0f} МБ больше {max_file_bytes / 1024 ** 2:.0f} МБ'
+    elif not fits(params):
+        reason = f'расчёт не помещается в {max_bytes / 1024 ** 2:.0f} МБ памяти'
+    else:
+        return Admission(params)
+    if params.mode == PREVIEW_MODE:
+        # Уже предпросмотр: понижать некуда
+        if fits(params):
+            return Admission(params)
+        raise ValueError(f'Снимки слишком велики для анализа: {reason}')
+    # Предпросмотр — целиком быстрый режим, с его фильтром выравнивания
+    preview = replace(params, mode=PREVIEW_MODE, resample=MODES[PREVIEW_MODE].resample)
+    if not fits(preview):
+        raise ValueError(f'Снимки слишком велики для анализа: {reason}, в том числе в режиме '
+                         f'«{MODES[PREVIEW_MODE].label}»')
+    return Admission(preview, preview=True, reason=reason)
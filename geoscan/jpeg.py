@@ -0,0 +1,74 @@
+"""Декодирование JPEG в уменьшенном масштабе для прореженного анализа.
+
+Декодер JPEG умеет масштабировать изображение в 2, 4 или 8 раз прямо при
+обратном DCT (``Image.draft``), не восстанавливая полный кадр. Если
+анализу нужен уровень, уменьшенный в ``factor`` раз, снимок декодируется
+сразу в этом масштабе (остаток до ``factor`` добирается ``reduce``), а
+полное разрешение декодируется только по запросу фрагмента.
+"""
+from __future__ import annotations
+
+import math
+
+from PIL import Image
+
+from .ingest import open_image
+from .pyramid import fit_factor
+
+
+class DraftImage:
+    """JPEG, декодированный на уровне, уменьшенном в ``factor`` раз; кадр — в полном размере."""
+
+    mode = 'RGB'
+
+    def __init__(self, source, size: tuple[int, int], reduced: Image.Image, factor: int):
+        self._source = source
+        self.size = size
+        self.reduced = reduced
+        self.factor = factor
+        self._full = None
+
+    @property
+    def nbytes(self) -> int:
+        images = [self.reduced] + ([self._full] if self._full is not None else [])
+        return sum(image.width * image.height * 3 for image in images)
+
+    def getbands(self) -> tuple[str, ...]:
+        return 'R', 'G', 'B'
+
+    def to_image(self) -> Image.Image:
+        """Полное разрешение; декодируется при первом обращении."""
+        if self._full is None:
+            self._full = open_image(self._source).convert('RGB')
+        return self._full
+
+    def crop(self, box: tuple[int, int, int, int]) -> Image.Image:
+        return self.to_image().crop(box)
+
+    def reduce(self, factor: int) -> Image.Image:
+        if factor % self.factor == 0:
+            rest = factor // self.factor
+            return self.reduced if rest == 1 else self.reduced.reduce(rest)
+        return self.to_image().reduce(factor)
+
+
+def open_draft(source, max_side: int) -> DraftImage | None:
+    """JPEG, уменьшенный до наибольшей стороны не больше ``max_side``; иначе ``None``.
+
+    ``None`` — не JPEG или уменьшать не нужно: вызывающий код декодирует
+    снимок обычным путём.
+    """
+    image = open_image(source)
+    if image.format != 'JPEG':
+        return None
+    factor = fit_factor(image.size, max_side)
+    if factor == 1:
+        return None
+    width, height = image.size
+    image.draft('RGB', (math.ceil(width / factor), math.ceil(height / factor)))
+    # draft выбирает масштаб 1/2, 1/4 или 1/8 не меньше запрошенного размера
+    scale = round(width / image.width)
+    reduced = image.convert('RGB')
+    if scale < factor:
+        reduced = reduced.reduce(factor // scale)
+    return DraftImage(source, (width, height), reduced, factor)
@@ -0,0 +1,118 @@
+"""Режимы анализа: каждый — отдельная конфигурация вычислений движка.
+
+Оценки скорости и точности в ``tradeoff`` измерены ``reference_benchmark``
+на синтетической паре 6000×4000 с известной областью изменений; эталон
+точности — режим «Высокая точность».
+"""
+from __future__ import annotations
+
+import io
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+
+@dataclass(frozen=True)
+class AnalysisMode:
+    key: str
+    label: str
+    resample: Image.Resampling
+    # Наибольшая сторона уровня анализа; None — полное разрешение
+    max_side: int | None = None
+    # Разница по каналам в float32 вместо 8-битной разницы яркости
+    precise: bool = False
+    # Предварительный скрининг на грубом уровне с досрочным выходом
+    screening: bool = False
+    tradeoff: str = ''
+
+
+STANDARD = AnalysisMode(
+    key='standard',
+    label='Стандартный',
+    resample=Image.Resampling.BICUBIC,
+    tradeoff='8-битная разница яркости в полном разрешении. '
+             'Базовая скорость; отклонение от высокой точности < 0.01 п.п.',
+)
+
+PRECISE = AnalysisMode(
+    key='precise',
+    label='Высокая точность',
+    resample=Image.Resampling.LANCZOS,
+    precise=True,
+    tradeoff='Разница по каналам в float32, выравнивание фильтром Ланцоша. '
+             '≈ 2× медленнее стандартного; эталон точности.',
+)
+
+FAST = AnalysisMode(
+    key='fast',
+    label='Быстрый анализ',
+    resample=Image.Resampling.BILINEAR,
+    max_side=1024,
+    screening=True,
+    tradeoff='Анализ на уровне не больше 1024 px со скринингом. '
+             '≈ 2.5× быстрее стандартного; усреднение гасит шум и мелкие изменения '
+             '(на эталонной паре доля изменений занижена на ≈ 2 п.п.).',
+)
+
+MODES = {mode.key: mode for mode in (STANDARD, PRECISE, FAST)}
+
+# Фильтры выравнивания снимков разного размера, которые можно выбрать вместо фильтра режима
+RESAMPLE_FILTERS = {
+    'nearest': Image.Resampling.NEAREST,
+    'bilinear': Image.Resampling.BILINEAR,
+    'bicubic': Image.Resampling.BICUBIC,
+    'lanczos': Image.Resampling.LANCZOS,
+}
+
+# Сторона уровня предварительного скрининга быстрого режима
+SCREEN_MAX_SIDE = 256
+
+# Если 99 % разницы на уровне скрининга не выше этого уровня, пара считается неизменной
+SCREEN_LEVEL = 8
+
+
+def mode_by_label(label: str) -> AnalysisMode:
+    for mode in MODES.values():
+        if mode.label == label:
+            return mode
+    raise KeyError(label)
+
+
+def reference_pair(size: tuple[int, int] = (6000, 4000), seed: int = 0) -> tuple[bytes, bytes]:
+    """Синтетическая пара несжатых TIFF: плавный фон с шумом и изменённый прямоугольник.
+
+    Несжатый TIFF читается оконным растром почти без затрат, поэтому
+    замер отражает вычисления режима, а не декодирование.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = (np.sin(x / 97.0) + np.cos(y / 61.0)) * 60 + 128
+    before = np.clip(base[..., None] + rng.normal(0, 6, (height, width, 3)), 0, 255).astype(np.uint8)
+    after = np.clip(base[..., None] + rng.normal(0, 6, (height, width, 3)), 0, 255).astype(np.uint8)
+    after[height // 4:height // 2, width // 3:width // 2] = (200, 180, 90)
+    encoded = []
+    for array in (before, after):
+        buffer = io.BytesIO()
+        Image.fromarray(array).save(buffer, 'TIFF')
+        encoded.append(buffer.getvalue())
+    return encoded[0], encoded[1]
+
+
+def reference_benchmark(size: tuple[int, int] = (6000, 4000)) -> dict[str, dict[str, float]]:
+    """Время и отклонение доли изменений каждого режима от режима высокой точности."""
+    from .engine import AnalysisParams, compute
+
+    data1, data2 = reference_pair(size)
+    results = {}
+    for key in MODES:
+        started = time.perf_counter()
+        result = compute(data1, data2, AnalysisParams.for_mode(key))
+        results[key] = {'seconds': time.perf_counter() - started, 'change_percent': result.change_percent}
+    reference = results[PRECISE.key]['change_percent']
+    for values in results.values():
+        values['error'] = abs(values['change_percent'] - reference)
+    return results
+
@@ -0,0 +1,115 @@
+"""Поэтапный отчёт о ходе анализа с ограничением частоты обновлений."""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable
+
+# Этапы конвейера: ключ, подпись для интерфейса, доля общей шкалы
+STAGES = (
+    ('decode', 'ДЕКОДИРОВАНИЕ СНИМКОВ', 0.30),
+    ('align', 'ВЫРАВНИВАНИЕ СНИМКОВ', 0.10),
+    ('diff', 'ВЫЧИСЛЕНИЕ РАЗЛИЧИЙ', 0.25),
+    ('stats', 'РАСЧЁТ СТАТИСТИКИ', 0.05),
+    ('regions', 'ВЫДЕЛЕНИЕ ОБЛАСТЕЙ ИЗМЕНЕНИЙ', 0.05),
+    ('overview', 'ПОСТРОЕНИЕ ОБЗОРОВ', 0.10),
+    ('render', 'ВИЗУАЛИЗАЦИЯ', 0.15),
+)
+
+DONE_LABEL = 'АНАЛИЗ ЗАВЕРШЁН'
+
+ProgressCallback = Callable[[float, str, float], None]
+
+
+class ProgressReporter:
+    """Переводит события этапов в общую долю выполнения 0..1.
+
+    ``callback(fraction, label, elapsed)`` вызывается только когда доля
+    действительно выросла и не чаще одного раза в ``min_interval`` секунд.
+    Отложенное частотой обновление сообщается при смене этапа, так что
+    последняя доля этапа не теряется; завершение сообщается всегда.
+    """
+
+    def __init__(self, callback: ProgressCallback | None = None,
+                 min_interval: float = 0.25, clock: Callable[[], float] = time.perf_counter):
+        self.callback = callback
+        self.min_interval = min_interval
+        self.clock = clock
+        self.started = clock()
+        self._offsets = {}
+        offset = 0.0
+        for name, label, weight in STAGES:
+            self._offsets[name] = (offset, weight, label)
+            offset += weight
+        self._stage = None
+        self._fraction = 0.0
+        self._emitted = -1.0
+        self._emitted_at = None
+
+    @property
+    def elapsed(self) -> float:
+        return self.clock() - self.started
+
+    @property
+    def fraction(self) -> float:
+        return self._fraction
+
+    def stage(self, name: str) -> None:
+        """Начало этапа ``name``."""
+        self.flush()
+        self._stage = name
+        self._set(self._offsets[name][0])
+
+    def advance(self, done: float) -> None:
+        """Доля ``done`` (0..1) текущего этапа выполнена."""
+        offset, weight, _ = self._offsets[self._stage]
+        self._set(offset + weight * min(max(done, 0.0), 1.0))
+
+    def finish(self) -> None:
+        self._stage = None
+        self._set(1.0, force=True)
+
+    def flush(self) -> None:
+        """Сообщает обновление, отложенное ограничением частоты, если оно есть."""
+        if self._stage is not None:
+            self._set(self._fraction, force=True)
+
+    def _set(self, fraction: float, force: bool = False) -> None:
+        self._fraction = max(self._fraction, fraction)
+        if self.callback is None or self._fraction <= self._emitted:
+            return
+        now = self.clock()
+        if not force and self._emitted_at is not None and now - self._emitted_at < self.min_interval:
+            return
+        self._emitted = self._fraction
+        self._emitted_at = now
+        label = self._offsets[self._stage][2] if self._stage else DONE_LABEL
+        self.callback(self._fraction, label, now - self.started)
+
+
+class ProgressRelay:
+    """Передаёт отчёты о ходе из потоков пула в поток, который их показывает.
+
+    Обёрнутый ``wrap`` обратный вызов в потоке-владельце (где создан
+    relay) срабатывает сразу, а в других потоках только запоминается —
+    последний отчёт показывается при ``replay()`` из потока-владельца.
+    Элементы Streamlit обновляются только из потока своей сессии.
+    """
+
+    def __init__(self):
+        self._owner = threading.get_ident()
+        self._pending = None
+
+    def wrap(self, callback: ProgressCallback) -> ProgressCallback:
+        def relay(*args) -> None:
+            if threading.get_ident() == self._owner:
+                callback(*args)
+            else:
+                self._pending = (callback, args)
+        return relay
+
+    def replay(self) -> None:
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            callback, args = pending
+            callback(*args)
@@ -0,0 +1,126 @@
+"""Пирамида обзорных уровней для показа снимков в интерфейсе.
+
+Уровни уменьшены в степень двойки раз усреднением по площади
+(``Image.reduce``). Самый детальный уровень строится из источника по
+тайлам, поэтому растр или карта изменений в файле не читаются в память
+целиком; полное разрешение выдаётся только по запросу через ``region``.
+"""
+from __future__ import annotations
+
+from PIL import Image
+
+from .tiling import DEFAULT_TILE_SIZE, iter_tiles
+
+# Наибольшая сторона самого детального обзорного уровня
+OVERVIEW_MAX_SIDE = 2048
+
+# Уровни строятся, пока наибольшая сторона не станет не больше этой
+OVERVIEW_MIN_SIDE = 128
+
+Box = tuple[int, int, int, int]
+
+
+def reduce_tiled(source, factor: int, tile_size: int = DEFAULT_TILE_SIZE) -> Image.Image:
+    """Уменьшение в ``factor`` раз по тайлам, кратным ``factor``.
+
+    Границы тайлов совпадают с границами блоков усреднения, поэтому
+    результат равен ``source.reduce(factor)`` для целого изображения.
+    """
+    width, height = source.size
+    step = max(factor, tile_size // factor * factor)
+    out = Image.new(source.mode, (-(-width // factor), -(-height // factor)))
+    for box in iter_tiles(width, height, step):
+        left, top = box[0] // factor, box[1] // factor
+        out.paste(source.crop(box).reduce(factor), (left, top))
+    return out
+
+
+def decimate(image, factor: int):
+    """Уменьшение в ``factor`` раз усреднением по площади; при 1 — источник как есть."""
+    if factor == 1:
+        return image
+    # PIL-изображения и JPEG, декодированные в уменьшенном масштабе, уменьшаются сами
+    if hasattr(image, 'reduce'):
+        return image.reduce(factor)
+    return reduce_tiled(image, factor)
+
+
+def fit_factor(size: tuple[int, int], max_side: int) -> int:
+    """Наименьшая степень двойки, после деления на которую сторона не больше ``max_side``."""
+    factor = 1
+    while max(size) > max_side * factor:
+        factor *= 2
+    return factor
+
+
+def _display(image: Image.Image) -> Image.Image:
+    # Дробная карта изменений показывается в 8 битах с округлением
+    if image.mode == 'F':
+        return image.point(lambda value: value + 0.5).convert('L')
+    return image
+
+
+class Pyramid:
+    """Источник и его обзорные уровни от крупного к мелкому.
+
+    ``scale`` — во сколько раз источник меньше кадра, в координатах
+    которого запрашиваются фрагменты (карта изменений быстрого режима).
+    """
+
+    def __init__(self, source, levels: list[Image.Image], scale: int = 1):
+        self.source = source
+        self.levels = levels
+        self.scale = scale
+
+    @classmethod
+    def build(cls, source, max_side: int = OVERVIEW_MAX_SIDE,
+              min_side: int = OVERVIEW_MIN_SIDE, scale: int = 1, top=None) -> Pyramid:
+        """``top`` — уже уменьшенная копия источника, чтобы не читать его ещё раз."""
+        if top is None:
+            top = decimate(source, fit_factor(source.size, max_side))
+        if not isinstance(top, Image.Image):
+            top = top.crop((0, 0) + top.size)
+        levels = [top]
+        while max(levels[-1].size) > min_side:
+            levels.append(levels[-1].reduce(2))
+        return cls(source, [_display(level) for level in levels], scale)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        width, height = self.source.size
+        return width * self.scale, height * self.scale
+
+    @property
+    def nbytes(self) -> int:
+        levels = self.levels if self.levels[0] is not self.source else self.levels[1:]
+        return sum(level.width * level.height * len(level.getbands()) for level in levels)
+
+    def level_for(self, width: int) -> Image.Image:
+        """Наименьший обзорный уровень не уже ``width`` пикселей (или самый детальный)."""
+        for level in reversed(self.levels):
+            if level.width >= width:
+                return level
+        return self.levels[0]
+
+    def region(self, box: Box) -> Image.Image:
+        """Фрагмент в полном разрешении кадра."""
+        if self.scale == 1:
+            return _display(self.source.crop(box))
+        scale = self.scale
+        left, top, right, bottom = box
+        coarse = (left // scale, top // scale, -(-right // scale), -(-bottom // scale))
+        upscaled = self.source.crop(coarse).resize(
+            ((coarse[2] - coarse[0]) * scale, (coarse[3] - coarse[1]) * scale),
+            Image.Resampling.NEAREST,
+        )
+        offset_x, offset_y = coarse[0] * scale, coarse[1] * scale
+        return _display(upscaled.crop((left - offset_x, top - offset_y, right - offset_x, bottom - offset_y)))
+
+
+def window_around(size: tuple[int, int], fx: float, fy: float, side: int) -> Box:
+    """Окно ``side``×``side`` с центром в долях ``fx``, ``fy`` кадра, прижатое к краям."""
+    width, height = size
+    side_x, side_y = min(side, width), min(side, height)
+    left = min(max(round(fx * width) - side_x // 2, 0), width - side_x)
+    top = min(max(round(fy * height) - side_y // 2, 0), height - side_y)
+    return left, top, left + side_x, top + side_y
@@ -0,0 +1,100 @@
+"""Радиометрическая нормализация снимка «после» по снимку «до».
+
+Сезонная разница освещённости сдвигает яркости всего кадра, и сырая
+разница принимает её за изменение. Снимок «после» приводится к
+радиометрии снимка «до» поканальной таблицей 256 значений: таблица
+строится только по гистограммам каналов обоих снимков (по уровню
+пирамиды не больше ``SAMPLE_MAX_SIDE``), а применяется ``Image.point`` —
+один проход по пикселям; для растров и других ленивых источников — по
+окнам, при их чтении.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from .pyramid import decimate, fit_factor
+from .tiling import Box, window
+
+# Наибольшая сторона уровня, по которому считаются гистограммы
+SAMPLE_MAX_SIDE = 2048
+
+LEVELS = np.arange(256, dtype=np.float64)
+
+
+@dataclass(frozen=True)
+class Normalization:
+    key: str
+    label: str
+    description: str
+
+
+NORMALIZATIONS = {normalization.key: normalization for normalization in (
+    Normalization('histogram', 'Согласование гистограмм',
+                  'Распределение яркостей каждого канала приводится к снимку «до»'),
+    Normalization('linear', 'Линейная (усиление и смещение)',
+                  'Среднее и разброс каждого канала приводятся к снимку «до»'),
+)}
+
+
+def band_histograms(image) -> np.ndarray:
+    """Гистограммы каналов формы (каналы, 256) по уровню не больше ``SAMPLE_MAX_SIDE``."""
+    sample = decimate(image, fit_factor(image.size, SAMPLE_MAX_SIDE))
+    sample = window(sample, (0, 0) + sample.size)
+    return np.asarray(sample.histogram(), dtype=np.float64).reshape(-1, 256)
+
+
+def match_histogram(reference: np.ndarray, moving: np.ndarray) -> np.ndarray:
+    """Таблица, переводящая распределение ``moving`` в распределение ``reference``."""
+    reference_cdf = np.cumsum(reference) / max(reference.sum(), 1)
+    moving_cdf = np.cumsum(moving) / max(moving.sum(), 1)
+    # Уровень «после» переходит в первый уровень «до» с не меньшей накопленной долей
+    return np.minimum(np.searchsorted(reference_cdf, moving_cdf - 1e-12), 255)
+
+
+def match_linear(reference: np.ndarray, moving: np.ndarray) -> np.ndarray:
+    """Таблица ``gain · v + offset``, совмещающая среднее и СКО ``moving`` с ``reference``."""
+    def moments(histogram):
+        total = max(histogram.sum(), 1)
+        mean = (histogram @ LEVELS) / total
+        return mean, np.sqrt((histogram @ (LEVELS - mean) ** 2) / total)
+
+    reference_mean, reference_std = moments(reference)
+    moving_mean, moving_std = moments(moving)
+    gain = reference_std / moving_std if moving_std > 0 else 1.0
+    return np.clip(np.rint(gain * (LEVELS - moving_mean) + reference_mean), 0, 255)
+
+
+_METHODS = {'histogram': match_histogram, 'linear': match_linear}
+
+
+def fit_lut(reference, moving, method: str) -> list[int]:
+    """Поканальная таблица для ``Image.point``: 256 значений на каждый канал ``moving``."""
+    match = _METHODS[method]
+    tables = [match(band1, band2) for band1, band2 in zip(band_histograms(reference), band_histograms(moving))]
+    return np.concatenate(tables).astype(np.uint8).tolist()
+
+
+class Remapped:
+    """Ленивый источник, окна которого читаются через таблицу ``lut``."""
+
+    def __init__(self, source, lut: list[int]):
+        self.source = source
+        self.lut = lut
+        self.size = source.size
+        self.mode = source.mode
+
+    def getbands(self) -> tuple[str, ...]:
+        return self.source.getbands()
+
+    def crop(self, box: Box) -> Image.Image:
+        return window(self.source, box).point(self.lut)
+
+
+def remap(image, lut: list[int]):
+    """Снимок через таблицу: PIL-изображение — сразу, одним проходом; иной источник — по окнам."""
+    if isinstance(image, Image.Image):
+        return image.point(lut)
+    return Remapped(image, lut)
@@ -0,0 +1,163 @@
+"""Совмещение снимков фазовой корреляцией перед вычислением разницы.
+
+Сдвиг снимка «после» относительно снимка «до» оценивается в два шага:
+грубо — по уровню пирамиды не больше ``COARSE_MAX_SIDE``, затем уточняется
+в полном разрешении по центральному окну ``REFINE_SIZE`` с поправкой на
+грубый сдвиг. Так стоимость не зависит от размера сцены: полное
+разрешение читается только в одном окне. Сдвиг применяется лениво —
+``Translated`` отдаёт окна сдвинутого источника без копии всего кадра.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from .pyramid import decimate, fit_factor
+from .tiling import Box, window
+
+# Наибольшая сторона уровня грубой оценки
+COARSE_MAX_SIDE = 512
+
+# Сторона окна уточнения в полном разрешении
+REFINE_SIZE = 1024
+
+# Ниже этой высоты пика корреляции сдвиг считается ненадёжным и не применяется
+MIN_CONFIDENCE = 0.05
+
+
+@dataclass(frozen=True)
+class Registration:
+    """Сдвиг снимка «после»: точка ``(x, y)`` снимка «до» совпадает с ``(x + dx, y + dy)``."""
+
+    dx: float
+    dy: float
+    # Высота пика фазовой корреляции: 1 — точное совпадение, около 0 — общего нет
+    confidence: float
+    applied: bool
+
+    def scaled(self, level: int) -> Registration:
+        """Сдвиг, оценённый на уровне, прореженном в ``level`` раз, — в пикселях полного кадра."""
+        return Registration(self.dx * level, self.dy * level, self.confidence, self.applied)
+
+    @property
+    def offset(self) -> tuple[int, int]:
+        """Целочисленный сдвиг, с которым снимок «после» читается при сравнении."""
+        return (round(self.dx), round(self.dy)) if self.applied else (0, 0)
+
+
+def _gray(image, box: Box | None = None) -> np.ndarray:
+    tile = window(image, box or (0, 0) + image.size)
+    return np.asarray(tile.convert('L'), dtype=np.float32)
+
+
+def _subpixel(before: float, peak: float, after: float) -> float:
+    # Вершина параболы через три соседние точки пика
+    denominator = before - 2 * peak + after
+    return 0.5 * (before - after) / denominator if denominator else 0.0
+
+
+def phase_correlation(reference: np.ndarray, moving: np.ndarray) -> tuple[float, float, float]:
+    """Сдвиг ``(dx, dy)`` содержимого ``moving`` относительно ``reference`` и высота пика."""
+    height, width = reference.shape
+    taper = np.outer(np.hanning(height), np.hanning(width)).astype(np.float32)
+    spectrum1 = np.fft.rfft2((reference - reference.mean()) * taper)
+    spectrum2 = np.fft.rfft2((moving - moving.mean()) * taper)
+    cross = spectrum2 * np.conj(spectrum1)
+    cross /= np.maximum(np.abs(cross), 1e-12)
+    surface = np.fft.irfft2(cross, s=(height, width))
+    row, column = np.unravel_index(int(np.argmax(surface)), surface.shape)
+    peak = float(surface[row, column])
+    dy = row + _subpixel(surface[row - 1, column], peak, surface[(row + 1) % height, column])
+    dx = column + _subpixel(surface[row, column - 1], peak, surface[row, (column + 1) % width])
+    # Пик за половиной периода — отрицательный сдвиг
+    if dy > height / 2:
+        dy -= height
+    if dx > width / 2:
+        dx -= width
+    return float(dx), float(dy), peak
+
+
+def register(reference, moving, reduced: tuple | None = None, level: int = 1) -> Registration:
+    """Оценка сдвига ``moving`` относительно ``reference`` того же размера.
+
+    ``reduced`` — та же пара, уже прореженная в ``level`` раз (рабочий
+    уровень быстрого режима): грубый уровень строится из неё, а не из
+    полного разрешения.
+    """
+    width, height = reference.size
+    coarse1, coarse2 = reduced or (reference, moving)
+    factor = fit_factor(coarse1.size, COARSE_MAX_SIDE)
+    dx, dy, confidence = phase_correlation(
+        _gray(decimate(coarse1, factor)), _gray(decimate(coarse2, factor)),
+    )
+    factor *= level
+    dx, dy = round(dx * factor), round(dy * factor)
+
+    # Уточнение: центральное окно перекрытия, сдвинутое на грубую оценку
+    side_x = min(REFINE_SIZE, width - abs(dx))
+    side_y = min(REFINE_SIZE, height - abs(dy))
+    if side_x >= 16 and side_y >= 16:
+        left = max(0, -dx) + (width - abs(dx) - side_x) // 2
+        top = max(0, -dy) + (height - abs(dy) - side_y) // 2
+        box = (left, top, left + side_x, top + side_y)
+        shifted = (left + dx, top + dy, left + dx + side_x, top + dy + side_y)
+        residual_x, residual_y, confidence = phase_correlation(_gray(reference, box), _gray(moving, shifted))
+        dx, dy = dx + residual_x, dy + residual_y
+    return Registration(dx, dy, confidence, applied=confidence >= MIN_CONFIDENCE)
+
+
+class Translated:
+    """Источник, сдвинутый на целый вектор, в кадре опорного снимка.
+
+    Область кадра, для которой у сдвинутого снимка нет данных, берётся из
+    опорного снимка, поэтому разница там нулевая, а не ложное изменение.
+    """
+
+    def __init__(self, source, reference, offset: tuple[int, int]):
+        self.source = source
+        self.reference = reference
+        self.dx, self.dy = offset
+        self.size = reference.size
+        self.mode = source.mode
+
+    def getbands(self) -> tuple[str, ...]:
+        return self.source.getbands()
+
+    def _boxes(self, box: Box) -> tuple[Box, Box | None]:
+        left, top, right, bottom = box
+        shifted = (left + self.dx, top + self.dy, right + self.dx, bottom + self.dy)
+        width, height = self.source.size
+        inner = (max(shifted[0], 0), max(shifted[1], 0), min(shifted[2], width), min(shifted[3], height))
+        if inner[0] >= inner[2] or inner[1] >= inner[3]:
+            return shifted, None
+        return shifted, inner
+
+    def crop(self, box: Box) -> Image.Image:
+        shifted, inner = self._boxes(box)
+        if inner == shifted:
+            return window(self.source, shifted)
+        out = self.reference.crop(box).convert(self.mode)
+        if inner is not None:
+            out.paste(window(self.source, inner), (inner[0] - shifted[0], inner[1] - shifted[1]))
+        return out
+
+    def read_bands(self, box: Box) -> np.ndarray:
+        shifted, inner = self._boxes(box)
+        if inner == shifted:
+            return self.source.read_bands(shifted)
+        out = np.array(self.reference.read_bands(box))
+        if inner is not None:
+            left, top = inner[0] - shifted[0], inner[1] - shifted[1]
+            out[:, top:top + inner[3] - inner[1], left:left + inner[2] - inner[0]] = self.source.read_bands(inner)
+        return out
+
+
+def translate(image, reference, registration: Registration, level: int = 1):
+    """Снимок, совмещённый с ``reference``; сдвиг задан в полном разрешении, ``level`` — прореживание."""
+    dx, dy = registration.offset
+    offset = (round(dx / level), round(dy / level))
+    if offset == (0, 0) and image.size == reference.size:
+        return image
+    return Translated(image, reference, offset)
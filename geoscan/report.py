@@ -0,0 +1,247 @@
+"""Отчёты по результату анализа: текст, статистика JSON, области CSV и GeoJSON.
+
+Всё строится из уже посчитанных ``DiffStats``, ``ChangeRegions`` и сетки
+блоков, которую результат запоминает после первого прохода по карте.
+``Reports`` собирает отчёт только при
+первом запросе (кнопка скачивания) и запоминает его для своего
+результата, поэтому перезапуски скрипта их не пересобирают.
+
+Координаты областей — в пикселях снимка «до»: x вправо, y вниз. Снимки
+не несут привязки, которую читал бы движок, поэтому полигоны GeoJSON —
+рамки областей в этой же пиксельной системе.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from .engine import AnalysisResult
+from .regions import ChangeRegions
+from .stats import CHANGED_LEVEL
+
+# Колонки таблицы областей — ключи ChangeRegions.rows()
+REGION_COLUMNS = (
+    'id', 'area', 'left', 'top', 'right', 'bottom', 'centroid_x', 'centroid_y', 'mean_intensity',
+)
+
+
+def status(result: AnalysisResult, threshold: float, block_size: int | None = None,
+           level: float | None = None) -> str:
+    """``anomaly`` или ``normal``; с ``block_size`` — по любому блоку сетки.
+
+    ``level`` — автоматический уровень изменений: с порогом сравнивается
+    доля пикселей выше него, а не средняя разница.
+    """
+    return 'anomaly' if result.exceeds(threshold, block_size, level) else 'normal'
+
+
+def summary(result: AnalysisResult, threshold: float, block_size: int | None = None,
+            level: float | None = None) -> dict:
+    """Сводка результата для машинной обработки; ключи — как в строках пакетной обработки.
+
+    ``block_size`` — правило аномалии по любому блоку; сетка в сводке —
+    этого размера. Без правила в сводку попадает сетка, которую результат
+    уже посчитал (например, для показа), а если её нет — ``blocks`` равно
+    ``None``: ради сводки по карте не делается отдельный проход.
+    ``level`` — автоматический уровень изменений, как в ``status``.
+    """
+    stats, regions = result.stats, result.regions
+    share = level is not None
+    grid_level = level if share else CHANGED_LEVEL
+    grid = result.grid(block_size, grid_level) if block_size else result.cached_grid(level=grid_level)
+    width, height = result.size
+    registration = result.registration
+    spectral = result.spectral
+    return {
+        'mode': result.mode,
+        'width': width,
+        'height': height,
+        'megapixels': round(width * height / 1e6, 3),
+        'scale': result.scale,
+        'screened': result.screened,
+        'threshold': threshold,
+        'similarity': round(result.similarity, 4),
+        'change_percent': round(result.change_percent, 4),
+        'status': status(result, threshold, block_size, level),
+        'rule': 'block' if block_size else 'scene',
+        'auto_level': {
+            'level': level,
+            'changed_share': round(stats.changed_share(level), 4),
+        } if share else None,
+        'stats': {
+            'mean': round(stats.mean, 4),
+            'std': round(stats.std, 4),
+            'max': round(float(stats.max), 4),
+            'median': stats.percentile(50),
+            'p95': stats.percentile(95),
+            'changed_level': CHANGED_LEVEL,
+            # Единиц данных снимков на 255 карты: 255 — 8-битная разница, иначе — диапазон растров
+            'span': stats.span,
+            'changed_pixels': stats.changed_pixels,
+            # Гистограмма — по пикселям карты; каждый представляет weight пикселей снимка
+            'weight': stats.weight,
+            'histogram': stats.histogram.tolist(),
+        },
+        'blocks': {
+            'block_size': grid.block_size,
+            'rows': grid.shape[0],
+            'columns': grid.shape[1],
+            'peak_block_percent': round(grid.peak_percent, 4),
+            'blocks_above': grid.blocks_above(threshold, share),
+            # Доля изменений каждого блока, %, строки сверху вниз
+            'change_percent': np.round(grid.change_percent, 4).tolist(),
+            **({'changed_share': np.round(grid.changed_percent, 4).tolist()} if share else {}),
+        } if grid is not None else None,
+        'regions': {
+            'count': regions.count,
+            'listed': len(regions),
+            'total_area': regions.total_area,
+            'largest_region': int(regions.area[0]) if len(regions) else 0,
+        } if regions is not None else None,
+        'registration': {
+            'shift_x': registration.offset[0],
+            'shift_y': registration.offset[1],
+            'confidence': round(registration.confidence, 4),
+            'applied': registration.applied,
+        } if registration is not None else None,
+        'spectral': {
+            'index': spectral.index,
+            'mean_delta': spectral.mean_delta,
+            'band_differences': list(spectral.band_differences),
+        } if spectral is not None else None,
+    }
+
+
+def stats_json(result: AnalysisResult, threshold: float, block_size: int | None = None,
+               level: float | None = None) -> bytes:
+    return json.dumps(summary(result, threshold, block_size, level), ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def regions_csv(regions: ChangeRegions) -> bytes:
+    text = io.StringIO()
+    writer = csv.DictWriter(text, REGION_COLUMNS, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(regions.rows())
+    return text.getvalue().encode('utf-8')
+
+
+def regions_geojson(regions: ChangeRegions) -> bytes:
+    """Рамки областей как полигоны GeoJSON в пикселях снимка «до»."""
+    features = []
+    for row in regions.rows():
+        left, top, right, bottom = row['left'], row['top'], row['right'], row['bottom']
+        features.append({
+            'type': 'Feature',
+            'id': row['id'],
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[[left, top], [right, top], [right, bottom], [left, bottom], [left, top]]],
+            },
+            'properties': row,
+        })
+    collection = {'type': 'FeatureCollection', 'features': features}
+    return json.dumps(collection, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def text_report(result: AnalysisResult, threshold: float, settings: dict[str, str],
+                block_size: int | None = None, level: float | None = None,
+                when: datetime | None = None) -> str:
+    """Текстовый отчёт; ``settings`` — подписи параметров анализа из интерфейса."""
+    when = when or datetime.now()
+    stats = result.stats
+    anomaly = status(result, threshold, block_size, level) == 'anomaly'
+    share = level is not None
+    change_percent = result.change_measure(None, level)
+    lines = [
+        '==================================',
+        'ОТЧЁТ ОБ АНАЛИЗЕ TERRAIN SCANNER',
+        '==================================',
+        '',
+        f'Дата анализа: {when.date()}',
+        f'Время анализа: {when.strftime("%H:%M:%S")}',
+        '',
+        '--------------------------------',
+        'ПАРАМЕТРЫ АНАЛИЗА:',
+        '--------------------------------',
+        f'• Порог обнаружения: {threshold}%',
+        f'• Правило аномалии: {f"любой блок {block_size} пикс" if block_size else "вся сцена"}',
+        *([f'• Уровень изменений: {level:g} из 255 (автоматически)'] if share else []),
+        *(f'• {label}: {value}' for label, value in settings.items()),
+        '',
+        '--------------------------------',
+        'РЕЗУЛЬТАТЫ:',
+        '--------------------------------',
+        f'• Сходство изображений: {result.similarity:.1f}%',
+        f'• Обнаружено изменений: {change_percent:.2f}%',
+        f'• Статус: {"АНОМАЛИЯ" if anomaly else "НОРМА"}',
+        f'• Эффективность анализа: {100 - result.change_percent * 0.5:.1f}%',
+        '',
+        '--------------------------------',
+        'ДЕТАЛЬНАЯ СТАТИСТИКА:',
+        '--------------------------------',
+        f'• Всего пикселей: {result.sample_count:,}',
+        f'• Изменённых пикселей: {stats.pixels_above(level) if share else stats.changed_pixels:,}',
+        f'• Макс. интенсивность: {stats.max:.1f}',
+        f'• Сред. интенсивность: {stats.mean:.2f}',
+    ]
+    if stats.rescaled:
+        lines.append(f'• Шкала разницы: 255 = {stats.span:g} ед. данных, '
+                     f'макс. разница {stats.in_data_units(stats.max):g} ед.')
+    if block_size:
+        grid = result.grid(block_size, level if share else CHANGED_LEVEL)
+        lines.append(f'• Наибольшая доля изменений блока: {grid.peak(share):.2f}%, '
+                     f'блоков выше порога: {grid.blocks_above(threshold, share)} из {grid.mean.size}')
+    if result.regions is not None:
+        lines.append(f'• Областей изменений: {result.regions.count:,}, '
+                     f'общая площадь {result.regions.total_area:,} пикс')
+    lines += [
+        '',
+        '--------------------------------',
+        'ЗАКЛЮЧЕНИЕ:',
+        '--------------------------------',
+        'Обнаружены значительные изменения, требующие внимания' if anomaly
+        else 'Значимых изменений не обнаружено, территория стабильна',
+        '',
+        '==================================',
+        'СИСТЕМА АВТОМАТИЧЕСКОГО МОНИТОРИНГА',
+        '© 2024 GEO SCAN PRO',
+        'Контакты: yasya.ackerman.77@gmail.com',
+        '==================================',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+class Reports:
+    """Отчёты одного результата: строятся при первом запросе и запоминаются."""
+
+    def __init__(self, result: AnalysisResult):
+        self.result = result
+        self._built: dict[tuple, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: tuple, build) -> bytes:
+        # Кнопки скачивания вызывают построение из своих потоков
+        with self._lock:
+            if key not in self._built:
+                self._built[key] = build()
+            return self._built[key]
+
+    def text(self, threshold: float, settings: dict[str, str], block_size: int | None = None,
+             level: float | None = None) -> bytes:
+        key = ('text', threshold, tuple(settings.items()), block_size, level)
+        return self._get(key, lambda: text_report(self.result, threshold, settings, block_size, level).encode('utf-8'))
+
+    def stats(self, threshold: float, block_size: int | None = None, level: float | None = None) -> bytes:
+        return self._get(('stats', threshold, block_size, level),
+                         lambda: stats_json(self.result, threshold, block_size, level))
+
+    def regions_csv(self) -> bytes:
+        return self._get(('regions_csv',), lambda: regions_csv(self.result.regions))
+
+    def regions_geojson(self) -> bytes:
+        return self._get(('regions_geojson',), lambda: regions_geojson(self.result.regions))
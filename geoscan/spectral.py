@@ -0,0 +1,128 @@
+"""Спектральные индексы и поканальная разница многоканальных растров.
+
+Каналы читаются окнами в форме (каналы, H, W) как представления над
+данными файла. Нормализованные разности считаются в float32 по тайлу с
+выходными буферами ``out=``: входные каналы приводятся к float32 внутри
+ufunc, поэтому копий каналов и полноразмерных временных массивов нет.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+# |Δ индекса| ∈ [0, 2] переводится в шкалу карты изменений 0–255
+INDEX_SCALE = 127.5
+
+
+@dataclass(frozen=True)
+class BandMap:
+    """Номера каналов (с нуля) в многоканальном растре."""
+
+    key: str
+    label: str
+    red: int
+    green: int
+    blue: int
+    nir: int
+    swir2: int | None = None
+
+    @property
+    def rgb(self) -> tuple[int, int, int]:
+        return self.red, self.green, self.blue
+
+
+BAND_MAPS = {band_map.key: band_map for band_map in (
+    BandMap('rgbn', 'R, G, B, NIR', red=0, green=1, blue=2, nir=3),
+    # Sentinel-2 L2A: B1, B2, B3, B4, B5, B6, B7, B8, B8A, B9, B11, B12
+    BandMap('sentinel2', 'Sentinel-2 L2A (B1…B12)', red=3, green=2, blue=1, nir=7, swir2=11),
+    # Landsat 8/9 OLI: B1 … B7
+    BandMap('landsat8', 'Landsat 8/9 OLI (B1…B7)', red=3, green=2, blue=1, nir=4, swir2=6),
+)}
+
+
+@dataclass(frozen=True)
+class SpectralIndex:
+    """Нормализованная разность ``(a − b) / (a + b)`` двух каналов."""
+
+    key: str
+    label: str
+    positive: str
+    negative: str
+
+
+INDICES = {index.key: index for index in (
+    SpectralIndex('ndvi', 'ΔNDVI (растительность)', positive='nir', negative='red'),
+    SpectralIndex('ndwi', 'ΔNDWI (вода)', positive='green', negative='nir'),
+    SpectralIndex('nbr', 'ΔNBR (гари)', positive='nir', negative='swir2'),
+)}
+
+
+@dataclass(frozen=True)
+class SpectralSummary:
+    index: str
+    # Среднее знаковое изменение индекса «после» − «до»
+    mean_delta: float
+    # Средняя абсолютная разница по каждому каналу, в единицах данных
+    band_differences: tuple[float, ...]
+
+
+def normalized_difference(a: np.ndarray, b: np.ndarray, out: np.ndarray, scratch: np.ndarray) -> np.ndarray:
+    """``(a − b) / (a + b)`` в ``out``; там, где ``a + b == 0``, — ноль."""
+    np.subtract(a, b, out=out, dtype=np.float32)
+    np.add(a, b, out=scratch, dtype=np.float32)
+    zero = scratch == 0
+    np.divide(out, scratch, out=out, where=~zero)
+    out[zero] = 0
+    return out
+
+
+class SpectralKernel:
+    """Ядро тайлового конвейера: |Δ индекса| × ``INDEX_SCALE`` и поканальные суммы."""
+
+    def __init__(self, index: SpectralIndex, band_map: BandMap):
+        self.index = index
+        self.positive = getattr(band_map, index.positive)
+        self.negative = getattr(band_map, index.negative)
+        if self.positive is None or self.negative is None:
+            raise ValueError(f'В порядке каналов «{band_map.label}» нет каналов для {index.label}')
+        self.signed_total = 0.0
+        self.band_totals = None
+        self.count = 0
+
+    @property
+    def required_bands(self) -> int:
+        return max(self.positive, self.negative) + 1
+
+    def __call__(self, raster1, raster2, box) -> np.ndarray:
+        bands1, bands2 = raster1.read_bands(box), raster2.read_bands(box)
+        shape = bands1.shape[1:]
+        before = np.empty(shape, dtype=np.float32)
+        after = np.empty(shape, dtype=np.float32)
+        scratch = np.empty(shape, dtype=np.float32)
+
+        if self.band_totals is None:
+            self.band_totals = np.zeros(bands1.shape[0], dtype=np.float64)
+        for band, (band1, band2) in enumerate(zip(bands1, bands2)):
+            np.subtract(band1, band2, out=scratch, dtype=np.float32)
+            self.band_totals[band] += float(np.nansum(np.abs(scratch, out=scratch), dtype=np.float64))
+
+        normalized_difference(bands1[self.positive], bands1[self.negative], before, scratch)
+        normalized_difference(bands2[self.positive], bands2[self.negative], after, scratch)
+        np.subtract(after, before, out=after)
+        # Нет данных (NaN в дробных растрах) — не изменение
+        np.nan_to_num(after, copy=False, nan=0.0)
+        self.signed_total += float(after.sum(dtype=np.float64))
+        self.count += after.size
+        np.abs(after, out=after)
+        after *= INDEX_SCALE
+        return after
+
+    def summary(self) -> SpectralSummary:
+        count = max(self.count, 1)
+        totals = self.band_totals if self.band_totals is not None else ()
+        return SpectralSummary(
+            index=self.index.key,
+            mean_delta=self.signed_total / count,
+            band_differences=tuple(float(total) / count for total in totals),
+        )
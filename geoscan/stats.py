@@ -0,0 +1,227 @@
+"""Статистика карты изменений по её 256-биновой гистограмме.
+
+Гистограмма накапливается за один проход по карте (целиком или по тайлам),
+а все показатели — среднее, СКО, максимум, перцентили и число пикселей
+выше любого порога — выводятся из неё и кумулятивной гистограммы за время,
+не зависящее от размера снимка.
+"""
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+# Уровень разницы, выше которого пиксель считается «изменённым»
+CHANGED_LEVEL = 50
+
+LEVELS = 256
+
+# Перцентиль автоматического порога «percentile» по умолчанию
+DEFAULT_PERCENTILE = 99.0
+
+
+@dataclass(frozen=True)
+class DiffStats:
+    """Показатели карты изменений; гистограмма — число пикселей каждого уровня.
+
+    Для дробной карты бин ``k`` содержит значения из ``[k, k + 1)``, а
+    среднее, СКО и максимум берутся из точных моментов. ``weight`` — сколько
+    пикселей исходного снимка представляет один пиксель карты (для карт,
+    посчитанных на прореженном уровне). ``span`` — сколько единиц данных
+    снимков соответствует 255 на карте: для растров глубже 8 бит это
+    диапазон их значений, и бины покрывают его, а не усечённые 8 бит.
+    """
+
+    histogram: np.ndarray
+    cumulative: np.ndarray
+    count: int
+    mean: float
+    std: float
+    max: float
+    weight: int = 1
+    span: float = LEVELS - 1
+
+    @classmethod
+    def from_histogram(cls, histogram: np.ndarray,
+                       moments: tuple[float, float, float] | None = None,
+                       weight: int = 1) -> DiffStats:
+        """``moments`` — сумма, сумма квадратов и максимум дробной карты."""
+        histogram = np.asarray(histogram, dtype=np.int64)
+        cumulative = np.cumsum(histogram)
+        count = int(cumulative[-1])
+        if count == 0:
+            return cls(histogram, cumulative, 0, 0.0, 0.0, 0, weight)
+        if moments is not None:
+            total, squares, maximum = moments
+            mean = total / count
+            return cls(histogram, cumulative, count, mean,
+                       math.sqrt(max(squares / count - mean * mean, 0.0)), maximum, weight)
+        levels = np.arange(histogram.size, dtype=np.int64)
+        total = int(histogram @ levels)
+        squares = int(histogram @ (levels * levels))
+        # Целочисленные суммы точны, поэтому результат не зависит от разбиения на тайлы
+        variance = (count * squares - total * total) / (count * count)
+        return cls(
+            histogram=histogram,
+            cumulative=cumulative,
+            count=count,
+            mean=total / count,
+            std=math.sqrt(variance),
+            max=int(np.flatnonzero(histogram)[-1]),
+            weight=weight,
+        )
+
+    @classmethod
+    def from_array(cls, diff_array: np.ndarray) -> DiffStats:
+        accumulator = StatsAccumulator()
+        accumulator.add(diff_array)
+        return accumulator.result()
+
+    @property
+    def nbytes(self) -> int:
+        return self.histogram.nbytes + self.cumulative.nbytes
+
+    @property
+    def pixel_count(self) -> int:
+        return self.count * self.weight
+
+    @property
+    def changed_pixels(self) -> int:
+        return self.pixels_above(CHANGED_LEVEL)
+
+    def pixels_above(self, level: float) -> int:
+        """Число пикселей (в масштабе исходного снимка) строго выше уровня ``level``."""
+        index = math.floor(level)
+        if index < 0:
+            return self.pixel_count
+        if index >= self.cumulative.size:
+            return 0
+        return (self.count - int(self.cumulative[index])) * self.weight
+
+    def percentile(self, q: float) -> int:
+        """Наименьший уровень, не превышаемый долей ``q`` % пикселей."""
+        if self.count == 0:
+            return 0
+        rank = max(1, math.ceil(q / 100 * self.count))
+        return int(np.searchsorted(self.cumulative, rank))
+
+    @property
+    def rescaled(self) -> bool:
+        """Карта в шкале диапазона значений растров глубже 8 бит, а не 8-битной разницы."""
+        return self.span != LEVELS - 1
+
+    def in_data_units(self, level: float) -> float:
+        """Уровень карты в единицах данных снимков."""
+        return level * self.span / (LEVELS - 1)
+
+    def changed_share(self, level: float) -> float:
+        """Доля пикселей строго выше ``level``, %."""
+        return self.pixels_above(level) / self.pixel_count * 100 if self.count else 0.0
+
+    def auto_level(self, method: str, q: float = DEFAULT_PERCENTILE) -> int:
+        """Уровень изменений методом ``method`` (ключ THRESHOLDS); изменены пиксели строго выше него."""
+        if self.count == 0:
+            return LEVELS - 1
+        if method == 'percentile':
+            return self.percentile(q)
+        return THRESHOLDS[method].level(self.histogram)
+
+
+def otsu_level(histogram: np.ndarray) -> int:
+    """Порог Оцу: разбиение гистограммы с наибольшей межклассовой дисперсией."""
+    counts = histogram.astype(np.float64)
+    levels = np.arange(counts.size)
+    below = np.cumsum(counts)
+    total = below[-1]
+    above = total - below
+    moment = np.cumsum(counts * levels)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # σ²_B(t) ∝ (μ_T·ω₀ − μ₀)² / (ω₀·ω₁), всё в счётчиках
+        between = (moment[-1] * below - total * moment) ** 2 / (below * above)
+    between[~np.isfinite(between)] = -1
+    return int(np.argmax(between))
+
+
+def triangle_level(histogram: np.ndarray) -> int:
+    """Порог треугольника: точка гистограммы, дальше всех от прямой «пик — конец хвоста»."""
+    nonzero = np.flatnonzero(histogram)
+    peak = int(np.argmax(histogram))
+    first, last = int(nonzero[0]), int(nonzero[-1])
+    counts = histogram.astype(np.float64)
+    # Хвост карты изменений — справа от пика у нуля; левый хвост отражается
+    flipped = peak - first > last - peak
+    if flipped:
+        counts = counts[::-1]
+        peak, last = counts.size - 1 - peak, counts.size - 1 - first
+    end = min(last + 1, counts.size - 1)
+    if end <= peak:
+        level = peak
+    else:
+        x = np.arange(peak, end + 1)
+        # Расстояние до прямой (peak, h[peak]) — (end, 0) без постоянного множителя
+        distance = counts[peak] * (end - x) - (end - peak) * counts[x]
+        level = int(x[np.argmax(distance)])
+    return counts.size - 1 - level if flipped else level
+
+
+@dataclass(frozen=True)
+class Threshold:
+    """Способ выбрать уровень изменений по гистограмме карты."""
+
+    key: str
+    label: str
+    description: str
+    level: Callable[[np.ndarray], int] | None = None
+
+
+THRESHOLDS = {threshold.key: threshold for threshold in (
+    Threshold('otsu', 'Оцу', 'Уровень, лучше всего разделяющий гистограмму на два класса — фон и изменения', otsu_level),
+    Threshold('triangle', 'Треугольник', 'Излом хвоста гистограммы за пиком фона; устойчив, когда изменений мало',
+              triangle_level),
+    Threshold('percentile', 'Перцентиль', 'Заданный перцентиль разницы: выше него — самые сильные изменения сцены'),
+)}
+
+
+class StatsAccumulator:
+    """Накопление гистограммы (и моментов дробной карты) по тайлам."""
+
+    def __init__(self):
+        self.histogram = np.zeros(LEVELS, dtype=np.int64)
+        self.moments = None
+
+    def add(self, tile: np.ndarray) -> None:
+        if tile.dtype == np.uint8:
+            self.histogram += np.bincount(tile.ravel(), minlength=LEVELS)
+            return
+        levels = np.clip(tile, 0, LEVELS - 1).astype(np.intp)
+        self.histogram += np.bincount(levels.ravel(), minlength=LEVELS)
+        total, squares, maximum = self.moments or (0.0, 0.0, 0.0)
+        self.moments = (
+            total + float(tile.sum(dtype=np.float64)),
+            squares + float(np.einsum('ij,ij->', tile, tile, dtype=np.float64)),
+            max(maximum, float(tile.max())),
+        )
+
+    def result(self, weight: int = 1) -> DiffStats:
+        return DiffStats.from_histogram(self.histogram, self.moments, weight)
+
+
+def bin_width(levels: int, nbins: int) -> int:
+    """«Круглая» ширина бина (1, 2, 5 × 10ⁿ), ближайшая к ``levels / nbins``."""
+    rough = levels / nbins
+    if rough <= 1:
+        return 1
+    base = 10 ** math.floor(math.log10(rough))
+    candidates = [m * base for m in (1, 2, 5, 10)]
+    return int(min(candidates, key=lambda width: abs(math.log(width / rough))))
+
+
+def rebin_histogram(histogram: np.ndarray, nbins: int) -> tuple[np.ndarray, np.ndarray, int]:
+    """Укрупнение гистограммы до ~``nbins`` бинов: левые границы, счётчики, ширина."""
+    width = bin_width(histogram.size, nbins)
+    padded = np.zeros(-(-histogram.size // width) * width, dtype=histogram.dtype)
+    padded[:histogram.size] = histogram
+    counts = padded.reshape(-1, width).sum(axis=1)
+    return np.arange(counts.size) * width, counts, width
@@ -0,0 +1,385 @@
+"""Хранилище результатов анализа на диске, общее для сессий, процессов и перезапусков.
+
+Запись адресуется содержимым: ключ — SHA-256 от хэшей обоих снимков и
+параметров, влияющих на результат (``AnalysisParams`` без ``tile_size``), и
+версии формата. Запись — каталог с тремя файлами:
+
+* ``meta.json`` — размеры, режим, масштаб, сдвиг, сводка индекса и СКО;
+* ``arrays.npz`` — гистограмма, таблица областей и уровни обзорных пирамид
+  (сжатые);
+* ``diff.zlib`` — карта изменений потоком zlib; читается полосами прямо в
+  карту, отображённую в память, если сцена большая.
+
+Повторный анализ той же пары отдаётся из записи без декодирования
+снимков: исходники нужны только для фрагмента в полном разрешении и
+пересчитываются лениво при первом таком запросе — в общем пуле анализов,
+если он передан, и от пересчёта остаются только сами снимки.
+
+Несколько процессов Streamlit работают с одним каталогом безопасно:
+запись собирается во временном каталоге и публикуется атомарным
+переименованием, вытеснение по LRU (время последнего чтения — mtime
+``meta.json``) идёт под файловой блокировкой, а запись, удалённая
+соседом во время чтения, считается промахом.
+"""
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from .engine import AnalysisParams, AnalysisResult, compute, estimate_bytes, resident_bytes
+from .pyramid import Pyramid
+from .regions import ChangeRegions
+from .registration import Registration
+from .spectral import SpectralSummary
+from .stats import DiffStats
+from .tiling import TILED_MIN_PIXELS, change_map
+
+try:
+    import fcntl
+except ImportError:  # Windows: публикация остаётся атомарной, вытеснение — без блокировки
+    fcntl = None
+
+# Меняется при несовместимом изменении формата записи или результата движка
+STORE_VERSION = 1
+
+# Каталог и предельный объём хранилища по умолчанию
+DEFAULT_STORE_DIR = Path(os.environ.get('GEOSCAN_STORE_DIR') or Path.home() / '.cache' / 'geoscan' / 'store')
+DEFAULT_STORE_BYTES = int(os.environ.get('GEOSCAN_STORE_BYTES') or 2 * 1024 ** 3)
+
+# Сколько байт карты изменений сжимается и распаковывается за раз
+CHUNK_BYTES = 16 * 1024 * 1024
+
+# Как долго объём хранилища берётся из счётчика без обхода каталога, секунд:
+# за это время учитываются записи соседних процессов
+SIZE_TTL = 30.0
+
+_PYRAMIDS = ('overview1', 'overview2', 'overview_diff')
+
+
+def store_key(hash1: str, hash2: str, params: AnalysisParams) -> str:
+    """Адрес записи: хэши снимков и параметры, входящие в сравнение ``AnalysisParams``."""
+    fields = {field.name: getattr(params, field.name) for field in dataclasses.fields(params) if field.compare}
+    fields['resample'] = int(fields['resample'])
+    payload = json.dumps([STORE_VERSION, hash1, hash2, fields], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _Recompute:
+    """Полный пересчёт пары по требованию — один на оба снимка записи.
+
+    С ``pool`` пересчёт ждёт допуска в ``geoscan.admission.AnalysisPool``
+    по оценке памяти, как и любой анализ. От результата остаются только
+    снимки; ``on_done`` вызывается после пересчёта — по нему кэш
+    результатов учитывает выросший объём записи.
+    """
+
+    def __init__(self, data1, data2, params: AnalysisParams, pool=None, on_done=None):
+        self._args = (data1, data2, params)
+        self._pool = pool
+        self._on_done = on_done
+        self.images: dict[str, object] | None = None
+        self._lock = threading.Lock()
+
+    def __call__(self) -> dict[str, object]:
+        with self._lock:
+            if self.images is not None:
+                return self.images
+            if self._pool is None:
+                result = compute(*self._args)
+            else:
+                result = self._pool.run(compute, *self._args, cost=estimate_bytes(*self._args))
+            self.images = {'image1': result.image1, 'image2': result.image2}
+        if self._on_done is not None:
+            self._on_done()
+        return self.images
+
+
+class Deferred:
+    """Снимок пары из хранилища: известен размер, пиксели — только после пересчёта."""
+
+    mode = 'RGB'
+
+    def __init__(self, size: tuple[int, int], recompute: _Recompute, attribute: str):
+        self.size = size
+        self._recompute = recompute
+        self._attribute = attribute
+
+    @property
+    def nbytes(self) -> int:
+        images = self._recompute.images
+        return resident_bytes(images[self._attribute]) if images is not None else 0
+
+    def getbands(self) -> tuple[str, ...]:
+        return 'R', 'G', 'B'
+
+    def crop(self, box: tuple[int, int, int, int]) -> Image.Image:
+        return self._recompute()[self._attribute].crop(box)
+
+
+class AnalysisStore:
+    """Каталог записей с ограничением объёма ``max_bytes`` и вытеснением давно не читанных."""
+
+    def __init__(self, root: str | os.PathLike = DEFAULT_STORE_DIR, max_bytes: int = DEFAULT_STORE_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Объём записей, который ведут put и вытеснение, и когда он сверен с диском
+        self._bytes = 0
+        self._counted = None
+        self._bytes_lock = threading.Lock()
+
+    def _entry(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def get(self, hash1: str, hash2: str, params: AnalysisParams, data1=None, data2=None,
+            pool=None, on_recompute=None) -> AnalysisResult | None:
+        """Результат из записи или ``None``; ``data1``/``data2`` нужны для фрагментов в полном разрешении.
+
+        Фрагмент пересчитывает пару целиком: с ``pool`` — в общем пуле
+        анализов; ``on_recompute`` вызывается, когда снимки пересчитаны.
+        """
+        entry = self._entry(store_key(hash1, hash2, params))
+        try:
+            result = self._read(entry, _Recompute(data1, data2, params, pool, on_recompute))
+            # Чтение продлевает жизнь записи при вытеснении
+            os.utime(entry / 'meta.json')
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, hash1: str, hash2: str, params: AnalysisParams, result: AnalysisResult) -> None:
+        """Сохраняет результат; запись, уже опубликованная другим процессом, не перезаписывается."""
+        entry = self._entry(store_key(hash1, hash2, params))
+        if entry.exists():
+            return
+        staging = self.root / 'staging' / uuid.uuid4().hex
+        staging.mkdir(parents=True)
+        try:
+            size = self._write(staging, result)
+            if size > self.max_bytes:
+                return
+            with self._locked():
+                self._evict(self.max_bytes - size)
+                entry.parent.mkdir(exist_ok=True)
+                try:
+                    staging.rename(entry)
+                except OSError:
+                    # Ту же пару успел опубликовать другой процесс
+                    pass
+                else:
+                    with self._bytes_lock:
+                        self._bytes += size
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    @property
+    def nbytes(self) -> int:
+        """Объём записей, байт; каталог обходится не чаще раза в ``SIZE_TTL``."""
+        if self._counted is None or time.monotonic() - self._counted >= SIZE_TTL:
+            self._count(sum(size for _, _, size in self._entries()))
+        return self._bytes
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._entries())
+
+    def clear(self) -> None:
+        with self._locked():
+            for entry, _, _ in self._entries():
+                self._remove(entry)
+            self._count(0)
+
+    def _entries(self):
+        """Опубликованные записи: путь, время последнего чтения и объём."""
+        if not self.root.exists():
+            return
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or len(shard.name) != 2:
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    files = list(os.scandir(entry.path))
+                    used = os.stat(os.path.join(entry.path, 'meta.json')).st_mtime
+                except OSError:
+                    continue
+                yield Path(entry.path), used, sum(file.stat().st_size for file in files)
+
+    def _evict(self, budget: int) -> None:
+        entries = sorted(self._entries(), key=lambda item: item[1])
+        total = sum(size for _, _, size in entries)
+        for entry, _, size in entries:
+            if total <= budget:
+                break
+            self._remove(entry)
+            total -= size
+        self._count(total)
+
+    def _count(self, total: int) -> None:
+        with self._bytes_lock:
+            self._bytes, self._counted = total, time.monotonic()
+
+    def _remove(self, entry: Path) -> None:
+        # Каталог сначала уводится из адреса, чтобы читатели не увидели его наполовину удалённым
+        trash = self.root / 'staging' / f'evicted-{uuid.uuid4().hex}'
+        trash.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            entry.rename(trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def _locked(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        return _FileLock(self.root / '.lock')
+
+    def _write(self, directory: Path, result: AnalysisResult) -> int:
+        diff = result.diff_array
+        meta = {
+            'version': STORE_VERSION,
+            'mode': result.mode,
+            'scale': result.scale,
+            'screened': result.screened,
+            'size1': list(result.image1.size),
+            'size2': list(result.image2.size),
+            'diff_shape': list(diff.shape),
+            'diff_dtype': diff.dtype.str,
+            'stats': {
+                'count': result.stats.count,
+                'mean': result.stats.mean,
+                'std': result.stats.std,
+                'max': float(result.stats.max),
+                'weight': result.stats.weight,
+                'span': result.stats.span,
+            },
+            'pyramids': {
+                name: {
+                    'scale': pyramid.scale,
+                    'levels': len(pyramid.levels),
+                    # Источник — сам верхний уровень (снимок «после» другого размера в быстром режиме)
+                    'source_is_top': pyramid.source is pyramid.levels[0],
+                }
+                for name, pyramid in zip(_PYRAMIDS, (result.overview1, result.overview2, result.overview_diff))
+            },
+            'registration': dataclasses.asdict(result.registration) if result.registration else None,
+            'spectral': dataclasses.asdict(result.spectral) if result.spectral else None,
+            'regions': {'level': result.regions.level, 'count': result.regions.count} if result.regions else None,
+        }
+        arrays = {'histogram': result.stats.histogram}
+        if result.regions is not None:
+            arrays.update({f'regions_{name}': getattr(result.regions, name) for name in _region_fields()})
+        for name in _PYRAMIDS:
+            for index, level in enumerate(getattr(result, name).levels):
+                arrays[f'{name}_{index}'] = np.asarray(level)
+        np.savez_compressed(directory / 'arrays.npz', **arrays)
+
+        # Карта пишется полосами строк, без полной копии в памяти
+        compressor = zlib.compressobj(1)
+        rows = max(1, CHUNK_BYTES // max(diff.strides[0], 1))
+        with open(directory / 'diff.zlib', 'wb') as file:
+            for top in range(0, diff.shape[0], rows):
+                file.write(compressor.compress(np.ascontiguousarray(diff[top:top + rows]).data))
+            file.write(compressor.flush())
+
+        # meta.json пишется последним: его mtime — время последнего чтения
+        with open(directory / 'meta.json', 'w', encoding='utf-8') as file:
+            json.dump(meta, file, ensure_ascii=False)
+        return sum(path.stat().st_size for path in directory.iterdir())
+
+    def _read(self, entry: Path, recompute: _Recompute) -> AnalysisResult:
+        with open(entry / 'meta.json', encoding='utf-8') as file:
+            meta = json.load(file)
+        if meta['version'] != STORE_VERSION:
+            raise ValueError('store entry version mismatch')
+
+        height, width = meta['diff_shape']
+        dtype = np.dtype(meta['diff_dtype'])
+        diff_array = change_map(width, height, dtype) if width * height >= TILED_MIN_PIXELS \
+            else np.empty((height, width), dtype)
+        buffer = diff_array.reshape(-1).view(np.uint8)
+        decompressor = zlib.decompressobj()
+        position = 0
+        with open(entry / 'diff.zlib', 'rb') as file:
+            while chunk := file.read(CHUNK_BYTES):
+                while chunk:
+                    data = decompressor.decompress(chunk, buffer.size - position)
+                    buffer[position:position + len(data)] = np.frombuffer(data, np.uint8)
+                    position += len(data)
+                    chunk = decompressor.unconsumed_tail
+        if position != buffer.size:
+            raise ValueError('truncated store entry')
+        diff_array.flags.writeable = False
+
+        with np.load(entry / 'arrays.npz') as arrays:
+            histogram = arrays['histogram']
+            stats = DiffStats(histogram=histogram, cumulative=np.cumsum(histogram), **meta['stats'])
+            regions = None
+            if meta['regions'] is not None:
+                regions = ChangeRegions(**meta['regions'], **{
+                    name: arrays[f'regions_{name}'] for name in _region_fields()
+                })
+            image1 = Deferred(tuple(meta['size1']), recompute, 'image1')
+            image2 = Deferred(tuple(meta['size2']), recompute, 'image2')
+            sources = {'overview1': image1, 'overview2': image2, 'overview_diff': Image.fromarray(diff_array)}
+            pyramids = {}
+            for name in _PYRAMIDS:
+                layout = meta['pyramids'][name]
+                levels = [Image.fromarray(arrays[f'{name}_{index}']) for index in range(layout['levels'])]
+                source = levels[0] if layout['source_is_top'] else sources[name]
+                pyramids[name] = Pyramid(source, levels, layout['scale'])
+
+        registration = meta['registration']
+        spectral = meta['spectral']
+        return AnalysisResult(
+            image1=image1,
+            image2=pyramids['overview2'].source if meta['pyramids']['overview2']['source_is_top'] else image2,
+            diff_array=diff_array,
+            stats=stats,
+            mode=meta['mode'],
+            scale=meta['scale'],
+            screened=meta['screened'],
+            spectral=SpectralSummary(**{**spectral, 'band_differences': tuple(spectral['band_differences'])})
+            if spectral else None,
+            registration=Registration(**registration) if registration else None,
+            regions=regions,
+            **pyramids,
+        )
+
+
+def _region_fields() -> tuple[str, ...]:
+    return tuple(field.name for field in dataclasses.fields(ChangeRegions) if field.name not in ('level', 'count'))
+
+
+class _FileLock:
+    """Исключительная блокировка каталога хранилища между процессами."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+# Общее хранилище процесса; каталог и объём — из GEOSCAN_STORE_DIR и GEOSCAN_STORE_BYTES
+default_store = AnalysisStore()
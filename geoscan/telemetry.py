@@ -0,0 +1,356 @@
+"""Телеметрия анализа: время, процессор и память по этапам, история и экспорт.
+
+``StageRecorder`` — отчёт о ходе анализа, который попутно меряет каждый
+этап конвейера: длительность, процессорное время процесса и пик
+резидентной памяти за этап. Пик снимается фоновым потоком, который раз в
+``SAMPLE_INTERVAL`` читает ``/proc/self/statm``; где его нет, берётся пик
+процесса за всё время (``ru_maxrss``), а на Windows, без ``resource``,
+память не известна и не показывается. Завершённые анализы складываются в
+``Telemetry`` — скользящую историю последних ``HISTORY_SIZE`` записей и
+накопительные счётчики, которые выгружаются журналом JSONL или текстом в
+формате Prometheus, в том числе по HTTP для локального сборщика метрик.
+
+Память и процессор — показатели всего процесса: сессии Streamlit
+работают в одном процессе и делят их.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .admission import AnalysisPool, default_pool
+from .engine import ResultCache, default_cache
+from .progress import ProgressCallback, ProgressReporter
+from .store import AnalysisStore, default_store
+
+try:
+    import resource
+except ImportError:  # Windows: пик памяти процесса неизвестен
+    resource = None
+
+# Период опроса резидентной памяти во время этапа, секунд
+SAMPLE_INTERVAL = 0.01
+
+# Сколько последних анализов хранится в истории
+HISTORY_SIZE = 50
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def current_rss() -> int | None:
+    """Текущая резидентная память процесса, байт; ``None``, если её не узнать."""
+    try:
+        with open('/proc/self/statm', 'rb') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss() -> int | None:
+    """Пик резидентной памяти процесса за всё время, байт; ``None``, если его не узнать."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def total_memory() -> int | None:
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class _RssSampler:
+    """Фоновый поток, поднимающий ``peak`` всех наблюдателей до текущей памяти процесса."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        # Брошенный наблюдатель (анализ прерван ошибкой) уходит из набора сам
+        self._watchers = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+
+    def watch(self, watcher) -> None:
+        with self._lock:
+            self._watchers.add(watcher)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='geoscan-rss', daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def unwatch(self, watcher) -> None:
+        with self._lock:
+            self._watchers.discard(watcher)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                # Без наблюдателей поток спит до следующего watch, а не опрашивает память
+                while not self._watchers:
+                    self._wake.wait()
+                watchers = list(self._watchers)
+            rss = current_rss()
+            # Замер не удался — пропускается, пик остаётся прежним
+            if rss is not None:
+                for watcher in watchers:
+                    watcher.peak = max(watcher.peak, rss)
+            del watchers
+            time.sleep(self.interval)
+
+
+_sampler = _RssSampler()
+
+
+@dataclass(frozen=True)
+class StageSample:
+    seconds: float
+    cpu_seconds: float
+    # Пик резидентной памяти процесса за этап, байт
+    peak_rss: int
+
+
+class _Window:
+    def __init__(self, peak: int):
+        self.peak = peak
+
+
+class StageRecorder(ProgressReporter):
+    """``ProgressReporter``, который меряет время, процессор и пик памяти каждого этапа."""
+
+    def __init__(self, callback: ProgressCallback | None = None, **kwargs):
+        super().__init__(callback, **kwargs)
+        self.stages: dict[str, StageSample] = {}
+        self._current = None
+        self._window = None
+
+    @property
+    def cached(self) -> bool:
+        """Этапы конвейера не выполнялись — результат взят из кэша или хранилища."""
+        return 'decode' not in self.stages
+
+    def stage(self, name: str) -> None:
+        self._close()
+        rss = current_rss()
+        self._current = (name, self.clock(), time.process_time())
+        self._window = _Window(rss or 0)
+        if rss is not None:
+            _sampler.watch(self._window)
+        super().stage(name)
+
+    def finish(self) -> None:
+        self._close()
+        super().finish()
+
+    def _close(self) -> None:
+        if self._current is None:
+            return
+        name, started, cpu_started = self._current
+        _sampler.unwatch(self._window)
+        peak = max(self._window.peak, current_rss() or 0) if self._window.peak else peak_rss() or 0
+        previous = self.stages.get(name)
+        sample = StageSample(self.clock() - started, time.process_time() - cpu_started, peak)
+        if previous is not None:
+            # Этап, начатый повторно, складывается с прошлым
+            sample = StageSample(previous.seconds + sample.seconds, previous.cpu_seconds + sample.cpu_seconds,
+                                 max(previous.peak_rss, sample.peak_rss))
+        self.stages[name] = sample
+        self._current = self._window = None
+
+
+@dataclass(frozen=True)
+class AnalysisRecord:
+    """Завершённый анализ в истории телеметрии."""
+
+    finished: float
+    kind: str
+    mode: str
+    megapixels: float
+    cached: bool
+    seconds: float
+    stages: dict[str, StageSample] = field(default_factory=dict)
+
+    @property
+    def peak_rss(self) -> int:
+        return max((sample.peak_rss for sample in self.stages.values()), default=0)
+
+    def to_dict(self) -> dict:
+        record = asdict(self)
+        record['peak_rss'] = self.peak_rss
+        return record
+
+
+class Telemetry:
+    """Скользящая история анализов и накопительные счётчики процесса."""
+
+    def __init__(self, history_size: int = HISTORY_SIZE, cache: ResultCache | None = default_cache,
+                 store: AnalysisStore | None = default_store, pool: AnalysisPool | None = default_pool):
+        self.cache = cache
+        self.store = store
+        self.pool = pool
+        self._history: deque[AnalysisRecord] = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._analyses: dict[tuple[str, str, bool], int] = {}
+        self._stage_totals: dict[str, list[float]] = {}
+        self._cpu_mark = (time.perf_counter(), time.process_time())
+
+    def record(self, recorder: StageRecorder, kind: str, mode: str, megapixels: float) -> AnalysisRecord:
+        """Запись о завершённом анализе; ``recorder.finish()`` уже вызван."""
+        record = AnalysisRecord(
+            finished=time.time(),
+            kind=kind,
+            mode=mode,
+            megapixels=round(megapixels, 3),
+            cached=recorder.cached,
+            seconds=recorder.elapsed,
+            stages=dict(recorder.stages),
+        )
+        with self._lock:
+            self._history.append(record)
+            key = (kind, mode, record.cached)
+            self._analyses[key] = self._analyses.get(key, 0) + 1
+            for name, sample in record.stages.items():
+                totals = self._stage_totals.setdefault(name, [0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += sample.seconds
+                totals[2] += sample.cpu_seconds
+        return record
+
+    def history(self) -> list[AnalysisRecord]:
+        """Записи от новых к старым."""
+        with self._lock:
+            return list(reversed(self._history))
+
+    def cpu_percent(self) -> float:
+        """Загрузка процессора процессом с прошлого вызова; 100 — одно ядро целиком."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        with self._lock:
+            last_wall, last_cpu = self._cpu_mark
+            self._cpu_mark = (wall, cpu)
+        return 100.0 * (cpu - last_cpu) / max(wall - last_wall, 1e-9)
+
+    def cache_hit_rate(self) -> float | None:
+        if self.cache is None:
+            return None
+        lookups = self.cache.hits + self.cache.misses
+        return self.cache.hits / lookups if lookups else None
+
+    def log(self) -> str:
+        """История в виде журнала JSONL, от старых записей к новым."""
+        return ''.join(json.dumps(record.to_dict(), ensure_ascii=False) + '\n' for record in reversed(self.history()))
+
+    def prometheus(self) -> str:
+        """Метрики процесса в текстовом формате Prometheus."""
+        lines = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def sample(name: str, value: float, **labels) -> None:
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f'{name}{{{label_text}}} {value:.10g}' if labels else f'{name} {value:.10g}')
+
+        header('geoscan_process_cpu_seconds_total', 'counter', 'Processor time of the process.')
+        sample('geoscan_process_cpu_seconds_total', time.process_time())
+        rss = current_rss()
+        if rss is not None:
+            header('geoscan_process_resident_memory_bytes', 'gauge', 'Resident memory of the process.')
+            sample('geoscan_process_resident_memory_bytes', rss)
+        peak = peak_rss()
+        if peak is not None:
+            header('geoscan_process_peak_resident_memory_bytes', 'gauge', 'Peak resident memory of the process.')
+            sample('geoscan_process_peak_resident_memory_bytes', peak)
+        if self.cache is not None:
+            for name, kind, help_text, value in (
+                ('geoscan_cache_hits_total', 'counter', 'Result cache hits.', self.cache.hits),
+                ('geoscan_cache_misses_total', 'counter', 'Result cache misses.', self.cache.misses),
+                ('geoscan_cache_entries', 'gauge', 'Results held in the cache.', len(self.cache)),
+                ('geoscan_cache_bytes', 'gauge', 'Memory held by cached results.', self.cache.nbytes),
+            ):
+                header(name, kind, help_text)
+                sample(name, value)
+        if self.store is not None:
+            for name, kind, help_text, value in (
+                ('geoscan_store_hits_total', 'counter', 'On-disk store hits.', self.store.hits),
+                ('geoscan_store_misses_total', 'counter', 'On-disk store misses.', self.store.misses),
+                ('geoscan_store_bytes', 'gauge', 'Disk space held by the store.', self.store.nbytes),
+            ):
+                header(name, kind, help_text)
+                sample(name, value)
+        if self.pool is not None:
+            for name, help_text, value in (
+                ('geoscan_pool_running', 'Analyses running in the shared pool.', self.pool.running),
+                ('geoscan_pool_queued', 'Analyses waiting for admission.', self.pool.queued),
+                ('geoscan_pool_in_flight_bytes', 'Estimated memory of running analyses.', self.pool.in_flight_bytes),
+                ('geoscan_pool_max_bytes', 'Memory budget of running analyses.', self.pool.max_bytes),
+            ):
+                header(name, 'gauge', help_text)
+                sample(name, value)
+        with self._lock:
+            analyses = sorted(self._analyses.items())
+            stage_totals = sorted(self._stage_totals.items())
+            last = self._history[-1] if self._history else None
+        header('geoscan_analyses_total', 'counter', 'Finished analyses.')
+        for (kind, mode, cached), count in analyses:
+            sample('geoscan_analyses_total', count, kind=kind, mode=mode, cached=str(cached).lower())
+        header('geoscan_stage_seconds', 'summary', 'Wall time of pipeline stages.')
+        for name, (count, seconds, _) in stage_totals:
+            sample('geoscan_stage_seconds_sum', seconds, stage=name)
+            sample('geoscan_stage_seconds_count', count, stage=name)
+        header('geoscan_stage_cpu_seconds_total', 'counter', 'Processor time of pipeline stages.')
+        for name, (_, _, cpu_seconds) in stage_totals:
+            sample('geoscan_stage_cpu_seconds_total', cpu_seconds, stage=name)
+        if last is not None:
+            header('geoscan_last_analysis_stage_seconds', 'gauge', 'Stage wall time of the latest analysis.')
+            for name, stage in last.stages.items():
+                sample('geoscan_last_analysis_stage_seconds', stage.seconds, stage=name)
+            header('geoscan_last_analysis_stage_peak_rss_bytes', 'gauge',
+                   'Peak resident memory during each stage of the latest analysis.')
+            for name, stage in last.stages.items():
+                sample('geoscan_last_analysis_stage_peak_rss_bytes', stage.peak_rss, stage=name)
+        return '\n'.join(lines) + '\n'
+
+
+# Общая телеметрия процесса, как и общий кэш результатов
+default_telemetry = Telemetry()
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port: int, host: str = '127.0.0.1', telemetry: Telemetry = default_telemetry) -> ThreadingHTTPServer:
+    """HTTP-сервер метрик ``/metrics`` в фоновом потоке; повторный вызов возвращает уже запущенный."""
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = telemetry.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        _server = ThreadingHTTPServer((host, port), Handler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name='geoscan-metrics', daemon=True).start()
+        return _server
@@ -0,0 +1,344 @@
+"""Оконное чтение TIFF/GeoTIFF без декодирования всего файла.
+
+Разбирается первый IFD классического TIFF или BigTIFF. Несжатые полосы и
+тайлы читаются как представления numpy поверх буфера файла (для файлов на
+диске — ``mmap``), сжатые Deflate — распаковываются только те полосы или
+тайлы, которые пересекает запрошенное окно. Для прочих вариантов
+(LZW, JPEG, палитры, раздельные плоскости) ``open_tiff`` возвращает
+``None`` и вызывающий код использует обычный путь через PIL.
+
+Отсчёты читаются в собственном типе файла: 8-, 16- и 32-битные целые и
+float32/float64. В 8 бит растр глубже 8 бит переводится только для
+показа (``crop``), в шкале своего диапазона значений. Снимки глубже 8
+бит, которые декодирует PIL (16-битный PNG, TIFF с LZW, режимы I и F),
+оборачиваются в ``DecodedRaster`` — тот же интерфейс поверх массива.
+"""
+from __future__ import annotations
+
+import mmap
+import struct
+import threading
+import warnings
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+# Теги TIFF
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIG = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+EXTRA_SAMPLES = 338
+SAMPLE_FORMAT = 339
+S_MIN_SAMPLE_VALUE = 340
+S_MAX_SAMPLE_VALUE = 341
+
+COMPRESSION_NONE = 1
+COMPRESSION_DEFLATE = (8, 32946)
+
+# Тип поля → (формат struct, размер)
+_FIELD_TYPES = {
+    1: ('B', 1), 2: ('c', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8),
+    6: ('b', 1), 7: ('B', 1), 8: ('h', 2), 9: ('i', 4), 10: ('ii', 8),
+    11: ('f', 4), 12: ('d', 8), 13: ('I', 4), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8),
+}
+
+# SampleFormat → (вид типа numpy, допустимые разрядности)
+_SAMPLE_KINDS = {1: ('u', (8, 16, 32)), 2: ('i', (8, 16, 32)), 3: ('f', (32, 64))}
+
+# Объём распакованных полос/тайлов, которые держатся для соседних окон
+CHUNK_CACHE_BYTES = 128 * 1024 * 1024
+
+# Наибольшее число пикселей в полосе прохода за диапазоном значений
+RANGE_STRIP_PIXELS = 4_000_000
+
+# Режимы PIL с отсчётами глубже 8 бит: convert('RGB') обрезал бы их до 255
+HIGH_BIT_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I', 'F')
+
+
+def _read_ifd(buffer, byteorder: str) -> dict[int, tuple]:
+    version, = struct.unpack_from(byteorder + 'H', buffer, 2)
+    if version == 42:
+        offset, = struct.unpack_from(byteorder + 'I', buffer, 4)
+        count_format, entry_format, inline = 'H', 'HHI', 4
+    elif version == 43:
+        offset, = struct.unpack_from(byteorder + 'Q', buffer, 8)
+        count_format, entry_format, inline = 'Q', 'HHQ', 8
+    else:
+        raise ValueError('not a TIFF file')
+    count, = struct.unpack_from(byteorder + count_format, buffer, offset)
+    position = offset + struct.calcsize(count_format)
+    entry_size = struct.calcsize('=' + entry_format) + inline
+    tags = {}
+    for _ in range(count):
+        tag, field_type, values = struct.unpack_from(byteorder + entry_format, buffer, position)
+        if field_type in _FIELD_TYPES:
+            code, size = _FIELD_TYPES[field_type]
+            data_offset = position + entry_size - inline
+            if size * values > inline:
+                data_offset, = struct.unpack_from(byteorder + ('I' if inline == 4 else 'Q'), buffer, data_offset)
+            if field_type != 2:
+                tags[tag] = struct.unpack_from(f'{byteorder}{values * len(code)}{code[0]}', buffer, data_offset)
+        position += entry_size
+    return tags
+
+
+class TiffRaster:
+    """Растр TIFF с доступом к произвольному окну.
+
+    Повторяет ту часть интерфейса ``PIL.Image``, которую использует движок
+    (``size``, ``getbands``, ``crop``), поэтому подставляется в тайловый
+    конвейер вместо декодированного изображения.
+    """
+
+    mode = 'RGB'
+
+    def __init__(self, buffer, tags: dict[int, tuple], byteorder: str, mapped: bool = False,
+                 rgb: tuple[int, int, int] = (0, 1, 2)):
+        self._buffer = buffer
+        self._mapped = mapped
+        self.width = tags[IMAGE_WIDTH][0]
+        self.height = tags[IMAGE_LENGTH][0]
+        self.samples = tags.get(SAMPLES_PER_PIXEL, (1,))[0]
+        bits = tags.get(BITS_PER_SAMPLE, (1,))[0]
+        kind, _ = _SAMPLE_KINDS[tags.get(SAMPLE_FORMAT, (1,))[0]]
+        self.dtype = np.dtype(f'{byteorder}{kind}{bits // 8}')
+        self.compression = tags.get(COMPRESSION, (COMPRESSION_NONE,))[0]
+        self.predictor = tags.get(PREDICTOR, (1,))[0]
+        # Каналы, из которых собирается RGB для показа и яркостной разницы
+        self.rgb = rgb if self.samples > max(rgb) else (0, 1, 2)
+        if TILE_OFFSETS in tags:
+            self.chunk_width = tags[TILE_WIDTH][0]
+            self.chunk_height = tags[TILE_LENGTH][0]
+            self._offsets = tags[TILE_OFFSETS]
+            self._counts = tags[TILE_BYTE_COUNTS]
+        else:
+            self.chunk_width = self.width
+            self.chunk_height = min(tags.get(ROWS_PER_STRIP, (self.height,))[0], self.height)
+            self._offsets = tags[STRIP_OFFSETS]
+            self._counts = tags[STRIP_BYTE_COUNTS]
+        self._chunks_across = -(-self.width // self.chunk_width)
+        self._chunk_cache: OrderedDict[int, np.ndarray] = OrderedDict()
+        self._chunk_cache_bytes = 0
+        self._lock = threading.Lock()
+        self._plane = self._contiguous_plane()
+        self._range = None
+        if S_MIN_SAMPLE_VALUE in tags and S_MAX_SAMPLE_VALUE in tags:
+            self._range = (float(min(tags[S_MIN_SAMPLE_VALUE])), float(max(tags[S_MAX_SAMPLE_VALUE])))
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+    @property
+    def nbytes(self) -> int:
+        """Резидентный объём: буфер загрузки; файл на диске отображается и не считается."""
+        return 0 if self._mapped else len(self._buffer)
+
+    def getbands(self) -> tuple[str, ...]:
+        return ('R', 'G', 'B')
+
+    @property
+    def high_bit(self) -> bool:
+        """Отсчёты глубже 8 бит или дробные."""
+        return self.dtype.itemsize > 1 or self.dtype.kind != 'u'
+
+    @property
+    def bands(self) -> tuple[int, ...]:
+        """Каналы, из которых собирается показ и яркостная разница."""
+        return self.rgb if self.samples >= 3 else (0,)
+
+    def value_range(self) -> tuple[float, float]:
+        """Наименьшее и наибольшее значение каналов ``bands``; для 8 бит — 0–255.
+
+        Берётся из тегов SMinSampleValue/SMaxSampleValue, иначе — одним
+        проходом по растру полосами; значения без данных (NaN) пропускаются.
+        """
+        if not self.high_bit:
+            return 0.0, 255.0
+        if self._range is None:
+            low, high = np.inf, -np.inf
+            rows = max(1, RANGE_STRIP_PIXELS // self.width)
+            with warnings.catch_warnings():
+                # Полоса целиком из NaN: nanmin/nanmax предупреждают и дают NaN, fmin/fmax его пропускают
+                warnings.simplefilter('ignore', RuntimeWarning)
+                for top in range(0, self.height, rows):
+                    strip = self.read((0, top, self.width, min(top + rows, self.height)))[:, :, list(self.bands)]
+                    low, high = np.fmin(low, np.nanmin(strip)), np.fmax(high, np.nanmax(strip))
+            self._range = (float(low), float(high)) if low <= high else (0.0, 1.0)
+        return self._range
+
+    def _contiguous_plane(self) -> np.ndarray | None:
+        # Несжатые полосы, записанные подряд, — один массив-представление на весь растр
+        if self.compression != COMPRESSION_NONE or self.chunk_width != self.width:
+            return None
+        position = self._offsets[0]
+        for offset, count in zip(self._offsets, self._counts):
+            if offset != position:
+                return None
+            position += count
+        count = self.width * self.height * self.samples
+        if self._offsets[0] + count * self.dtype.itemsize > len(self._buffer):
+            return None
+        plane = np.frombuffer(self._buffer, dtype=self.dtype, count=count, offset=self._offsets[0])
+        return plane.reshape(self.height, self.width, self.samples)
+
+    def _chunk(self, index: int) -> np.ndarray:
+        rows = self.chunk_height
+        if self.chunk_width == self.width:
+            rows = min(rows, self.height - index * self.chunk_height)
+        shape = (rows, self.chunk_width, self.samples)
+        count = rows * self.chunk_width * self.samples
+        offset = self._offsets[index]
+        if self.compression == COMPRESSION_NONE:
+            return np.frombuffer(self._buffer, dtype=self.dtype, count=count, offset=offset).reshape(shape)
+
+        with self._lock:
+            cached = self._chunk_cache.get(index)
+            if cached is not None:
+                self._chunk_cache.move_to_end(index)
+                return cached
+        # Срез представления не копирует сжатые данные, а распаковка ограничена
+        # объёмом самой полосы: поток, разворачивающийся больше, дальше не читается
+        compressed = memoryview(self._buffer)[offset:offset + self._counts[index]]
+        raw = zlib.decompressobj().decompress(compressed, count * self.dtype.itemsize)
+        chunk = np.frombuffer(raw, dtype=self.dtype, count=count).reshape(shape)
+        if self.predictor == 2:
+            chunk = np.cumsum(chunk, axis=1, dtype=self.dtype)
+        with self._lock:
+            if index not in self._chunk_cache:
+                self._chunk_cache[index] = chunk
+                self._chunk_cache_bytes += chunk.nbytes
+            while self._chunk_cache_bytes > CHUNK_CACHE_BYTES and len(self._chunk_cache) > 1:
+                _, evicted = self._chunk_cache.popitem(last=False)
+                self._chunk_cache_bytes -= evicted.nbytes
+        return chunk
+
+    def read(self, box: tuple[int, int, int, int]) -> np.ndarray:
+        """Окно ``(left, top, right, bottom)`` в исходном типе, форма (H, W, каналы)."""
+        left, top, right, bottom = box
+        if self._plane is not None:
+            return self._plane[top:bottom, left:right]
+        out = np.empty((bottom - top, right - left, self.samples), dtype=self.dtype)
+        first_row, last_row = top // self.chunk_height, (bottom - 1) // self.chunk_height
+        first_col, last_col = left // self.chunk_width, (right - 1) // self.chunk_width
+        for chunk_row in range(first_row, last_row + 1):
+            for chunk_col in range(first_col, last_col + 1):
+                chunk = self._chunk(chunk_row * self._chunks_across + chunk_col)
+                y0, x0 = chunk_row * self.chunk_height, chunk_col * self.chunk_width
+                ya, yb = max(top, y0), min(bottom, y0 + chunk.shape[0])
+                xa, xb = max(left, x0), min(right, x0 + self.chunk_width)
+                out[ya - top:yb - top, xa - left:xb - left] = chunk[ya - y0:yb - y0, xa - x0:xb - x0]
+        return out
+
+    def read_bands(self, box: tuple[int, int, int, int]) -> np.ndarray:
+        """Окно в форме (каналы, H, W) — представление без копирования каналов."""
+        return self.read(box).transpose(2, 0, 1)
+
+    def _to_display(self, window: np.ndarray) -> np.ndarray:
+        # Каналы показа в 8 бит: диапазон значений растра растягивается на 0–255
+        low, high = self.value_range()
+        scaled = window[:, :, list(self.bands)].astype(np.float32)
+        scaled -= low
+        scaled *= 255 / max(high - low, np.finfo(np.float32).tiny)
+        scaled += 0.5
+        np.nan_to_num(scaled, copy=False, nan=0.0)
+        return np.clip(scaled, 0, 255, out=scaled).astype(np.uint8)
+
+    def _to_rgb(self, window: np.ndarray) -> Image.Image:
+        if self.high_bit:
+            window = self._to_display(window)
+            if window.shape[2] < 3:
+                return Image.fromarray(window[:, :, 0]).convert('RGB')
+            return Image.fromarray(window)
+        if self.samples < 3:
+            return Image.fromarray(np.ascontiguousarray(window[:, :, 0])).convert('RGB')
+        if self.rgb == (0, 1, 2):
+            return Image.fromarray(np.ascontiguousarray(window[:, :, :3]))
+        return Image.fromarray(window[:, :, list(self.rgb)])
+
+    def crop(self, box: tuple[int, int, int, int]) -> Image.Image:
+        return self._to_rgb(self.read(box))
+
+    def to_image(self) -> Image.Image:
+        """Полное декодирование — только там, где без него не обойтись."""
+        return self.crop((0, 0, self.width, self.height))
+
+
+class DecodedRaster(TiffRaster):
+    """Уже декодированный снимок глубже 8 бит — массив (H, W[, каналы]) в собственном типе."""
+
+    def __init__(self, array: np.ndarray, rgb: tuple[int, int, int] = (0, 1, 2)):
+        if array.ndim == 2:
+            array = array[:, :, np.newaxis]
+        self.height, self.width, self.samples = array.shape
+        self.dtype = array.dtype
+        self.rgb = rgb if self.samples > max(rgb) else (0, 1, 2)
+        self._plane = array
+        self._range = None
+        self._mapped = False
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._plane.nbytes
+
+
+def open_tiff(buffer, mapped: bool = False, rgb: tuple[int, int, int] = (0, 1, 2)) -> TiffRaster | None:
+    """Растр с оконным доступом или ``None``, если формат не поддерживается.
+
+    ``rgb`` — номера каналов многоканального растра для показа.
+    """
+    header = bytes(buffer[:4])
+    if header[:2] == b'II':
+        byteorder = '<'
+    elif header[:2] == b'MM':
+        byteorder = '>'
+    else:
+        return None
+    try:
+        tags = _read_ifd(buffer, byteorder)
+    except (ValueError, struct.error):
+        return None
+    samples = tags.get(SAMPLES_PER_PIXEL, (1,))[0]
+    bits = set(tags.get(BITS_PER_SAMPLE, (1,)))
+    sample_format = tags.get(SAMPLE_FORMAT, (1,))[0]
+    supported = (
+        IMAGE_WIDTH in tags and IMAGE_LENGTH in tags
+        # Одна разрядность на все каналы: целые 8/16/32 бит или float32/float64
+        and sample_format in _SAMPLE_KINDS
+        and len(bits) == 1 and bits <= set(_SAMPLE_KINDS[sample_format][1])
+        and tags.get(PLANAR_CONFIG, (1,))[0] == 1
+        and (tags.get(COMPRESSION, (COMPRESSION_NONE,))[0] == COMPRESSION_NONE
+             or tags[COMPRESSION][0] in COMPRESSION_DEFLATE)
+        # Горизонтальный предиктор — только для целых; плавающий (3) не поддерживается
+        and (tags.get(PREDICTOR, (1,))[0] == 1 or tags[PREDICTOR][0] == 2 and sample_format != 3)
+        # Оттенки серого и многоканальные растры, RGB; альфа — только неассоциированная
+        and (tags.get(PHOTOMETRIC, (1,))[0] == 1
+             or samples >= 3 and tags[PHOTOMETRIC][0] == 2)
+        and 1 not in tags.get(EXTRA_SAMPLES, ())
+        and (TILE_OFFSETS in tags or STRIP_OFFSETS in tags)
+    )
+    if not supported:
+        return None
+    return TiffRaster(buffer, tags, byteorder, mapped=mapped, rgb=rgb)
+
+
+def open_tiff_path(path, rgb: tuple[int, int, int] = (0, 1, 2)) -> TiffRaster | None:
+    """Растр из файла на диске через ``mmap``: загрузка без чтения данных."""
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return open_tiff(mapped, mapped=True, rgb=rgb)
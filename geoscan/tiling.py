@@ -0,0 +1,130 @@
+"""Потайловое вычисление разницы и статистики для снимков больше памяти.
+
+Разница считается поточечными ядрами, поэтому карта изменений совпадает
+побитово при любом размере тайла. Статистика накапливается гистограммой,
+а карта изменений пишется в файл, отображённый в память, — пиковое
+потребление зависит от размера тайла, а не от размера сцены.
+
+Это верно только для несжатого или поблочно сжатого TIFF, который
+читается окнами. PNG, JPEG и прочие форматы PIL декодирует целиком, так
+что для них пик памяти по-прежнему растёт с размером сцены — по тайлам
+считается лишь разница.
+"""
+from __future__ import annotations
+
+import tempfile
+from typing import Callable, Iterator
+
+import numpy as np
+from PIL import Image, ImageChops
+
+from .stats import DiffStats, StatsAccumulator
+
+# Размер стороны тайла по умолчанию, пикселей
+DEFAULT_TILE_SIZE = 1024
+
+# Начиная с такого числа пикселей сцена автоматически считается по тайлам
+TILED_MIN_PIXELS = 16_000_000
+
+# Веса яркости ITU-R 601-2, как в PIL ``convert('L')``
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+Box = tuple[int, int, int, int]
+Kernel = Callable[[object, object, 'Box'], np.ndarray]
+
+
+def iter_tiles(width: int, height: int, tile_size: int) -> Iterator[Box]:
+    """Окна ``(left, top, right, bottom)`` построчно слева направо."""
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            yield left, top, min(left + tile_size, width), min(top + tile_size, height)
+
+
+def tile_count(width: int, height: int, tile_size: int) -> int:
+    return -(-width // tile_size) * -(-height // tile_size)
+
+
+def window(image, box: Box):
+    """Окно источника; целый кадр PIL-изображения отдаётся без копии."""
+    if isinstance(image, Image.Image) and box == (0, 0) + image.size:
+        return image
+    return image.crop(box)
+
+
+def diff_tile(image1, image2, box: Box) -> np.ndarray:
+    """8-битная разница яркости окна ``box``; источники — PIL-изображения или растры с ``crop``."""
+    tile = ImageChops.difference(window(image1, box), window(image2, box)).convert('L')
+    return np.asarray(tile)
+
+
+def precise_tile(image1, image2, box: Box) -> np.ndarray:
+    """Разница по каналам в float32, сведённая в яркость без промежуточного округления."""
+    before = np.asarray(window(image1, box), dtype=np.float32)
+    after = np.asarray(window(image2, box), dtype=np.float32)
+    np.subtract(before, after, out=before)
+    np.abs(before, out=before)
+    return before @ LUMA_WEIGHTS
+
+
+class NativeKernel:
+    """Разница растров глубже 8 бит в их собственном типе, сведённая в яркость.
+
+    |Δ| каналов считается в расширенном типе (``np.promote_types`` с
+    float32: 8- и 16-битные отсчёты в нём точны, 32-битные и float64 —
+    в float64) и переводится в шкалу карты: 255 — это ``span`` единиц
+    данных, диапазон значений пары. Источники — растры с ``read_bands``.
+    """
+
+    def __init__(self, span: float, bands: tuple[int, ...]):
+        self.span = span
+        self.bands = bands
+        self.weights = LUMA_WEIGHTS if len(bands) == 3 else np.ones(len(bands), dtype=np.float32)
+
+    def __call__(self, raster1, raster2, box: Box) -> np.ndarray:
+        bands1, bands2 = raster1.read_bands(box), raster2.read_bands(box)
+        wide = np.promote_types(bands1.dtype, np.float32)
+        out = np.zeros(bands1.shape[1:], dtype=wide)
+        scratch = np.empty_like(out)
+        for band, weight in zip(self.bands, self.weights):
+            np.subtract(bands1[band], bands2[band], out=scratch, dtype=wide)
+            np.abs(scratch, out=scratch)
+            scratch *= weight
+            out += scratch
+        out *= 255 / self.span
+        # Нет данных (NaN) хотя бы в одном снимке — не изменение
+        np.nan_to_num(out, copy=False, nan=0.0)
+        return out.astype(np.float32, copy=False)
+
+
+def change_map(width: int, height: int, dtype=np.uint8) -> np.memmap:
+    """Карта изменений во временном файле, отображённом в память."""
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=(height, width))
+
+
+def whole_difference(image1, image2, kernel: Kernel = diff_tile) -> tuple[np.ndarray, DiffStats]:
+    """Карта изменений и статистика за один вызов ядра на весь кадр."""
+    diff_array = kernel(image1, image2, (0, 0) + image1.size)
+    accumulator = StatsAccumulator()
+    accumulator.add(diff_array)
+    return diff_array, accumulator.result()
+
+
+def tiled_difference(image1, image2, tile_size: int, kernel: Kernel = diff_tile, dtype=np.uint8,
+                     on_tile: Callable[[int, int], None] | None = None) -> tuple[np.ndarray, DiffStats]:
+    """Карта изменений и её статистика, посчитанные по тайлам.
+
+    ``on_tile(done, total)`` вызывается после каждого тайла.
+    """
+    width, height = image1.size
+    out = change_map(width, height, dtype)
+    accumulator = StatsAccumulator()
+    total = tile_count(width, height, tile_size)
+    for done, box in enumerate(iter_tiles(width, height, tile_size), start=1):
+        tile = kernel(image1, image2, box)
+        left, top, right, bottom = box
+        out[top:bottom, left:right] = tile
+        accumulator.add(tile)
+        if on_tile is not None:
+            on_tile(done, total)
+    out.flush()
+    return out, accumulator.result()
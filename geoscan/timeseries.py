@@ -0,0 +1,249 @@
+"""Временной ряд снимков: последовательные и накопленные карты изменений.
+
+Каждый снимок ряда декодируется и совмещается с первым один раз.
+Карта шага ``k`` — разница снимков ``k − 1`` и ``k``; накопленная карта —
+поточечный максимум последовательных карт до шага ``k`` включительно
+(«где хоть раз что-то менялось»). Она обновляется на месте тем же проходом
+по тайлам, что и последовательная, поэтому добавление снимка в конец ряда
+стоит одного декодирования и одной разницы.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, replace
+from datetime import date
+
+import numpy as np
+from PIL import Image
+
+from .engine import (
+    AnalysisParams,
+    align,
+    check_spectral,
+    content_hash,
+    decode,
+    difference,
+    estimate_bytes,
+    native_kernel,
+    native_raster,
+    resolve_tile_size,
+    select_kernel,
+)
+from .modes import MODES
+from .progress import ProgressReporter
+from .pyramid import OVERVIEW_MAX_SIDE, Pyramid, decimate, fit_factor
+from .radiometry import Remapped, fit_lut, remap
+from .registration import Registration, register, translate
+from .spectral import BAND_MAPS, INDICES, SpectralKernel
+from .stats import DiffStats, StatsAccumulator
+from .tiling import Box, change_map
+
+# Дата в имени файла: 2024-05-31, 2024_05_31 или 20240531
+_DATE_PATTERN = re.compile(r'(\d{4})[-_.]?(\d{2})[-_.]?(\d{2})')
+
+
+def scene_label(name: str) -> str:
+    """Дата снимка из имени файла (ISO) или само имя, если даты в нём нет."""
+    match = _DATE_PATTERN.search(name)
+    if match:
+        try:
+            return date(*map(int, match.groups())).isoformat()
+        except ValueError:
+            pass
+    return name
+
+
+@dataclass
+class Frame:
+    """Снимок ряда: декодированный источник, снимок для показа и рабочий уровень, совмещённые с первым."""
+
+    key: str
+    label: str
+    # Как декодирован, до совмещения и нормализации: ряд пересобирается из него
+    source: object
+    image: object
+    work: object
+    overview: Pyramid
+
+
+@dataclass
+class Step:
+    """Изменения между снимком ``index − 1`` и ``index``."""
+
+    index: int
+    label: str
+    consecutive: DiffStats
+    cumulative: DiffStats
+    overview_consecutive: Pyramid
+    overview_cumulative: Pyramid
+    # Сдвиг снимка ``index`` относительно первого снимка ряда
+    registration: Registration | None = None
+
+    @property
+    def change_percent(self) -> float:
+        return (self.consecutive.mean / 255.0) * 100
+
+    @property
+    def cumulative_percent(self) -> float:
+        return (self.cumulative.mean / 255.0) * 100
+
+
+class CumulativeKernel:
+    """Обёртка ядра: попутно поднимает накопленную карту до максимума и считает её статистику."""
+
+    def __init__(self, kernel, cumulative: np.ndarray):
+        self.kernel = kernel
+        self.cumulative = cumulative
+        self.accumulator = StatsAccumulator()
+
+    def __call__(self, image1, image2, box: Box) -> np.ndarray:
+        tile = self.kernel(image1, image2, box)
+        left, top, right, bottom = box
+        running = self.cumulative[top:bottom, left:right]
+        np.maximum(running, tile, out=running)
+        self.accumulator.add(running)
+        return tile
+
+
+def snapshot_overview(diff_array: np.ndarray, scale: int) -> Pyramid:
+    """Обзор карты, не связанный с её буфером: накопленная карта дальше меняется на месте."""
+    image = Image.fromarray(diff_array)
+    factor = fit_factor(image.size, OVERVIEW_MAX_SIDE)
+    top = decimate(image, factor) if factor > 1 else image.copy()
+    return Pyramid.build(top, scale=scale * factor)
+
+
+class SceneStack:
+    """Упорядоченный ряд снимков с пошаговыми картами изменений.
+
+    Выравнивание — по размеру первого снимка; в быстром режиме ряд
+    считается на прореженном уровне, без скрининга. Результаты общие для
+    всех перезапусков сессии — не изменять снаружи.
+    """
+
+    def __init__(self, params: AnalysisParams | None = None):
+        self.params = params or AnalysisParams()
+        self.frames: list[Frame] = []
+        self.steps: list[Step] = []
+        self.cumulative: np.ndarray | None = None
+        self.scale = 1
+        # Шкала карт растров глубже 8 бит, единиц данных на 255; задаётся первым шагом
+        self.span: float | None = None
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def append(self, data, label: str, key: str | None = None,
+               progress: ProgressReporter | None = None) -> Step | None:
+        """Добавляет снимок в конец ряда; для второго и следующих возвращает новый шаг."""
+        progress = progress or ProgressReporter()
+        progress.stage('decode')
+        max_side = MODES[self.params.mode].max_side if not self.params.index else None
+        image = decode(data, BAND_MAPS[self.params.bands].rgb, max_side)
+        return self._add(image, label, key or content_hash(data), progress)
+
+    def sync(self, sources: list[tuple[str, object]], progress_factory=None,
+             pool=None, on_wait=None, keys: list[str] | None = None) -> int:
+        """Приводит ряд к списку ``(подпись, данные)``; возвращает число декодированных снимков.
+
+        Общее начало ряда сохраняется, и в обычном случае — новые снимки в
+        конце — считаются только они. Если ряд разошёлся раньше конца,
+        накопленная карта пересчитывается по уже декодированным снимкам
+        общего начала. С ``pool`` каждый новый снимок ждёт допуска в
+        ``geoscan.admission.AnalysisPool`` как пара с первым снимком ряда.
+        ``keys`` — уже известные ``content_hash`` снимков.
+        """
+        keys = keys or [content_hash(data) for _, data in sources]
+        common = 0
+        while common < min(len(keys), len(self.frames)) and self.frames[common].key == keys[common]:
+            common += 1
+        if common < len(self.frames):
+            self._truncate(common)
+        for position in range(common, len(sources)):
+            label, data = sources[position]
+            progress = progress_factory(position, len(sources)) if progress_factory else None
+            if pool is None:
+                self.append(data, label, keys[position], progress)
+            else:
+                cost = estimate_bytes(sources[0][1], data, self.params)
+                pool.run(self.append, data, label, keys[position], progress, cost=cost, on_wait=on_wait)
+        return len(sources) - common
+
+    def _add(self, image, label: str, key: str, progress: ProgressReporter) -> Step | None:
+        mode = MODES[self.params.mode]
+        spectral = None
+        if self.params.index:
+            spectral = SpectralKernel(INDICES[self.params.index], BAND_MAPS[self.params.bands])
+
+        progress.stage('align')
+        if not self.frames:
+            if spectral is not None:
+                check_spectral(image, image, spectral)
+            self.scale = fit_factor(image.size, mode.max_side) if mode.max_side and spectral is None else 1
+            work = decimate(image, self.scale)
+            self.frames.append(Frame(key, label, image, image, work, self._overview(image, work)))
+            return None
+        source = image
+        previous, reference = self.frames[-1], self.frames[0].work
+        if spectral is not None:
+            check_spectral(self.frames[0].image, image, spectral)
+        if (native_raster(image) is None) != (native_raster(self.frames[0].source) is None):
+            # Иначе шаг молча ушёл бы в 8-битную шкалу, а накопленная карта смешала бы шкалы
+            depth = '8 бит' if native_raster(image) is None else 'глубже 8 бит'
+            raise ValueError(f'Снимок {label} ({depth}) отличается разрядностью от первого снимка ряда '
+                             f'{self.frames[0].label}: в ряду нужны снимки одной разрядности')
+        work = align(reference, decimate(image, self.scale), self.params)
+        if self.params.normalize and spectral is None:
+            # Радиометрия каждого снимка приводится к первому, как и геометрия
+            lut = fit_lut(reference, work, self.params.normalize)
+            work = remap(work, lut)
+            if self.scale > 1:
+                image = Remapped(image, lut)
+        registration = None
+        if self.params.register:
+            # Каждый снимок совмещается с первым, чтобы весь ряд был в одной геометрии
+            registration = register(reference, work).scaled(self.scale)
+            work = translate(work, reference, registration, self.scale)
+        if self.scale == 1:
+            image = work
+        frame = Frame(key, label, source, image, work, self._overview(image, work))
+
+        progress.stage('diff')
+        native = native_kernel(previous.work, work, self.span) if spectral is None else None
+        if native is not None:
+            # Все шаги в одной шкале, иначе накопленная карта смешала бы разные
+            self.span = native.span
+        kernel, dtype = select_kernel(mode, spectral, native)
+        if self.cumulative is None:
+            width, height = reference.size
+            tiled = resolve_tile_size(reference, work, self.params.tile_size)
+            self.cumulative = change_map(width, height, dtype) if tiled else np.zeros((height, width), dtype)
+        cumulative = CumulativeKernel(kernel, self.cumulative)
+        diff_array, consecutive = difference(previous.work, work, cumulative, dtype, self.params.tile_size, progress)
+
+        progress.stage('stats')
+        weight = self.scale * self.scale
+        span = native.span if native is not None else consecutive.span
+        step = Step(
+            index=len(self.frames),
+            label=label,
+            consecutive=replace(consecutive, weight=weight, span=span),
+            cumulative=replace(cumulative.accumulator.result(weight), span=span),
+            overview_consecutive=Pyramid.build(Image.fromarray(diff_array), scale=self.scale),
+            overview_cumulative=snapshot_overview(self.cumulative, self.scale),
+            registration=registration,
+        )
+        self.frames.append(frame)
+        self.steps.append(step)
+        return step
+
+    def _overview(self, image, work) -> Pyramid:
+        return Pyramid.build(image, top=work if self.scale > 1 else None)
+
+    def _truncate(self, length: int) -> None:
+        kept = self.frames[:length]
+        self.frames, self.steps, self.cumulative, self.span = [], [], None, None
+        # Накопленная карта не откатывается на месте: шаги общего начала
+        # пересчитываются заново из декодированных источников, без повторного декодирования
+        for frame in kept:
+            self._add(frame.source, frame.label, frame.key, ProgressReporter())
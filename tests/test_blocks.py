@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from geoscan import blocks
+from geoscan.blocks import block_grid
+
+
+def naive_grid(diff_array, block, level):
+    height, width = diff_array.shape
+    rows, cols = -(-height // block), -(-width // block)
+    mean, peak, changed = (np.zeros((rows, cols)) for _ in range(3))
+    for row in range(rows):
+        for col in range(cols):
+            cell = diff_array[row * block:(row + 1) * block, col * block:(col + 1) * block].astype(np.float64)
+            mean[row, col] = cell.mean()
+            peak[row, col] = cell.max()
+            changed[row, col] = (cell > level).mean()
+    return mean, peak, changed
+
+
+def assert_grid(grid, diff, block, level):
+    mean, peak, changed = naive_grid(diff, block, level)
+    assert grid.mean.shape == mean.shape
+    np.testing.assert_allclose(grid.mean, mean, rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(grid.max, peak, rtol=1e-6)
+    np.testing.assert_allclose(grid.changed, changed, rtol=1e-6, atol=1e-9)
+
+
+@pytest.mark.parametrize('shape, block', [
+    ((64, 64), 16),
+    ((70, 53), 16),
+    ((33, 100), 7),
+    ((5, 9), 32),
+])
+def test_matches_per_block_loop(shape, block):
+    diff = np.random.default_rng(block).integers(0, 256, shape).astype(np.uint8)
+    grid = block_grid(diff, block_size=block, level=30)
+    assert grid.block_size == block
+    assert_grid(grid, diff, block, 30)
+
+
+def test_float_map(monkeypatch):
+    monkeypatch.setattr(blocks, 'STRIP_PIXELS', 40)
+    diff = (np.random.default_rng(7).random((41, 29)) * 255).astype(np.float32)
+    assert_grid(block_grid(diff, block_size=8, level=30), diff, 8, 30)
+
+
+@pytest.mark.parametrize('strip_pixels', [1, 100, 333])
+def test_strips_do_not_change_grid(monkeypatch, strip_pixels):
+    monkeypatch.setattr(blocks, 'STRIP_PIXELS', strip_pixels)
+    diff = np.random.default_rng(3).integers(0, 256, (57, 43)).astype(np.uint8)
+    assert_grid(block_grid(diff, block_size=10, level=30), diff, 10, 30)
+
+
+def test_scaled_map_uses_frame_block_size():
+    diff = np.random.default_rng(5).integers(0, 256, (30, 22)).astype(np.uint8)
+    grid = block_grid(diff, block_size=32, scale=4, level=30)
+    assert grid.block_size == 32
+    assert_grid(grid, diff, 8, 30)
@@ -0,0 +1,92 @@
+from collections import deque
+
+import numpy as np
+import pytest
+
+from geoscan import regions
+from geoscan.regions import find_regions
+
+
+def naive_regions(diff_array, level):
+    """Поиск в ширину по 8-соседям: (площадь, рамка, центр, среднее) каждой области."""
+    height, width = diff_array.shape
+    mask = diff_array > level
+    seen = np.zeros_like(mask)
+    found = []
+    for y0, x0 in zip(*np.nonzero(mask)):
+        if seen[y0, x0]:
+            continue
+        seen[y0, x0] = True
+        queue, pixels = deque([(y0, x0)]), []
+        while queue:
+            y, x = queue.popleft()
+            pixels.append((y, x))
+            for ny in range(max(0, y - 1), min(height, y + 2)):
+                for nx in range(max(0, x - 1), min(width, x + 2)):
+                    if mask[ny, nx] and not seen[ny, nx]:
+                        seen[ny, nx] = True
+                        queue.append((ny, nx))
+        ys, xs = np.array(pixels).T
+        found.append((
+            len(pixels), xs.min(), ys.min(), xs.max() + 1, ys.max() + 1,
+            round(xs.mean(), 6), round(ys.mean(), 6),
+            round(float(diff_array[ys, xs].astype(np.float64).mean()), 4),
+        ))
+    return sorted(found)
+
+
+def as_rows(result):
+    return sorted(zip(
+        result.area.tolist(), result.left.tolist(), result.top.tolist(),
+        result.right.tolist(), result.bottom.tolist(),
+        np.round(result.centroid_x, 6).tolist(), np.round(result.centroid_y, 6).tolist(),
+        np.round(result.mean.astype(np.float64), 4).tolist(),
+    ))
+
+
+def random_map(seed, shape, density):
+    rng = np.random.default_rng(seed)
+    diff = rng.integers(0, 256, shape).astype(np.uint8)
+    diff[rng.random(shape) > density] = 0
+    return diff
+
+
+@pytest.mark.parametrize('seed, shape, density', [
+    (0, (40, 50), 0.3),
+    (1, (33, 71), 0.45),
+    (2, (64, 17), 0.6),
+    (3, (1, 90), 0.5),
+])
+def test_matches_flood_fill(seed, shape, density):
+    diff = random_map(seed, shape, density)
+    result = find_regions(diff, level=30)
+    expected = naive_regions(diff, 30)
+    assert result.count == len(expected)
+    assert as_rows(result) == expected
+    assert np.all(np.diff(result.area) <= 0)
+
+
+@pytest.mark.parametrize('strip_pixels', [1, 50, 137])
+def test_strip_seams_merge(monkeypatch, strip_pixels):
+    # Узкие полосы режут области на каждой строке — после склейки результат тот же
+    monkeypatch.setattr(regions, 'STRIP_PIXELS', strip_pixels)
+    diff = random_map(4, (45, 60), 0.5)
+    assert as_rows(find_regions(diff, level=30)) == naive_regions(diff, 30)
+
+
+def test_float_map_strict_level():
+    diff = np.array([[0.0, 30.0, 30.5], [0.0, 0.0, 0.0], [31.0, 0.0, 0.0]], dtype=np.float32)
+    result = find_regions(diff, level=30)
+    assert result.count == 2
+    assert sorted(result.area.tolist()) == [1, 1]
+
+
+def test_scale_maps_to_frame():
+    diff = np.zeros((10, 12), dtype=np.uint8)
+    diff[2:4, 3:6] = 200
+    result = find_regions(diff, level=30, scale=4, frame_size=(46, 40))
+    assert result.count == 1
+    assert result.area[0] == 6 * 16
+    assert (result.left[0], result.top[0], result.right[0], result.bottom[0]) == (12, 8, 24, 16)
+    assert result.centroid_x[0] == pytest.approx(17.5)
+    assert result.centroid_y[0] == pytest.approx(11.5)
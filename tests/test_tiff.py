@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from geoscan.tiff import open_tiff, open_tiff_path
+
+WINDOWS = [(0, 0, 90, 70), (7, 5, 80, 66), (89, 69, 90, 70), (30, 15, 31, 60), (0, 31, 45, 33)]
+
+
+def save(tmp_path, array, **options):
+    path = tmp_path / 'scene.tif'
+    Image.fromarray(array).save(path, **options)
+    return path
+
+
+def rgb_scene():
+    return np.random.default_rng(0).integers(0, 256, (70, 90, 3), dtype=np.uint8)
+
+
+def gray16_scene():
+    return np.random.default_rng(1).integers(0, 65536, (70, 90), dtype=np.uint16)
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'compression': 'tiff_adobe_deflate'},
+    {'compression': 'tiff_adobe_deflate', 'tiffinfo': {278: 16}},
+    {'compression': 'tiff_adobe_deflate', 'tiffinfo': {278: 7, 317: 2}},
+])
+@pytest.mark.parametrize('scene', [rgb_scene, gray16_scene])
+def test_read_matches_pillow(tmp_path, scene, options):
+    path = save(tmp_path, scene(), **options)
+    expected = np.asarray(Image.open(path))
+    if expected.ndim == 2:
+        expected = expected[:, :, None]
+    for mapped, raster in ((True, open_tiff_path(path)), (False, open_tiff(path.read_bytes()))):
+        assert raster is not None, mapped
+        assert raster.size == (90, 70)
+        assert raster.dtype == expected.dtype
+        for left, top, right, bottom in WINDOWS:
+            window = raster.read((left, top, right, bottom))
+            np.testing.assert_array_equal(window, expected[top:bottom, left:right])
+
+
+def test_crop_matches_pillow(tmp_path):
+    path = save(tmp_path, rgb_scene(), compression='tiff_adobe_deflate', tiffinfo={278: 9})
+    raster = open_tiff_path(path)
+    with Image.open(path) as reference:
+        for box in WINDOWS:
+            crop = raster.crop(box)
+            assert crop.mode == 'RGB'
+            np.testing.assert_array_equal(np.asarray(crop), np.asarray(reference.crop(box)))
+
+
+def test_unsupported_compression_falls_back(tmp_path):
+    path = save(tmp_path, rgb_scene(), compression='tiff_lzw')
+    assert open_tiff(path.read_bytes()) is None
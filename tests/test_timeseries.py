@@ -0,0 +1,74 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from geoscan.engine import AnalysisParams
+from geoscan.timeseries import SceneStack
+
+SHIFTS = [(0, 0, 1.0), (5, 3, 0.9), (-2, 4, 1.1), (3, -1, 0.95)]
+
+
+def scene_bytes(base, dx, dy, gain, mode='RGB', fmt='PNG'):
+    array = np.roll(base, (dy, dx), axis=(0, 1)).astype(np.float32) * gain
+    image = Image.fromarray(np.clip(array, 0, 255).astype(np.uint8)).convert(mode)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope='module')
+def scenes():
+    rng = np.random.default_rng(0)
+    base = (rng.random((64, 80)) * 255).astype(np.uint8)
+    base = np.asarray(Image.fromarray(base).resize((320, 256), Image.BILINEAR))
+    return [(f'scene {index}', scene_bytes(base, *shift)) for index, shift in enumerate(SHIFTS)]
+
+
+def summary(stack):
+    return [(
+        step.label,
+        step.registration.offset if step.registration else None,
+        round(step.change_percent, 6),
+        round(step.cumulative_percent, 6),
+        step.consecutive.histogram.tolist(),
+        step.cumulative.histogram.tolist(),
+    ) for step in stack.steps]
+
+
+@pytest.mark.parametrize('normalize', [None, 'linear'])
+def test_reorder_matches_fresh_stack(scenes, normalize):
+    params = AnalysisParams.for_mode('standard', register=True, normalize=normalize)
+    fresh = SceneStack(params)
+    fresh.sync(scenes)
+
+    stack = SceneStack(params)
+    stack.sync(scenes)
+    assert stack.sync([scenes[0], scenes[1], scenes[3], scenes[2]]) == 2
+    assert stack.sync(scenes) == 2
+    assert summary(stack) == summary(fresh)
+    assert [step.registration.offset for step in fresh.steps] == [(5, 3), (-2, 4), (3, -1)]
+
+
+def test_truncate_then_append(scenes):
+    params = AnalysisParams.for_mode('standard', register=True)
+    fresh = SceneStack(params)
+    fresh.sync(scenes[:3])
+
+    stack = SceneStack(params)
+    stack.sync(scenes)
+    assert stack.sync(scenes[:3]) == 0
+    assert len(stack) == 3
+    assert summary(stack) == summary(fresh)
+
+
+def test_mixed_bit_depth_rejected(scenes, tmp_path):
+    wide = np.full((256, 320), 1000, dtype=np.uint16)
+    buffer = io.BytesIO()
+    Image.fromarray(wide).save(buffer, 'TIFF')
+    stack = SceneStack(AnalysisParams.for_mode('standard'))
+    stack.sync(scenes[:2])
+    with pytest.raises(ValueError):
+        stack.sync(scenes[:2] + [('wide', buffer.getvalue())])
+    assert len(stack) == 2